@@ -0,0 +1,164 @@
+#!/usr/bin/env python
+
+# Offline benchmark of the bundled gesture models on the recorded datasets.
+#
+# Every model is run over each dataset that shares its labels (the hand
+# models over new_data/hand and old_data, the leg model over new_data/leg)
+# and reports accuracy, per-class precision/recall, the confusion matrix,
+# single-window latency percentiles, batched throughput and peak memory.
+#   python benchmark_models.py [model.h5 ...]
+# Results are printed as tables and saved to BENCH_JSON.
+
+import json
+import os
+import resource
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+import imu_dataset
+import numpy_model
+
+DATASETS = {
+    'new_data/hand': os.path.join('new_data', 'hand'),
+    'new_data/leg': os.path.join('new_data', 'leg'),
+    'old_data': 'old_data',
+}
+BATCH_SIZES = [int(n) for n in os.getenv('BENCH_BATCH_SIZES', '1,8,32,128').split(',')]
+LATENCY_RUNS = int(os.getenv('BENCH_RUNS', '1000'))
+THROUGHPUT_SECONDS = float(os.getenv('BENCH_SECONDS', '1'))
+BENCH_JSON = os.getenv('BENCH_JSON', 'benchmark_results.json')
+
+
+def evaluate(probabilities, labels, classes):
+    predicted = np.array(classes)[probabilities.argmax(axis=1)]
+    confusion = np.zeros((len(classes), len(classes)), dtype=int)
+    index = {label: i for i, label in enumerate(classes)}
+    np.add.at(confusion, ([index[label] for label in labels], [index[label] for label in predicted]), 1)
+
+    perClass = {}
+    for i, label in enumerate(classes):
+        support = int(confusion[i].sum())
+        if support == 0 and confusion[:, i].sum() == 0:
+            continue
+        perClass[label] = {
+            'precision': float(confusion[i, i] / confusion[:, i].sum()) if confusion[:, i].sum() else 0.0,
+            'recall': float(confusion[i, i] / support) if support else 0.0,
+            'support': support,
+        }
+    return {
+        'windows': len(labels),
+        'accuracy': float(np.mean(predicted == labels)),
+        'per_class': perClass,
+        'classes': list(classes),
+        'confusion': confusion.tolist(),
+    }
+
+
+def single_window_latency(model, inputs):
+    single = np.empty((1,) + model.input_shape, dtype=np.float32)
+    model.predict(inputs[:1])
+    timings = np.empty(LATENCY_RUNS)
+    for i in range(LATENCY_RUNS):
+        single[0] = inputs[i % len(inputs)]
+        start = time.perf_counter()
+        model.predict(single)
+        timings[i] = time.perf_counter() - start
+    return {
+        'p50_us': float(np.percentile(timings, 50) * 1e6),
+        'p99_us': float(np.percentile(timings, 99) * 1e6),
+        'mean_us': float(timings.mean() * 1e6),
+    }
+
+
+# windows per second, scaling included, for each batch size
+def batched_throughput(model, windows):
+    throughput = {}
+    for size in BATCH_SIZES:
+        batch = windows[np.arange(size) % len(windows)]
+        inputs = np.empty((size,) + model.input_shape, dtype=np.float32)
+        model.predict(numpy_model.scale_into(batch, inputs))
+        count = 0
+        start = time.perf_counter()
+        while time.perf_counter() - start < THROUGHPUT_SECONDS:
+            model.predict(numpy_model.scale_into(batch, inputs))
+            count += size
+        throughput[size] = count / (time.perf_counter() - start)
+    return throughput
+
+
+# peak Python heap (NumPy buffers included) to load the model and run the largest batch
+def peak_memory(path, windows):
+    tracemalloc.start()
+    model, _ = numpy_model.load_bundled(path)
+    size = max(BATCH_SIZES)
+    inputs = np.empty((size,) + model.input_shape, dtype=np.float32)
+    model.predict(numpy_model.scale_into(windows[np.arange(size) % len(windows)], inputs))
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak
+
+
+def benchmark(path):
+    model, classes = numpy_model.load_bundled(path)
+    samples = model.input_shape[0] // imu_dataset.IMU_AXES
+    result = {'classes': classes, 'datasets': {}}
+
+    windows = None
+    for name, data_dir in DATASETS.items():
+        dataWindows, labels = imu_dataset.load_dir(data_dir, samples)
+        known = np.isin(labels, classes)
+        if not known.any():
+            continue
+        inputs = numpy_model.scale_into(dataWindows[known], np.empty((known.sum(),) + model.input_shape, dtype=np.float32))
+        result['datasets'][name] = evaluate(model.predict(inputs), labels[known], classes)
+        result['datasets'][name]['skipped'] = int((~known).sum())
+        if windows is None:
+            windows = dataWindows[known]
+            result['latency'] = single_window_latency(model, inputs)
+
+    result['throughput'] = batched_throughput(model, windows)
+    result['peak_memory_bytes'] = peak_memory(path, windows)
+    return result
+
+
+def print_report(path, result):
+    print(f'\n=== {path} ===')
+    latency = result['latency']
+    print(f"Single window: p50 {latency['p50_us']:.1f} us  p99 {latency['p99_us']:.1f} us")
+    print('Throughput:  ' + '  '.join(f'batch {size}: {rate:,.0f}/s' for size, rate in result['throughput'].items()))
+    print(f"Peak memory: {result['peak_memory_bytes'] / 1024:.0f} KiB")
+
+    for name, metrics in result['datasets'].items():
+        skipped = f", {metrics['skipped']} skipped (unknown labels)" if metrics['skipped'] else ''
+        print(f"\n{name}: accuracy {metrics['accuracy']:.4f} on {metrics['windows']} windows{skipped}")
+        print(f"{'class':16} {'precision':>9} {'recall':>7} {'support':>7}")
+        for label, row in metrics['per_class'].items():
+            print(f"{label:16} {row['precision']:9.4f} {row['recall']:7.4f} {row['support']:7}")
+
+        # confusion matrix: rows are the true labels, columns the predictions
+        classes = metrics['classes']
+        print(f"{'':16}" + ''.join(f'{label[:5]:>6}' for label in classes))
+        for label, row in zip(classes, metrics['confusion']):
+            if sum(row):
+                print(f'{label:16}' + ''.join(f'{n:>6}' for n in row))
+
+
+if __name__ == '__main__':
+    paths = sys.argv[1:] or list(numpy_model.BUNDLED_MODELS)
+    results = {}
+    for path in paths:
+        results[path] = benchmark(path)
+        print_report(path, results[path])
+
+    results_json = {
+        'batch_sizes': BATCH_SIZES,
+        'latency_runs': LATENCY_RUNS,
+        'max_rss_kib': resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        'models': results,
+    }
+    with open(BENCH_JSON, 'w') as f:
+        json.dump(results_json, f, indent=4)
+    print(f'\nSaved {BENCH_JSON}')
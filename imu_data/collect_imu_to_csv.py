@@ -10,7 +10,7 @@ from bluepy.btle import BTLEDisconnectError
 import struct
 import myBle
 
-import csv
+import recording_store
 
 # Load environment variables from .env file
 load_dotenv()
@@ -40,6 +40,13 @@ print(f'[DEBUG] Player ID: {PLAYER_ID}')
 MAC_ADDR = os.getenv(f'{DEVICE}_P{PLAYER_ID}')
 print(f'[DEBUG] MAC Address: {MAC_ADDR}')
 
+# Takes are appended to a binary recording store, and each take of this
+# session is appended to the CSV as one row (an undo removes it again)
+RECORDING_STORE = os.getenv('RECORDING_STORE', f'recordings_{DEVICE.lower()}_p{PLAYER_ID}')
+CSV_PATH = f"{NAME_OF_ACTION}_{PLAYER_ID}.csv"
+store = recording_store.RecordingStore(RECORDING_STORE, IMU_SAMPLES)
+session = recording_store.SessionExport(store, CSV_PATH, NAME_OF_ACTION, PLAYER_ID)
+
 connectionStatus = {
     'isConnected': False,
 }
@@ -74,13 +81,11 @@ dataPacket = {
 
 dataPacketQueue = []
 
-def saveImuToCSV():
+def saveImu():
     if (dataPacket['imuCounter'] > 30):
-        with open(f"{NAME_OF_ACTION}_{PLAYER_ID}.csv", "a") as f:
-            csv_writer = csv.writer(f)
-            csv_writer.writerow([str(dataPacket["ax"]),str(dataPacket["ay"]),str(dataPacket["az"]),str(dataPacket["gx"]),str(dataPacket["gy"]),str(dataPacket["gz"])])
+        takeId = session.append([dataPacket["ax"], dataPacket["ay"], dataPacket["az"], dataPacket["gx"], dataPacket["gy"], dataPacket["gz"]])
+        print(f'>> Saved IMU take {takeId} ({NAME_OF_ACTION}) to {CSV_PATH}')
 
-    print(f'>> Saved IMU to {NAME_OF_ACTION}.csv')
     dataPacket['ax'] = [0] * IMU_SAMPLES
     dataPacket['ay'] = [0] * IMU_SAMPLES
     dataPacket['az'] = [0] * IMU_SAMPLES
@@ -90,11 +95,12 @@ def saveImuToCSV():
     dataPacket['isAllImuReceived'] = False
     dataPacket['imuCounter'] = 0  
 
-def deleteLastRow():
-    filepath = f"{NAME_OF_ACTION}_{PLAYER_ID}.csv"
-    os.system('sed -i "$ d" {0}'.format(filepath))
-
-    print('deleted last row')
+def deleteLastTake():
+    takeId = session.undo_last()
+    if takeId is None:
+        print('no take of this session to delete')
+        return
+    print(f'deleted take {takeId}')
 
 class ExtendedBLEConnection(myBle.BLEConnection):
     def appendImuData(self):
@@ -119,7 +125,7 @@ class ExtendedBLEConnection(myBle.BLEConnection):
             self.sendACK(seqReceived)
             if (shootPacket['seq'] != seqReceived):
                 shootPacket['seq']  = seqReceived
-                deleteLastRow()
+                deleteLastTake()
         
         elif (packetType == myBle.DATA):
             dataPacket['seq'] = self.device.delegate.seqReceived
@@ -145,7 +151,7 @@ class ExtendedBLEConnection(myBle.BLEConnection):
 
             dataPacket['isAllImuReceived'] = True
             self.imuSeq = 0
-            saveImuToCSV()
+            saveImu()
             
             print(f"[BLE] >> All IMU data is received.")
             
@@ -363,3 +369,7 @@ if __name__ == '__main__':
         glove_beetle_server.should_run = False
     except Exception as e:
         print(f'[ERROR] {e}')
+    finally:
+        print(f'>> {len(session.rows)} takes of this session in {CSV_PATH}')
+        session.close()
+        store.close()
@@ -9,5 +9,9 @@ module.exports = {
 				PLAYER_ID: 1,
 			},
 		},
+		// {
+		// 	name: "inference_service",
+		// 	script: "python -u inference_service.py",
+		// },
 	],
 };
@@ -0,0 +1,142 @@
+#!/usr/bin/env python
+
+# Augmentation of IMU windows for training.
+#
+# Each transform works on a whole int16 batch (n, 6, samples) at once and
+# draws its parameters from a seeded numpy Generator, so a run is
+# reproducible. augment_batches() streams augmented batches lazily; only one
+# batch is held in memory however many passes over the data are asked for:
+#   dataset = imu_dataset.Dataset('new_data/hand')
+#   for windows, labels in augment_batches(dataset.windows, dataset.labels, seed=0):
+#       ...
+
+import os
+import sys
+import time
+
+import numpy as np
+
+import imu_dataset
+
+INT16_MIN, INT16_MAX = -32768, 32767
+
+# transform -> strength, and the probability that a window gets it
+AUGMENTATIONS = {
+    'time_shift': (6, 0.5),      # samples
+    'time_warp': (0.2, 0.5),     # relative speed deviation
+    'scaling': (0.1, 0.5),       # std of the per-axis gain
+    'jitter': (200, 0.5),        # std of the added noise, raw units
+    'rotation': (0.25, 0.5),     # max rotation angle, radians
+    'dropout': (0.05, 0.5),      # share of samples zeroed
+}
+
+
+def time_shift(batch, strength, rng):
+    # shift every window by up to strength samples, filling with 0
+    n, _, samples = batch.shape
+    shift = rng.integers(-strength, strength + 1, size=n)
+    source = np.arange(samples) - shift[:, None]
+    valid = (source >= 0) & (source < samples)
+    shifted = np.take_along_axis(batch, np.clip(source, 0, samples - 1)[:, None, :], axis=2)
+    return np.where(valid[:, None, :], shifted, 0)
+
+
+def time_warp(batch, strength, rng, knots=4):
+    # resample along a smooth random monotonic time axis: the playback speed is
+    # drawn at a few knots and linearly interpolated to every sample
+    n, _, samples = batch.shape
+    knotSpeed = 1 + rng.uniform(-strength, strength, size=(n, knots))
+    grid = np.linspace(0, knots - 1, samples)
+    weights = np.maximum(0, 1 - np.abs(grid[:, None] - np.arange(knots)))
+    speed = knotSpeed @ weights.T
+    position = np.cumsum(speed, axis=1)
+    position = (position - position[:, :1]) * (samples - 1) / (position[:, -1:] - position[:, :1])
+
+    left = np.floor(position).astype(np.intp)
+    right = np.minimum(left + 1, samples - 1)
+    fraction = (position - left)[:, None, :]
+    before = np.take_along_axis(batch, left[:, None, :], axis=2)
+    after = np.take_along_axis(batch, right[:, None, :], axis=2)
+    return before + (after - before) * fraction
+
+
+def scaling(batch, strength, rng):
+    return batch * rng.normal(1, strength, size=batch.shape[:2] + (1,))
+
+
+def jitter(batch, strength, rng):
+    return batch + rng.normal(0, strength, size=batch.shape)
+
+
+def rotation(batch, strength, rng):
+    # the same small random 3D rotation of the accelerometer and gyroscope axes
+    n = len(batch)
+    axis = rng.normal(size=(n, 3))
+    axis /= np.linalg.norm(axis, axis=1, keepdims=True)
+    angle = rng.uniform(-strength, strength, size=(n, 1, 1))
+    cross = np.zeros((n, 3, 3))
+    cross[:, 0, 1], cross[:, 0, 2], cross[:, 1, 2] = -axis[:, 2], axis[:, 1], -axis[:, 0]
+    cross -= cross.transpose(0, 2, 1)
+    matrix = np.eye(3) + np.sin(angle) * cross + (1 - np.cos(angle)) * (cross @ cross)
+    return np.concatenate([matrix @ batch[:, :3], matrix @ batch[:, 3:]], axis=1)
+
+
+def dropout(batch, strength, rng):
+    # lost samples read as 0 on all axes, like packets that never arrived
+    keep = rng.random((len(batch), 1, batch.shape[2])) >= strength
+    return batch * keep
+
+
+TRANSFORMS = {
+    'time_shift': time_shift,
+    'time_warp': time_warp,
+    'scaling': scaling,
+    'jitter': jitter,
+    'rotation': rotation,
+    'dropout': dropout,
+}
+
+
+def augment(windows, rng, augmentations=AUGMENTATIONS):
+    # int16 (n, 6, samples) -> augmented int16 copy; each transform is applied to
+    # a random subset of the windows
+    batch = windows.astype(np.float64)
+    for name, (strength, probability) in augmentations.items():
+        mask = rng.random(len(batch)) < probability
+        if mask.any():
+            batch[mask] = TRANSFORMS[name](batch[mask], strength, rng)
+    return np.clip(np.rint(batch), INT16_MIN, INT16_MAX).astype(np.int16)
+
+
+def augment_batches(windows, labels, batch_size=256, factor=4, seed=0, augmentations=AUGMENTATIONS):
+    # factor shuffled passes over windows, each batch augmented as it is requested
+    rng = np.random.default_rng(seed)
+    for _ in range(factor):
+        order = rng.permutation(len(windows))
+        for start in range(0, len(order), batch_size):
+            index = np.sort(order[start:start + batch_size])
+            yield augment(windows[index], rng, augmentations), labels[index]
+
+
+if __name__ == '__main__':
+    # Throughput, and how well a model still recognises the augmented windows:
+    #   python imu_augment.py [data dir] [model.h5]
+    import numpy_model
+
+    data_dir = sys.argv[1] if len(sys.argv) > 1 else os.path.join('new_data', 'hand')
+    model_path = sys.argv[2] if len(sys.argv) > 2 else 'gesture_model_hand_augmented_59.h5'
+    dataset = imu_dataset.Dataset(data_dir)
+    model, classes = numpy_model.load_bundled(model_path)
+    samples = model.input_shape[0] // imu_dataset.IMU_AXES
+
+    count, correct, elapsed = 0, 0, 0
+    start = time.perf_counter()
+    for windows, labels in augment_batches(dataset.windows, dataset.labels, factor=2):
+        elapsed += time.perf_counter() - start
+        inputs = np.empty((len(windows),) + model.input_shape, dtype=np.float32)
+        predicted = np.array(classes)[model.predict(numpy_model.scale_into(windows[:, :, :samples], inputs)).argmax(axis=1)]
+        correct += np.sum(predicted == labels)
+        count += len(windows)
+        start = time.perf_counter()
+    print(f'Augmented {count} windows at {count / elapsed:,.0f} windows/s')
+    print(f'{model_path} accuracy on augmented windows: {correct / count:.4f}')
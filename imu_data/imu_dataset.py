@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+# Loading of the recorded IMU datasets in new_data/ and old_data/.
+#
+# Each CSV row is one window: six cells (ax, ay, az, gx, gy, gz), each a
+# stringified list of int16 samples. Windows are returned as int16 arrays of
+# shape (n, 6, samples), padded with 0 or truncated to the sample count a
+# model expects.
+#
+# A folder is parsed once and cached as a memory-mapped .npy (windows grouped
+# by class) plus a JSON index in IMU_CACHE_DIR. The cache is keyed by the
+# content hash of the CSVs, so it is rebuilt whenever one of them changes:
+#   dataset = Dataset('new_data/hand')
+#   dataset.windows, dataset.labels, dataset.by_class('bomb')
+
+import glob
+import hashlib
+import json
+import os
+
+import numpy as np
+
+IMU_AXES = 6
+CACHE_DIR = os.getenv('IMU_CACHE_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '.dataset_cache'))
+
+# bytes.translate table turning the list and CSV separators into blanks
+SEPARATORS_TO_BLANK = bytes(ord(' ') if chr(c) in '[]",\r\n' else c for c in range(256))
+
+
+def parse_csv(text):
+    # all cells of a CSV in one pass: the numbers between each '[' and ']'
+    # with the commas between them counted to find each cell's length
+    buf = np.frombuffer(text, dtype=np.uint8)
+    opens = np.flatnonzero(buf == ord('['))
+    closes = np.flatnonzero(buf == ord(']'))
+    if len(opens) != len(closes) or len(opens) % IMU_AXES:
+        raise ValueError(f'expected {IMU_AXES} list cells per row')
+    commas = np.cumsum(buf == ord(','))
+    lengths = np.where(closes - opens > 1, commas[closes] - commas[opens] + 1, 0)
+
+    values = np.fromstring(text.translate(SEPARATORS_TO_BLANK), dtype=np.int32, sep=' ')
+    if len(values) != lengths.sum():
+        raise ValueError('malformed list cell')
+
+    width = int(lengths.max()) if len(lengths) else 0
+    cells = np.zeros((len(lengths), width), dtype=np.int16)
+    starts = np.repeat(np.cumsum(lengths) - lengths, lengths)
+    rows = np.repeat(np.arange(len(lengths)), lengths)
+    cells[rows, np.arange(len(values)) - starts] = values
+    return cells.reshape(-1, IMU_AXES, width)
+
+
+def fit_samples(windows, samples):
+    # truncating is a view, padding has to copy
+    if windows.shape[2] >= samples:
+        return windows[:, :, :samples]
+    padded = np.zeros(windows.shape[:2] + (samples,), dtype=np.int16)
+    padded[:, :, :windows.shape[2]] = windows
+    return padded
+
+
+def load_csv(path, samples):
+    with open(path, 'rb') as f:
+        return fit_samples(parse_csv(f.read()), samples)
+
+
+# bowl_new_1.csv -> bowl
+def label_from_path(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    for suffix in ('_new_1', '_new'):
+        if name.endswith(suffix):
+            return name[:-len(suffix)]
+    return name
+
+
+class Dataset:
+    def __init__(self, data_dir, cache_dir=CACHE_DIR):
+        self.data_dir = data_dir
+        self.cache_dir = cache_dir
+        self.paths = sorted(glob.glob(os.path.join(data_dir, '*.csv')))
+        dirKey = hashlib.sha1(os.path.abspath(data_dir).encode()).hexdigest()[:12]
+        self.stat_path = os.path.join(cache_dir, f'{dirKey}.stat.json')
+
+        hashes = self.content_hashes()
+        key = hashlib.sha1(json.dumps(hashes).encode()).hexdigest()[:16]
+        self.windows_path = os.path.join(cache_dir, f'{dirKey}-{key}.npy')
+        self.index_path = os.path.join(cache_dir, f'{dirKey}-{key}.json')
+        if not (os.path.exists(self.windows_path) and os.path.exists(self.index_path)):
+            self.build(dirKey)
+
+        with open(self.index_path) as f:
+            self.index = json.load(f)
+        self.windows = np.load(self.windows_path, mmap_mode='r')
+        self.classes = list(self.index['classes'])
+        counts = [stop - start for start, stop in self.index['classes'].values()]
+        self.labels = np.repeat(np.array(self.classes), counts)
+
+    # name -> sha1 of every CSV; files whose size and mtime are unchanged since
+    # the last run are not hashed again
+    def content_hashes(self):
+        try:
+            with open(self.stat_path) as f:
+                known = json.load(f)
+        except (FileNotFoundError, json.JSONDecodeError):
+            known = {}
+        hashes, stats = {}, {}
+        for path in self.paths:
+            name = os.path.basename(path)
+            stat = os.stat(path)
+            entry = known.get(name)
+            if entry and entry['size'] == stat.st_size and entry['mtime_ns'] == stat.st_mtime_ns:
+                hashes[name] = entry['sha1']
+            else:
+                with open(path, 'rb') as f:
+                    hashes[name] = hashlib.sha1(f.read()).hexdigest()
+            stats[name] = {'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns, 'sha1': hashes[name]}
+        if stats != known:
+            os.makedirs(self.cache_dir, exist_ok=True)
+            write_atomic(self.stat_path, lambda f: f.write(json.dumps(stats).encode()))
+        return hashes
+
+    def build(self, dirKey):
+        print(f'[DEBUG] Building dataset cache for {self.data_dir}')
+        parsed = {}
+        for path in self.paths:
+            with open(path, 'rb') as f:
+                parsed.setdefault(label_from_path(path), []).append(parse_csv(f.read()))
+        samples = max((w.shape[2] for files in parsed.values() for w in files), default=0)
+
+        # windows grouped by class, so every class is one contiguous slice
+        classes, parts, start = {}, [], 0
+        for label in sorted(parsed):
+            for windows in parsed[label]:
+                parts.append(fit_samples(windows, samples))
+            stop = start + sum(len(w) for w in parsed[label])
+            classes[label] = (start, stop)
+            start = stop
+        windows = np.concatenate(parts) if parts else np.zeros((0, IMU_AXES, samples), dtype=np.int16)
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+        write_atomic(self.windows_path, lambda f: np.save(f, windows))
+        index = {'files': [os.path.basename(path) for path in self.paths], 'samples': samples, 'classes': classes}
+        write_atomic(self.index_path, lambda f: f.write(json.dumps(index, indent=4).encode()))
+
+        # drop the caches of earlier versions of this folder
+        for path in glob.glob(os.path.join(self.cache_dir, f'{dirKey}-*')):
+            if path not in (self.windows_path, self.index_path):
+                os.remove(path)
+
+    def by_class(self, label):
+        start, stop = self.index['classes'][label]
+        return self.windows[start:stop]
+
+    def __len__(self):
+        return len(self.windows)
+
+
+def write_atomic(path, write):
+    tmp = f'{path}.{os.getpid()}.tmp'
+    with open(tmp, 'wb') as f:
+        write(f)
+    os.replace(tmp, path)
+
+
+# all CSVs of a folder: windows (n, 6, samples) and a label per window
+def load_dir(data_dir, samples):
+    dataset = Dataset(data_dir)
+    return fit_samples(dataset.windows, samples), dataset.labels
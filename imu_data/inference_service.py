@@ -0,0 +1,280 @@
+#!/usr/bin/env python
+
+# Micro-batched inference service for IMU windows from all players and devices.
+#
+# Windows arrive on AI_QUEUE (with AI_SHARDING=1 on this worker's shard queue,
+# see ai_shards.py, and with IMU_SHM=1 also on the shared memory rings of
+# co-located relays). Requests for the same model that arrive within
+# BATCH_DEADLINE_MS of the oldest pending one are classified with a single
+# forward pass, then each result is published on its own. The added latency
+# per window is bounded by the deadline plus one batched forward pass.
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+from dotenv import load_dotenv
+import aio_pika
+import numpy as np
+
+import numpy_model
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'relay_to_external'))
+import ai_shards
+import latency_trace
+import priority_lanes
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Broker configurations
+BROKER = os.getenv('BROKER')
+BROKERUSER = os.getenv('BROKERUSER')
+PASSWORD = os.getenv('PASSWORD')
+RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', '5672'))
+
+# RabbitMQ queues
+AI_QUEUE = os.getenv('AI_QUEUE', 'ai_queue')
+UPDATE_GE_QUEUE = os.getenv('UPDATE_GE_QUEUE', 'update_ge_queue')
+
+# RabbitMQ exchanges
+UPDATE_PREDICTIONS_EXCHANGE = os.getenv('UPDATE_PREDICTIONS_EXCHANGE', 'update_predictions_exchange')
+
+# Batching
+BATCH_DEADLINE_MS = float(os.getenv('BATCH_DEADLINE_MS', '3'))
+MAX_BATCH = int(os.getenv('MAX_BATCH', '32'))
+PREFETCH = int(os.getenv('AI_PREFETCH', '64'))
+
+# Model per IMU device, one of numpy_model.BUNDLED_MODELS so its labels are known
+MODELS = {
+    'glove': os.getenv('GLOVE_MODEL', 'gesture_model_hand_augmented_59.h5'),
+    'leg': os.getenv('LEG_MODEL', 'gesture_model_real_leg.h5'),
+}
+
+# Predictions that are not game actions are only shown, not sent to the game engine
+IDLE_ACTIONS = {'stationary', 'shaking', 'stationary_leg', 'walk', 'run'}
+MIN_CONFIDENCE = float(os.getenv('MIN_CONFIDENCE', '0'))
+
+# Read windows of relays on this machine from shared memory as well
+IMU_SHM = os.getenv('IMU_SHM', '0') == '1'
+PLAYERS = [int(p) for p in os.getenv('PLAYERS', '1,2').split(',')]
+
+
+class MicroBatcher:
+    def __init__(self, device, model_path):
+        self.device = device
+        self.model, self.classes = numpy_model.load_bundled(model_path)
+        self.samples = self.model.input_shape[0] // 6
+        # preallocated int16 batch and scaled model input
+        self.windowBatch = np.zeros((MAX_BATCH, 6, self.samples), dtype=np.int16)
+        self.inputBatch = np.empty((MAX_BATCH,) + self.model.input_shape, dtype=np.float32)
+        self.deadline = BATCH_DEADLINE_MS / 1000
+        self.pending = []  # (arrival time, window, future)
+        self.wakeup = asyncio.Event()
+        self.batches = 0
+        self.windows = 0
+        print(f'[DEBUG] {device}: {model_path}, {self.samples} samples, classes {self.classes}')
+
+    def to_window(self, ax, ay, az, gx, gy, gz):
+        window = np.zeros((6, self.samples), dtype=np.int16)
+        for axis, values in enumerate((ax, ay, az, gx, gy, gz)):
+            n = min(len(values), self.samples)
+            window[axis, :n] = values[:n]
+        return window
+
+    def submit(self, window):
+        future = asyncio.get_running_loop().create_future()
+        self.pending.append((time.monotonic(), window, future))
+        self.wakeup.set()
+        return future
+
+    def forward(self, windows):
+        n = len(windows)
+        np.stack(windows, out=self.windowBatch[:n])
+        numpy_model.scale_into(self.windowBatch[:n], self.inputBatch[:n])
+        return self.model.predict(self.inputBatch[:n])
+
+    async def run(self):
+        while True:
+            await self.wakeup.wait()
+            self.wakeup.clear()
+
+            # collect until the oldest request hits the deadline or the batch is full
+            while self.pending and len(self.pending) < MAX_BATCH:
+                remaining = self.pending[0][0] + self.deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    await asyncio.wait_for(self.wakeup.wait(), remaining)
+                except asyncio.TimeoutError:
+                    break
+                self.wakeup.clear()
+
+            if not self.pending:
+                continue
+            batch, self.pending = self.pending[:MAX_BATCH], self.pending[MAX_BATCH:]
+            if self.pending:
+                self.wakeup.set()
+
+            try:
+                probabilities = self.forward([window for _, window, _ in batch])
+            except Exception as e:
+                for _, _, future in batch:
+                    future.set_exception(e)
+                continue
+            self.batches += 1
+            self.windows += len(batch)
+            for (_, _, future), row in zip(batch, probabilities):
+                if not future.done():
+                    future.set_result(row)
+
+    async def classify(self, window):
+        probabilities = await self.submit(window)
+        index = int(np.argmax(probabilities))
+        return self.classes[index], float(probabilities[index])
+
+
+class InferenceService:
+    def __init__(self):
+        self.rabbitmq_connection = None
+        self.channel = None
+        self.predictions_exchange = None
+        self.batchers = {device: MicroBatcher(device, path) for device, path in MODELS.items()}
+        self.should_run = True
+        self.tasks = set()  # in-flight window handlers, kept so they are not garbage collected
+
+    async def setup_rabbitmq(self):
+        print('[DEBUG] Connecting to RabbitMQ broker...')
+        self.rabbitmq_connection = await aio_pika.connect_robust(
+            host=BROKER,
+            port=RABBITMQ_PORT,
+            login=BROKERUSER,
+            password=PASSWORD,
+        )
+        self.channel = await self.rabbitmq_connection.channel()
+        await self.channel.set_qos(prefetch_count=PREFETCH)
+        if ai_shards.AI_SHARDING:
+            self.ai_queue = await ai_shards.declare_shard_queue(self.channel)
+        else:
+            self.ai_queue = await self.channel.declare_queue(AI_QUEUE, durable=True)
+        await self.channel.declare_queue(UPDATE_GE_QUEUE, durable=True, arguments=priority_lanes.ge_queue_arguments())
+        self.predictions_exchange = await self.channel.declare_exchange(UPDATE_PREDICTIONS_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True)
+        print(f'[DEBUG] Connected to RabbitMQ broker at {BROKER}:{RABBITMQ_PORT}')
+
+    # audit: the relay already sent this window's action to the game engine
+    # trace_properties: correlation id and headers of the IMU window, passed on to the game engine
+    async def publish_prediction(self, player_id, device, action_type, confidence, received_at, audit=False, trace_properties=None):
+        print(f"[DEBUG] P{player_id} {device}: {action_type} ({confidence:.5f}) in {(time.monotonic() - received_at) * 1000:.2f} ms{' (audit)' if audit else ''}")
+        prediction = {
+            'player_id': player_id,
+            'imu_device': device,
+            'action_type': action_type,
+            'confidence': confidence,
+        }
+        await self.predictions_exchange.publish(
+            aio_pika.Message(body=json.dumps(prediction).encode('utf-8')),
+            routing_key='',
+        )
+        if not audit and action_type not in IDLE_ACTIONS and confidence >= MIN_CONFIDENCE:
+            action = {
+                'action': True,
+                'action_type': action_type,
+                'player_id': player_id,
+            }
+            await self.channel.default_exchange.publish(
+                aio_pika.Message(body=json.dumps(action).encode('utf-8'), priority=priority_lanes.LANES['action'], **(trace_properties or {})),
+                routing_key=UPDATE_GE_QUEUE,
+            )
+
+    async def handle_message(self, message):
+        async with message.process():
+            received_at = time.monotonic()
+            try:
+                data = json.loads(message.body.decode('utf-8'))
+                device = data.get('imu_device', 'glove')
+                batcher = self.batchers[device]
+                window = batcher.to_window(data['ax'], data['ay'], data['az'], data['gx'], data['gy'], data['gz'])
+                action_type, confidence = await batcher.classify(window)
+                await self.publish_prediction(data.get('player_id'), device, action_type, confidence, received_at, data.get('audit', False),
+                                              latency_trace.forward_properties(message, action_type))
+            except json.JSONDecodeError:
+                print(f'[ERROR] Invalid JSON payload: {message.body[:100]}')
+            except Exception as e:
+                print(f'[ERROR] {e}')
+
+    async def consume_imu_data(self):
+        # one task per window so windows arriving together end up in one batch;
+        # the channel prefetch bounds how many are in flight
+        async with self.ai_queue.iterator() as queue_iter:
+            async for message in queue_iter:
+                self.spawn(self.handle_message(message))
+
+    def spawn(self, coroutine):
+        task = asyncio.create_task(coroutine)
+        self.tasks.add(task)
+        task.add_done_callback(self.tasks.discard)
+
+    async def handle_ring_window(self, player_id, device, window):
+        received_at = time.monotonic()
+        try:
+            action_type, confidence = await self.batchers[device].classify(window)
+            await self.publish_prediction(player_id, device, action_type, confidence, received_at)
+        except Exception as e:
+            print(f'[ERROR] {e}')
+
+    async def consume_rings(self):
+        import imu_shm
+
+        loop = asyncio.get_running_loop()
+        readers = {(player_id, device): None for player_id in PLAYERS for device in self.batchers}
+        # keep watching every ring: a reader whose FIFO was replaced is reopened
+        while self.should_run:
+            for (player_id, device), reader in readers.items():
+                if reader is not None and reader.is_stale():
+                    print(f'[DEBUG] FIFO of shared memory ring {reader.name} was replaced, reopening')
+                    loop.remove_reader(reader.fileno())
+                    reader.close()
+                    readers[player_id, device] = reader = None
+                if reader is not None:
+                    continue
+                try:
+                    reader = imu_shm.ImuRingReader(player_id, device)
+                except FileNotFoundError:
+                    continue
+                readers[player_id, device] = reader
+                print(f'[DEBUG] Reading IMU windows from shared memory ring {reader.name}')
+
+                def on_notify(reader=reader):
+                    for _, view in reader.read_available():
+                        window = self.batchers[reader.device].to_window(*view)
+                        self.spawn(self.handle_ring_window(reader.playerId, reader.device, window))
+                loop.add_reader(reader.fileno(), on_notify)
+            await asyncio.sleep(1)
+
+    async def report_stats(self):
+        while self.should_run:
+            await asyncio.sleep(30)
+            for device, batcher in self.batchers.items():
+                if batcher.batches:
+                    print(f'[DEBUG] {device}: {batcher.windows} windows in {batcher.batches} batches (avg {batcher.windows / batcher.batches:.1f})')
+
+    async def run(self):
+        await self.setup_rabbitmq()
+        tasks = [batcher.run() for batcher in self.batchers.values()]
+        tasks += [self.consume_imu_data(), self.report_stats()]
+        if IMU_SHM:
+            tasks.append(self.consume_rings())
+        await asyncio.gather(*tasks)
+
+
+if __name__ == '__main__':
+    inference_service = InferenceService()
+    try:
+        asyncio.run(inference_service.run())
+    except KeyboardInterrupt:
+        print('[DEBUG] Inference service stopped by user')
+        inference_service.should_run = False
+    except Exception as e:
+        print(f'[ERROR] {e}')
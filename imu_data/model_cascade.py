@@ -0,0 +1,128 @@
+#!/usr/bin/env python
+
+# Offline search for a confidence-based cascade of the hand gesture models.
+#
+# In a cascade a cheap model classifies every window first, and only windows
+# where its top probability is below a threshold are escalated to the next
+# (more accurate) model. This tool tunes such a two-stage cascade on
+# new_data/hand and reports whether it would beat the best single model:
+#   python model_cascade.py tune
+#
+# The bundled models all need about the same work per window (62-106K MACs), so
+# none of them is a cheap first stage and the tuner finds no cascade that beats
+# gesture_model_hand_augmented_59.h5 alone. predict_action.py therefore runs
+# the single model and has no cascade mode; a smaller model has to be trained
+# before a cascade can save anything.
+
+import os
+import sys
+import time
+
+import numpy as np
+
+import imu_dataset
+import numpy_model
+
+HAND_MODELS = [
+    'gesture_model_hand_augmented_59.h5',
+    'gesture_model_hand_reduced.h5',
+    'gesture_model_real.h5',
+    'gesture_model_real_raisearm.h5',
+]
+HAND_DATA = os.path.join('new_data', 'hand')
+
+# the cascade may lose at most this much accuracy against the best single model
+ACCURACY_TOLERANCE = float(os.getenv('CASCADE_ACCURACY_TOLERANCE', '0.002'))
+# and has to save at least this share of its per-window latency to be used
+MIN_SAVING = float(os.getenv('CASCADE_MIN_SAVING', '0.05'))
+
+
+class CascadeStage:
+    def __init__(self, path):
+        self.path = path
+        self.model, self.classes = numpy_model.load_bundled(path)
+        self.samples = self.model.input_shape[0] // imu_dataset.IMU_AXES
+
+    def predict(self, windows):
+        # windows: int16 (n, 6, samples >= self.samples)
+        inputs = np.empty((len(windows),) + self.model.input_shape, dtype=np.float32)
+        numpy_model.scale_into(windows[:, :, :self.samples], inputs)
+        return self.model.predict(inputs)
+
+
+def single_window_latency(stage, windows, runs=200, repeats=5):
+    # best of several runs, so the comparison between models is not scheduler noise
+    stage.predict(windows[:1])
+    best = float('inf')
+    for _ in range(repeats):
+        start = time.perf_counter()
+        for i in range(runs):
+            stage.predict(windows[i % len(windows)][None])
+        best = min(best, (time.perf_counter() - start) / runs)
+    return best
+
+
+def tune(models=HAND_MODELS, data_dir=HAND_DATA):
+    stages = {path: CascadeStage(path) for path in models}
+    # long enough for every model; each stage takes its own prefix of the window
+    samples = max(stage.samples for stage in stages.values())
+    windows, labels = imu_dataset.load_dir(data_dir, samples)
+
+    # tune thresholds on one half of every class, report on the other half
+    rng = np.random.default_rng(0)
+    tuneMask = rng.random(len(labels)) < 0.5
+
+    results = {}
+    for path, stage in stages.items():
+        probabilities = stage.predict(windows)
+        results[path] = {
+            'confidence': probabilities.max(axis=1),
+            'correct': np.array(stage.classes)[probabilities.argmax(axis=1)] == labels,
+            'latency': single_window_latency(stage, windows),
+        }
+        print(f"{path:36} accuracy {results[path]['correct'].mean():.4f}  latency {results[path]['latency'] * 1e6:7.1f} us  MACs {stage.model.macs}")
+
+    best = max(models, key=lambda path: (results[path]['correct'][tuneMask].mean(), -results[path]['latency']))
+    bestAccuracy = results[best]['correct'][tuneMask].mean()
+    choice = {'stages': [{'model': best}], 'cost': results[best]['latency'] * (1 - MIN_SAVING)}
+
+    for first in models:
+        for second in models:
+            # only a cheaper model is worth putting in front; the bundled models
+            # time within noise of each other, so it has to do less work as well
+            if (first == second or results[first]['latency'] >= results[second]['latency']
+                    or stages[first].model.macs >= stages[second].model.macs):
+                continue
+            a, b = results[first], results[second]
+            for threshold in np.unique(np.round(a['confidence'][tuneMask], 4)):
+                accept = a['confidence'] >= threshold
+                correct = np.where(accept, a['correct'], b['correct'])[tuneMask]
+                if correct.mean() < bestAccuracy - ACCURACY_TOLERANCE:
+                    continue
+                cost = a['latency'] + (1 - accept[tuneMask].mean()) * b['latency']
+                if cost < choice['cost']:
+                    choice = {'stages': [{'model': first, 'threshold': float(threshold)}, {'model': second}], 'cost': cost}
+                break  # lowest passing threshold is the cheapest for this pair
+
+    # report on the held-out half
+    held = ~tuneMask
+    if len(choice['stages']) == 1:
+        choice['cost'] = results[best]['latency']
+        print('No cascade is cheaper than the best single model by the required margin')
+    correct = results[choice['stages'][-1]['model']]['correct']
+    if len(choice['stages']) == 2:
+        first = results[choice['stages'][0]['model']]
+        accept = first['confidence'] >= choice['stages'][0]['threshold']
+        correct = np.where(accept, first['correct'], correct)
+        print(f'Escalated on held-out data: {1 - accept[held].mean():.1%}')
+    print(f"Cascade: {choice['stages']}")
+    print(f"Held-out accuracy {correct[held].mean():.4f} vs best single model {results[best]['correct'][held].mean():.4f}")
+    print(f"Expected latency {choice['cost'] * 1e6:.1f} us vs {results[best]['latency'] * 1e6:.1f} us")
+    return {'stages': choice['stages']}
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1 and sys.argv[1] == 'tune':
+        tune()
+    else:
+        print('Usage: python model_cascade.py tune')
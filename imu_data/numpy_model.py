@@ -0,0 +1,354 @@
+#!/usr/bin/env python
+
+# Pure NumPy inference for the Keras .h5 gesture models in this folder.
+#
+# Importing TensorFlow takes seconds and model.predict has a large fixed cost
+# per call, which dominates for a single 1 x 354 x 1 window. The bundled models
+# are small Sequential CNNs, so the layer config and weights are read straight
+# from the .h5 file with h5py and the forward pass is done with NumPy.
+
+import json
+import os
+import pickle
+
+import h5py
+import numpy as np
+
+# Input scaling: MinMaxScaler(feature_range=(-1, 1)) fitted on [-2**15, 2**15 - 1].
+# Every int16 value maps to one float32, so the affine transform is precomputed
+# into a 64K table (in float64, like sklearn) and applied as a single gather.
+INT16_SCALE = 2 / (2**16 - 1)
+INT16_OFFSET = -1 + 2**15 * INT16_SCALE
+# indexed by the uint16 bit pattern of each int16 sample
+INT16_TABLE = (np.arange(2**16, dtype=np.uint16).view(np.int16) * INT16_SCALE + INT16_OFFSET).astype(np.float32)
+
+
+# Activations
+def relu(x):
+    return np.maximum(x, 0, out=x)
+
+def softmax(x):
+    x = x - x.max(axis=-1, keepdims=True)
+    np.exp(x, out=x)
+    x /= x.sum(axis=-1, keepdims=True)
+    return x
+
+def sigmoid(x):
+    return 1 / (1 + np.exp(-x))
+
+def linear(x):
+    return x
+
+ACTIVATIONS = {
+    'relu': relu,
+    'softmax': softmax,
+    'sigmoid': sigmoid,
+    'tanh': np.tanh,
+    'linear': linear,
+    None: linear,
+}
+
+
+def get_activation(name):
+    if name not in ACTIVATIONS:
+        raise ValueError(f'Unsupported activation: {name}')
+    return ACTIVATIONS[name]
+
+
+def first(value):
+    # Keras stores 1D sizes as [n] in newer versions and n in older ones
+    return value[0] if isinstance(value, (list, tuple)) else value
+
+
+def window_indices(length, size, stride, dilation=1):
+    # (out_length, size) indices of each sliding window over the time axis
+    out_length = (length - (size - 1) * dilation - 1) // stride + 1
+    return np.arange(out_length)[:, None] * stride + np.arange(size)[None, :] * dilation
+
+
+def same_padding(length, size, stride, dilation=1):
+    effective = (size - 1) * dilation + 1
+    out_length = -(-length // stride)
+    total = max((out_length - 1) * stride + effective - length, 0)
+    return total // 2, total - total // 2
+
+
+# Layers work on float32 arrays of shape (batch, steps, channels) and are
+# built for a fixed input shape so window indices are computed only once.
+class Conv1D:
+    def __init__(self, config, weights, input_shape):
+        self.kernel = weights['kernel']  # (size, in_channels, filters)
+        self.bias = weights.get('bias')
+        self.activation = get_activation(config.get('activation'))
+        size, in_channels, filters = self.kernel.shape
+        stride = first(config.get('strides', 1))
+        dilation = first(config.get('dilation_rate', 1))
+        padding = config.get('padding', 'valid')
+        if config.get('data_format', 'channels_last') != 'channels_last' or config.get('groups', 1) != 1:
+            raise ValueError('Only channels_last, ungrouped Conv1D is supported')
+
+        length = input_shape[0]
+        if padding == 'same':
+            self.padding = same_padding(length, size, stride, dilation)
+        elif padding == 'causal':
+            self.padding = ((size - 1) * dilation, 0)
+        else:
+            self.padding = (0, 0)
+        self.indices = window_indices(length + sum(self.padding), size, stride, dilation)
+        self.flatKernel = self.kernel.reshape(size * in_channels, filters)
+        self.output_shape = (self.indices.shape[0], filters)
+        self.macs = self.indices.shape[0] * size * in_channels * filters
+
+    def __call__(self, x):
+        if any(self.padding):
+            x = np.pad(x, ((0, 0), self.padding, (0, 0)))
+        columns = x[:, self.indices, :]  # (batch, out_length, size, in_channels)
+        batch, out_length = columns.shape[:2]
+        y = columns.reshape(batch * out_length, -1) @ self.flatKernel
+        if self.bias is not None:
+            y += self.bias
+        return self.activation(y.reshape(batch, out_length, -1))
+
+
+class Dense:
+    def __init__(self, config, weights, input_shape):
+        self.kernel = weights['kernel']
+        self.bias = weights.get('bias')
+        self.activation = get_activation(config.get('activation'))
+        self.output_shape = tuple(input_shape[:-1]) + (self.kernel.shape[1],)
+        self.macs = int(np.prod(input_shape)) * self.kernel.shape[1]
+
+    def __call__(self, x):
+        y = x @ self.kernel
+        if self.bias is not None:
+            y += self.bias
+        return self.activation(y)
+
+
+class BatchNormalization:
+    # inference mode only: fold the moving statistics into one scale and shift
+    def __init__(self, config, weights, input_shape):
+        channels = input_shape[-1]
+        gamma = weights.get('gamma', np.ones(channels, dtype=np.float32))
+        beta = weights.get('beta', np.zeros(channels, dtype=np.float32))
+        inv = gamma / np.sqrt(weights['moving_variance'] + np.float32(config.get('epsilon', 1e-3)))
+        self.scale = inv.astype(np.float32)
+        self.shift = (beta - weights['moving_mean'] * inv).astype(np.float32)
+        self.output_shape = input_shape
+
+    def __call__(self, x):
+        return x * self.scale + self.shift
+
+
+class Pooling1D:
+    def __init__(self, config, weights, input_shape, reduce):
+        size = first(config.get('pool_size', 2))
+        stride = first(config.get('strides') or size)
+        length = input_shape[0]
+        self.padding = same_padding(length, size, stride) if config.get('padding', 'valid') == 'same' else (0, 0)
+        self.indices = window_indices(length + sum(self.padding), size, stride)
+        self.reduce = reduce
+        self.output_shape = (self.indices.shape[0], input_shape[1])
+        # like Keras, 'same' average pooling divides by the valid positions only
+        valid = (self.indices >= self.padding[0]) & (self.indices < self.padding[0] + length)
+        self.counts = valid.sum(axis=1).astype(np.float32)[:, None]
+
+    def __call__(self, x):
+        if any(self.padding):
+            fill = -np.inf if self.reduce is np.max else 0
+            x = np.pad(x, ((0, 0), self.padding, (0, 0)), constant_values=fill)
+        pooled = self.reduce(x[:, self.indices, :], axis=2)
+        return pooled if self.reduce is np.max else pooled / self.counts
+
+
+class GlobalPooling1D:
+    def __init__(self, config, weights, input_shape, reduce):
+        self.reduce = reduce
+        self.output_shape = (input_shape[-1],)
+
+    def __call__(self, x):
+        return self.reduce(x, axis=1)
+
+
+class Flatten:
+    def __init__(self, config, weights, input_shape):
+        self.output_shape = (int(np.prod(input_shape)),)
+
+    def __call__(self, x):
+        return x.reshape(x.shape[0], -1)
+
+
+class Activation:
+    def __init__(self, config, weights, input_shape):
+        self.activation = get_activation(config.get('activation'))
+        self.output_shape = input_shape
+
+    def __call__(self, x):
+        return self.activation(x)
+
+
+class Identity:
+    # Dropout and friends do nothing at inference time
+    def __init__(self, config, weights, input_shape):
+        self.output_shape = input_shape
+
+    def __call__(self, x):
+        return x
+
+
+LAYERS = {
+    'Conv1D': Conv1D,
+    'Dense': Dense,
+    'BatchNormalization': BatchNormalization,
+    'MaxPooling1D': lambda c, w, s: Pooling1D(c, w, s, np.max),
+    'AveragePooling1D': lambda c, w, s: Pooling1D(c, w, s, np.sum),
+    'GlobalMaxPooling1D': lambda c, w, s: GlobalPooling1D(c, w, s, np.max),
+    'GlobalAveragePooling1D': lambda c, w, s: GlobalPooling1D(c, w, s, np.mean),
+    'Flatten': Flatten,
+    'Activation': Activation,
+    'Dropout': Identity,
+    'SpatialDropout1D': Identity,
+    'GaussianNoise': Identity,
+    'GaussianDropout': Identity,
+}
+
+
+def read_layer_weights(weights_group, name):
+    # weights keyed by variable name (kernel, bias, gamma, ...), as float32
+    if name not in weights_group:
+        return {}
+    group = weights_group[name]
+    weights = {}
+    for weight_name in group.attrs.get('weight_names', []):
+        if isinstance(weight_name, bytes):
+            weight_name = weight_name.decode('utf-8')
+        key = weight_name.split('/')[-1].split(':')[0]
+        weights[key] = np.asarray(group[weight_name], dtype=np.float32)
+    return weights
+
+
+class NumpyModel:
+    def __init__(self, path):
+        with h5py.File(path, 'r') as f:
+            config = json.loads(f.attrs['model_config'])
+            if config['class_name'] != 'Sequential':
+                raise ValueError(f'{path}: only Sequential models are supported')
+            weights_group = f['model_weights'] if 'model_weights' in f else f
+
+            layers = config['config']['layers']
+            input_config = layers[0]['config']
+            batch_shape = input_config.get('batch_shape') or input_config.get('batch_input_shape')
+            self.input_shape = tuple(batch_shape[1:])
+
+            self.layers = []
+            shape = self.input_shape
+            for layer in layers:
+                class_name = layer['class_name']
+                if class_name == 'InputLayer':
+                    continue
+                if class_name not in LAYERS:
+                    raise ValueError(f'{path}: unsupported layer {class_name}')
+                built = LAYERS[class_name](layer['config'], read_layer_weights(weights_group, layer['config']['name']), shape)
+                self.layers.append(built)
+                shape = built.output_shape
+            self.output_shape = shape
+            # multiply-accumulates per window in the Conv1D and Dense layers
+            self.macs = sum(getattr(layer, 'macs', 0) for layer in self.layers)
+
+    def predict(self, x):
+        x = np.asarray(x, dtype=np.float32).reshape((-1,) + self.input_shape)
+        for layer in self.layers:
+            x = layer(x)
+        return x
+
+
+def load_model(path):
+    return NumpyModel(path)
+
+
+# Bundled models: label encoder and the encoder classes a model has no output for
+BUNDLED_MODELS = {
+    'gesture_model_hand_augmented_59.h5': ('label_encoder_hand.pkl', []),
+    'gesture_model_hand_reduced.h5': ('label_encoder_hand.pkl', []),
+    'gesture_model_real_raisearm.h5': ('label_encoder_hand.pkl', []),
+    # 9 outputs, trained before raise_arm was added (checked on new_data/hand)
+    'gesture_model_real.h5': ('label_encoder_hand.pkl', ['raise_arm']),
+    'gesture_model_real_leg.h5': ('label_encoder_leg.pkl', []),
+}
+
+
+def load_bundled(path):
+    # model and its output labels, for one of BUNDLED_MODELS
+    labels_file, missing = BUNDLED_MODELS[os.path.basename(path)]
+    model = load_model(path)
+    classes = [label for label in load_label_classes(os.path.join(os.path.dirname(path), labels_file)) if label not in missing]
+    if len(classes) != model.output_shape[-1]:
+        raise ValueError(f'{path}: {model.output_shape[-1]} outputs but {len(classes)} labels')
+    return model, classes
+
+
+def scale_into(windows, out):
+    # int16 windows (..., 6, samples) -> scaled float32 model input, written into
+    # the preallocated out array; (batch, 6 * samples, 1) for the models here
+    windows = np.ascontiguousarray(windows, dtype=np.int16)
+    np.take(INT16_TABLE, windows.view(np.uint16), out=out.reshape(windows.shape))
+    return out
+
+
+class _PickledLabelEncoder:
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+
+
+class _LabelUnpickler(pickle.Unpickler):
+    # the label encoders only need classes_, so sklearn is not imported for them
+    def find_class(self, module, name):
+        if module.startswith('sklearn.'):
+            return _PickledLabelEncoder
+        return super().find_class(module, name)
+
+
+def load_label_classes(path):
+    with open(path, 'rb') as file:
+        encoder = _LabelUnpickler(file).load()
+    return [str(label) for label in encoder.classes_]
+
+
+if __name__ == '__main__':
+    # Validate against TensorFlow on the recorded CSVs:
+    #   python numpy_model.py gesture_model_hand_augmented_59.h5 new_data/hand
+    import glob
+    import sys
+    import time
+
+    import imu_dataset
+
+    model_path, data_dir = sys.argv[1], sys.argv[2]
+
+    start = time.perf_counter()
+    model = load_model(model_path)
+    print(f'Loaded {model_path} in {(time.perf_counter() - start) * 1000:.1f} ms, input {model.input_shape}')
+
+    samples = model.input_shape[0] // 6
+    windows = np.concatenate([imu_dataset.load_csv(path, samples) for path in sorted(glob.glob(os.path.join(data_dir, '*.csv')))])
+    inputs = scale_into(windows, np.empty((len(windows),) + model.input_shape, dtype=np.float32))
+
+    single = inputs[:1]
+    model.predict(single)
+    runs = 1000
+    start = time.perf_counter()
+    for _ in range(runs):
+        model.predict(single)
+    print(f'Single window latency: {(time.perf_counter() - start) / runs * 1e6:.1f} us')
+
+    outputs = model.predict(inputs)
+    try:
+        import tensorflow as tf
+    except ImportError:
+        print('TensorFlow is not installed; skipped the comparison')
+        sys.exit(0)
+
+    expected = tf.keras.models.load_model(model_path).predict(inputs, verbose=0)
+    print(f'Windows: {len(inputs)}')
+    print(f'Max abs difference: {np.abs(outputs - expected).max():.3g}')
+    print(f'Argmax agreement: {np.mean(outputs.argmax(1) == expected.argmax(1)):.2%}')
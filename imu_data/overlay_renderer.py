@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# Long-lived overlay window for predicted actions.
+#
+# Runs as its own process with a single persistent Tk window. Predictions
+# arrive as small JSON datagrams on a localhost UDP port, so the sender
+# (predict_action.py) never waits on the GUI:
+#   {"text": "bomb (0.99871)", "duration": 2}
+
+import json
+import os
+import socket
+import tkinter as tk
+
+OVERLAY_HOST = '127.0.0.1'
+OVERLAY_PORT = int(os.getenv('OVERLAY_PORT', '5005'))
+
+# Global variable to set the size of the overlay
+OVERLAY_WIDTH = 1000
+OVERLAY_HEIGHT = 400
+BORDER_RADIUS = 100  # Adjust to make the corners more or less rounded
+TRANSPARENCY_LEVEL = 0  # Adjust for semi-transparency
+
+def round_rectangle(canvas, x1, y1, x2, y2, radius=25, **kwargs):
+    """Draw a rounded rectangle on the given canvas."""
+    points = [
+        (x1 + radius, y1),
+        (x2 - radius, y1),
+        (x2, y1),
+        (x2, y1 + radius),
+        (x2, y2 - radius),
+        (x2, y2),
+        (x2 - radius, y2),
+        (x1 + radius, y2),
+        (x1, y2),
+        (x1, y2 - radius),
+        (x1, y1 + radius),
+        (x1, y1)
+    ]
+
+    return canvas.create_polygon(points, smooth=True, **kwargs)
+
+class OverlayRenderer:
+    def __init__(self, root, sock):
+        self.root = root
+        self.sock = sock
+        self.hideJob = None
+
+        root.overrideredirect(True)  # Remove window borders
+        root.attributes("-topmost", True)  # Keep on top of other windows
+        root.attributes('-alpha', TRANSPARENCY_LEVEL)  # Set transparency level
+        root.geometry(f"{OVERLAY_WIDTH}x{OVERLAY_HEIGHT}+{root.winfo_screenwidth()//2 - OVERLAY_WIDTH//2}+{root.winfo_screenheight()//2 - OVERLAY_HEIGHT//2}")
+
+        # Pill-shaped background with the predicted action centered on it
+        canvas = tk.Canvas(root, width=OVERLAY_WIDTH, height=OVERLAY_HEIGHT, highlightthickness=0, bg="black")
+        canvas.pack(fill="both", expand=True)
+        round_rectangle(canvas, 0, 0, OVERLAY_WIDTH, OVERLAY_HEIGHT, radius=BORDER_RADIUS, fill="black")
+        self.label = tk.Label(canvas, text="", font=("Arial", int(OVERLAY_HEIGHT * 0.1), "bold"), fg="white", bg="black")
+        self.label.place(relx=0.5, rely=0.5, anchor="center")
+
+        root.withdraw()
+        root.tk.createfilehandler(sock, tk.READABLE, self.on_readable)
+
+    def on_readable(self, sock, mask):
+        # only the newest prediction is worth showing
+        latest = None
+        while True:
+            try:
+                latest = self.sock.recv(4096)
+            except BlockingIOError:
+                break
+        if latest is None:
+            return
+        try:
+            message = json.loads(latest.decode('utf-8'))
+        except json.JSONDecodeError:
+            print(f'[ERROR] Invalid overlay message: {latest}')
+            return
+        self.show(message.get('text', ''), message.get('duration', 2))
+
+    def show(self, text, duration):
+        self.label.config(text=text)
+        self.root.deiconify()
+        self.root.lift()
+        if self.hideJob is not None:
+            self.root.after_cancel(self.hideJob)
+        self.hideJob = self.root.after(int(duration * 1000), self.hide)
+
+    def hide(self):
+        self.hideJob = None
+        self.root.withdraw()
+
+def main():
+    sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    sock.bind((OVERLAY_HOST, OVERLAY_PORT))
+    sock.setblocking(False)
+    print(f'[DEBUG] Overlay renderer listening on {OVERLAY_HOST}:{OVERLAY_PORT}')
+
+    root = tk.Tk()
+    OverlayRenderer(root, sock)
+    root.mainloop()
+
+if __name__ == '__main__':
+    main()
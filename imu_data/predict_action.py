@@ -1,6 +1,10 @@
 #!/usr/bin/env python
 
+import json
 import os
+import socket
+import subprocess
+import sys
 from dotenv import load_dotenv
 
 import bluepy.btle as btle
@@ -11,10 +15,9 @@ import numpy as np
 
 import csv
 
-import tensorflow as tf
-from sklearn.preprocessing import MinMaxScaler
-import pickle
-from sklearn.preprocessing import LabelEncoder
+import numpy_model
+import overlay_renderer
+import stream_calibration
 
 # Load environment variables from .env file
 load_dotenv()
@@ -50,6 +53,18 @@ CRC8 = Calculator(Crc8.CCITT)
 PACKET_SIZE = 15
 DATASIZE = 59
 
+# Streaming inference: classify the partial window every STREAM_CHECKPOINT samples
+# and stop early once the model is confident enough. The CNN keeps no state
+# between checkpoints, so each one is a full inference on the zero-padded prefix.
+# The confidence each checkpoint needs is calibrated by stream_calibration.py;
+# STREAM_CONFIDENCE overrides it with one threshold for all checkpoints.
+# Off by default: the calibrated checkpoints decide 42% of the windows early
+# without losing accuracy, but a window then costs about 2.4 inferences, not 1.
+STREAM_INFERENCE = os.getenv('STREAM_INFERENCE', '0') == '1'
+STREAM_CHECKPOINT = int(os.getenv('STREAM_CHECKPOINT', '10'))
+STREAM_MIN_SAMPLES = int(os.getenv('STREAM_MIN_SAMPLES', '20'))
+STREAM_CONFIDENCE = os.getenv('STREAM_CONFIDENCE', '')
+
 # Packet Types
 SYN = 'S'
 SYNACK = 'C'
@@ -93,139 +108,123 @@ dataPacket = {
 
 dataPacketQueue = []
 
-model = tf.keras.models.load_model('gesture_model_hand_augmented_59.h5')
-
-# Define the scaler to scale between -1 and 1 (to maintain negative values)
-scaler = MinMaxScaler(feature_range=(-1, 1))
-
-# Fit the scaler with the 16-bit signed integer range (this only needs to be done once)
-scaler.fit(np.array([-2**15, 2**15 - 1]).reshape(-1, 1))
+# NumPy port of the Keras model; no TensorFlow import or per-call predict overhead
+model = numpy_model.load_model('gesture_model_hand_augmented_59.h5')
 
+# Labels of the model outputs, read without importing sklearn
+label_classes = numpy_model.load_label_classes('label_encoder_hand.pkl')
 
-with open('label_encoder_hand.pkl', 'rb') as file:
-    label_encoder = pickle.load(file)
-
-# Function to pad or truncate the data to exactly 60 samples
-def pad_or_truncate(array, target_length=DATASIZE):
-    if len(array) > target_length:
-        return array[:target_length]
-    elif len(array) < target_length:
-        return array + [0] * (target_length - len(array))
-    else:
-        return array
-
-
-import tkinter as tk
-import threading
-import time
-
-# Global variable to set the size of the overlay
-OVERLAY_WIDTH = 1000
-OVERLAY_HEIGHT = 400
-BORDER_RADIUS = 100  # Adjust to make the corners more or less rounded
-TRANSPARENCY_LEVEL = 0  # Adjust for semi-transparency
-
-def round_rectangle(canvas, x1, y1, x2, y2, radius=25, **kwargs):
-    """Draw a rounded rectangle on the given canvas."""
-    points = [
-        (x1 + radius, y1),
-        (x2 - radius, y1),
-        (x2, y1),
-        (x2, y1 + radius),
-        (x2, y2 - radius),
-        (x2, y2),
-        (x2 - radius, y2),
-        (x1 + radius, y2),
-        (x1, y2),
-        (x1, y2 - radius),
-        (x1, y1 + radius),
-        (x1, y1)
-    ]
-    
-    return canvas.create_polygon(points, smooth=True, **kwargs)
+# int16 IMU window filled in by appendImuData and the preallocated model input it
+# is scaled into. Samples not received yet stay 0, like the padding of a short
+# window, so every prefix of the window is a valid model input as well.
+imuWindow = np.zeros((6, DATASIZE), dtype=np.int16)
+modelInput = np.empty((1, 6 * DATASIZE, 1), dtype=np.float32)
+streamState = {
+    'nextCheckpoint': STREAM_CHECKPOINT,
+    'isDecided': False,
+}
+streamThresholds = {}
+if STREAM_INFERENCE:
+    streamThresholds = stream_calibration.load_thresholds()
+    if STREAM_CONFIDENCE:
+        streamThresholds = {samples: float(STREAM_CONFIDENCE) for samples in range(STREAM_CHECKPOINT, DATASIZE, STREAM_CHECKPOINT)}
+
+# Predictions are shown by a separate overlay_renderer.py process, so neither
+# inference nor the BLE loop ever waits on the GUI
+OVERLAY_SPAWN = os.getenv('OVERLAY_SPAWN', '1') == '1'
+overlaySocket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+overlaySocket.setblocking(False)
+overlayProcess = None
+
+def start_overlay_renderer():
+    global overlayProcess
+    if OVERLAY_SPAWN and overlayProcess is None:
+        script = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'overlay_renderer.py')
+        overlayProcess = subprocess.Popen([sys.executable, script])
 
 def show_overlay(predicted_action, duration=2):
-    """Display a temporary, pill-shaped overlay showing the predicted action with transparency on Linux."""
-    root = tk.Tk()
-    root.overrideredirect(True)  # Remove window borders
-    root.attributes("-topmost", True)  # Keep on top of other windows
-    root.attributes('-alpha', TRANSPARENCY_LEVEL)  # Set transparency level
-    
-    # Set the geometry of the window to be centered
-    root.geometry(f"{OVERLAY_WIDTH}x{OVERLAY_HEIGHT}+{root.winfo_screenwidth()//2 - OVERLAY_WIDTH//2}+{root.winfo_screenheight()//2 - OVERLAY_HEIGHT//2}")
-    
-    # Create a canvas to draw the pill-shaped background
-    canvas = tk.Canvas(root, width=OVERLAY_WIDTH, height=OVERLAY_HEIGHT, highlightthickness=0, bg="black")
-    canvas.pack(fill="both", expand=True)
-    
-    # Draw a rounded rectangle as the pill shape background
-    round_rectangle(canvas, 0, 0, OVERLAY_WIDTH, OVERLAY_HEIGHT, radius=BORDER_RADIUS, fill="black")
-    
-    # Create a label with a bigger font that fills the window (centered in the pill shape)
-    label = tk.Label(canvas, text=predicted_action, font=("Arial", int(OVERLAY_HEIGHT * 0.1), "bold"), fg="white", bg="black")
-    label.place(relx=0.5, rely=0.5, anchor="center")
+    """Send the predicted action to the overlay renderer without waiting for it."""
+    message = json.dumps({'text': predicted_action, 'duration': duration}).encode('utf-8')
+    try:
+        overlaySocket.sendto(message, (overlay_renderer.OVERLAY_HOST, overlay_renderer.OVERLAY_PORT))
+    except OSError as e:
+        print(f'[ERROR] Overlay: {e}')
 
-    # Close the overlay after a delay using tkinter's after method
-    root.after(duration * 1000, root.destroy)
 
-    # Start the Tkinter main loop (this should stay in the main thread)
-    root.mainloop()
+def reset_data_packet():
+    dataPacket['ax'] = [0] * DATASIZE
+    dataPacket['ay'] = [0] * DATASIZE
+    dataPacket['az'] = [0] * DATASIZE
+    dataPacket['gx'] = [0] * DATASIZE
+    dataPacket['gy'] = [0] * DATASIZE
+    dataPacket['gz'] = [0] * DATASIZE
+    dataPacket['isAllImuReceived'] = False
+    dataPacket['imuCounter'] = 0
 
+    imuWindow.fill(0)
+    streamState['nextCheckpoint'] = STREAM_CHECKPOINT
+    streamState['isDecided'] = False
 
-# Update the predict_action function to show the overlay without threading
-def predict_action():
-    # Ensure each IMU data array has 60 elements
-    ax_padded = pad_or_truncate(dataPacket["ax"])
-    ay_padded = pad_or_truncate(dataPacket["ay"])
-    az_padded = pad_or_truncate(dataPacket["az"])
-    gx_padded = pad_or_truncate(dataPacket["gx"])
-    gy_padded = pad_or_truncate(dataPacket["gy"])
-    gz_padded = pad_or_truncate(dataPacket["gz"])
-    
-    # Concatenate all six arrays (ax, ay, az, gx, gy, gz)
-    imu_data = ax_padded + ay_padded + az_padded + gx_padded + gy_padded + gz_padded
-    print("IMU Data:", imu_data)  # Sanity check
-    imu_data = np.array(imu_data).reshape(-1, 1)  # Reshape for the scaler
-    
-    # Scale the data
-    scaled_imu_data = scaler.transform(imu_data).flatten()
-    print("Scaled IMU Data:", scaled_imu_data)  # Sanity check
-    
-    # Reshape the data for the model (1 sample, 360 features)
-    input_data = scaled_imu_data.reshape(1, -1, 1)  # Assuming your CNN expects (samples, time steps, channels)
-    
-    # Make prediction using the loaded TensorFlow model
-    prediction = model.predict(input_data)
-    
-    # Print probabilities with 5 decimal places
-    probabilities = prediction.flatten()
+def show_prediction(probabilities, classes=label_classes):
     print("Prediction probabilities:", [f"{prob:.5f}" for prob in probabilities])
-    
+
     # Get the predicted class (as an index)
-    predicted_class = np.argmax(prediction, axis=1)
-    
+    predicted_class = int(np.argmax(probabilities))
+
     # Check if the highest probability is above the threshold
-    max_probability = np.max(probabilities)
+    max_probability = probabilities[predicted_class]
     if max_probability >= 0:
         # Decode the predicted class index back to the original label
-        predicted_label = label_encoder.inverse_transform(predicted_class)
-        predicted_action = f"{predicted_label[0]} ({max_probability:.5f})"
-        print(f"Predicted label: {predicted_label[0]} with probability: {max_probability:.5f}")
+        predicted_label = classes[predicted_class]
+        predicted_action = f"{predicted_label} ({max_probability:.5f})"
+        print(f"Predicted label: {predicted_label} with probability: {max_probability:.5f}")
         
         # Show the predicted action in an overlay
         show_overlay(predicted_action)
     else:
         print("Ignored action (probability too low)")
-    
+
+# Probabilities for the current window and the labels they belong to
+def classify(window=imuWindow):
+    # Scale the int16 window straight into the model input (1 sample, 354 time steps, 1 channel)
+    numpy_model.scale_into(window, modelInput)
+    return model.predict(modelInput).flatten(), label_classes
+
+def predict_action():
+    print("IMU Data:", imuWindow.tolist())  # Sanity check
+
+    # Make prediction using the loaded model
+    probabilities, classes = classify()
+    show_prediction(probabilities, classes)
+
     # Reset the dataPacket for the next IMU data collection
-    dataPacket['ax'] = [0] * DATASIZE
-    dataPacket['ay'] = [0] * DATASIZE
-    dataPacket['az'] = [0] * DATASIZE
-    dataPacket['gx'] = [0] * DATASIZE
-    dataPacket['gy'] = [0] * DATASIZE
-    dataPacket['gz'] = [0] * DATASIZE
-    dataPacket['isAllImuReceived'] = False
-    dataPacket['imuCounter'] = 0
+    reset_data_packet()
+
+# Streaming mode: run the classifier on the part of the window received so far
+# at each checkpoint and show the result early once the model is confident.
+# Checkpoints are positional prefixes of the window, as in stream_calibration:
+# checkpoint k is due once sample k - 1 has arrived, with lost samples left 0.
+def stream_checkpoint():
+    received = dataPacket['seq'] + 1
+    if streamState['isDecided'] or received < streamState['nextCheckpoint']:
+        return
+    # the last checkpoint reached; ones skipped over by lost packets are not run
+    checkpoint = received // STREAM_CHECKPOINT * STREAM_CHECKPOINT
+    streamState['nextCheckpoint'] = checkpoint + STREAM_CHECKPOINT
+    if checkpoint < STREAM_MIN_SAMPLES:
+        return
+
+    threshold = streamThresholds.get(checkpoint)
+    if threshold is None:
+        return  # no early exit calibrated at this checkpoint
+
+    prefix = imuWindow.copy()
+    prefix[:, checkpoint:] = 0
+    probabilities, classes = classify(prefix)
+    if np.max(probabilities) >= threshold:
+        print(f"[BLE] >> Early decision after {checkpoint} samples")
+        streamState['isDecided'] = True
+        show_prediction(probabilities, classes)
 
 class MyDelegate(btle.DefaultDelegate):
     def __init__(self):
@@ -360,7 +359,10 @@ class BLEConnection:
         dataPacket['gx'][dataPacket['seq']] = gx
         dataPacket['gy'][dataPacket['seq']] = gy
         dataPacket['gz'][dataPacket['seq']] = gz
+        imuWindow[:, dataPacket['seq']] = (ax, ay, az, gx, gy, gz)
 
+        if STREAM_INFERENCE:
+            stream_checkpoint()
 
     def parseRxPacket(self):
         packetType = self.device.delegate.packetType
@@ -392,7 +394,10 @@ class BLEConnection:
             # all data is ready
             dataPacket['isAllImuReceived'] = True
             print(f"[BLE] >> All IMU data is received.")
-            predict_action()
+            if streamState['isDecided']:
+                reset_data_packet()  # already shown from a prefix of the window
+            else:
+                predict_action()
             
         elif (packetType == SYNACK):
             self.sendSYNACK(0)
@@ -452,9 +457,13 @@ def get_imu_data():
         return None
 
 if __name__ == '__main__':
+    start_overlay_renderer()
     ble1 = BLEConnection(MAC_ADDR, SERVICE_UUID, CHAR_UUID)
     try:
         ble1.run()
     except KeyboardInterrupt:
         print('[DEBUG] Glove Beetle Server stopped by user')
+    finally:
+        if overlayProcess is not None:
+            overlayProcess.terminate()
 
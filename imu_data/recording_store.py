@@ -0,0 +1,203 @@
+#!/usr/bin/env python
+
+# Append-only store for IMU data collection sessions.
+#
+# Every take is one fixed-size int16 record (6 axes x samples) in <prefix>.imu,
+# after a short header with the sample count, and one fixed-size entry in
+# <prefix>.idx (take id, player, deleted flag, timestamp, label). Records are
+# only ever appended; undoing a take flips its deleted flag in place. Live
+# takes can be exported to the CSV layout of new_data/ at any time:
+#   python recording_store.py <prefix> <csv> [label]
+# SessionExport appends the takes of one collection session to a CSV as they
+# are recorded, one row per take, after whatever rows the CSV already had.
+
+import os
+import struct
+import sys
+import time
+
+import numpy as np
+
+IMU_AXES = 6
+
+# magic, samples per axis
+LOG_HEADER_FORMAT = '<4sH2x'
+LOG_HEADER_SIZE = struct.calcsize(LOG_HEADER_FORMAT)
+LOG_MAGIC = b'IMUR'
+
+# take id, player, deleted, timestamp, label
+INDEX_FORMAT = '<IBBd32s'
+INDEX_SIZE = struct.calcsize(INDEX_FORMAT)
+DELETED_OFFSET = struct.calcsize('<IB')
+LABEL_SIZE = 32
+
+
+def check_label(label):
+    if len(label.encode('utf-8')) > LABEL_SIZE:
+        raise ValueError(f'Label {label!r} is longer than {LABEL_SIZE} bytes')
+
+
+# not O_APPEND: on Linux pwrite to an O_APPEND file ignores the offset
+def open_for_update(path):
+    return os.fdopen(os.open(path, os.O_RDWR | os.O_CREAT, 0o644), 'r+b')
+
+
+class RecordingStore:
+    # samples is only used for a new store; an existing one keeps its own
+    def __init__(self, prefix, samples=None):
+        self.log_path = f'{prefix}.imu'
+        self.log = open_for_update(self.log_path)
+        self.index = open_for_update(f'{prefix}.idx')
+
+        header = os.pread(self.log.fileno(), LOG_HEADER_SIZE, 0)
+        if header:
+            magic, self.samples = struct.unpack(LOG_HEADER_FORMAT, header)
+            if magic != LOG_MAGIC:
+                raise ValueError(f'{self.log_path} is not a recording log')
+        elif samples is None:
+            raise ValueError(f'{self.log_path} does not exist yet; the sample count is required')
+        else:
+            self.samples = samples
+            self.log.write(struct.pack(LOG_HEADER_FORMAT, LOG_MAGIC, samples))
+            self.log.flush()
+        self.record_size = IMU_AXES * self.samples * 2
+
+        # an interrupted append leaves at most one partial record behind
+        logRecords = (os.fstat(self.log.fileno()).st_size - LOG_HEADER_SIZE) // self.record_size
+        count = min(os.fstat(self.index.fileno()).st_size // INDEX_SIZE, logRecords)
+        self.log.truncate(LOG_HEADER_SIZE + count * self.record_size)
+        self.index.truncate(count * INDEX_SIZE)
+        self.log.seek(0, os.SEEK_END)
+        self.index.seek(0, os.SEEK_END)
+
+        self.entries = [self.read_entry(i) for i in range(count)]
+        self.live = [i for i, entry in enumerate(self.entries) if not entry['deleted']]
+
+    def read_entry(self, i):
+        takeId, player, deleted, timestamp, label = struct.unpack(INDEX_FORMAT, os.pread(self.index.fileno(), INDEX_SIZE, i * INDEX_SIZE))
+        return {
+            'take_id': takeId,
+            'player': player,
+            'deleted': bool(deleted),
+            'timestamp': timestamp,
+            'label': label.rstrip(b'\0').decode('utf-8'),
+        }
+
+    # window: six sequences of samples (ax, ay, az, gx, gy, gz); returns the take id
+    def append(self, label, player, window):
+        check_label(label)
+        record = np.zeros((IMU_AXES, self.samples), dtype='<i2')
+        for axis, values in enumerate(window):
+            n = min(len(values), self.samples)
+            record[axis, :n] = values[:n]
+
+        entry = {'take_id': len(self.entries), 'player': player, 'deleted': False, 'timestamp': time.time(), 'label': label}
+        self.log.write(record.tobytes())
+        self.log.flush()
+        self.index.write(struct.pack(INDEX_FORMAT, entry['take_id'], player, 0, entry['timestamp'], label.encode('utf-8')))
+        self.index.flush()
+        self.entries.append(entry)
+        self.live.append(entry['take_id'])
+        return entry['take_id']
+
+    def delete(self, takeId):
+        os.pwrite(self.index.fileno(), b'\x01', takeId * INDEX_SIZE + DELETED_OFFSET)
+        self.entries[takeId]['deleted'] = True
+        if self.live and self.live[-1] == takeId:
+            self.live.pop()
+        elif takeId in self.live:
+            self.live.remove(takeId)
+
+    # tombstone the newest live take from take id since on; returns its id, or None if there is none
+    def undo_last(self, since=0):
+        if not self.live or self.live[-1] < since:
+            return None
+        takeId = self.live[-1]
+        self.delete(takeId)
+        return takeId
+
+    # int16 (6, samples) record of one take
+    def window(self, takeId):
+        record = os.pread(self.log.fileno(), self.record_size, LOG_HEADER_SIZE + takeId * self.record_size)
+        return np.frombuffer(record, dtype='<i2').reshape(IMU_AXES, self.samples)
+
+    # int16 (n, 6, samples) view of every record, deleted ones included
+    def windows(self):
+        if not self.entries:
+            return np.zeros((0, IMU_AXES, self.samples), dtype='<i2')
+        return np.memmap(self.log_path, dtype='<i2', mode='r', offset=LOG_HEADER_SIZE, shape=(len(self.entries), IMU_AXES, self.samples))
+
+    def takes(self, label=None, player=None, since=0):
+        return [entry for entry in self.entries[since:]
+                if not entry['deleted'] and (label is None or entry['label'] == label) and (player is None or entry['player'] == player)]
+
+    # live takes as CSV rows of six "[...]" cells, like the files in new_data/
+    def csv_rows(self, takes):
+        windows = self.windows()
+        for entry in takes:
+            yield csv_row(windows[entry['take_id']])
+
+    def export_csv(self, path, label=None, player=None):
+        takes = self.takes(label, player)
+        with open(path, 'w', newline='') as f:
+            f.writelines(self.csv_rows(takes))
+        return len(takes)
+
+    def close(self):
+        self.log.close()
+        self.index.close()
+
+
+class SessionExport:
+    # Rows already in the CSV when the session starts are kept. Each take of
+    # the session adds one row at the end, and undoing a take cuts its row off
+    # again: the newest live take is always the last row. The CSV is current
+    # after each take or undo and is never rewritten.
+    def __init__(self, store, path, label, player):
+        check_label(label)
+        self.store = store
+        self.path = path
+        self.label = label
+        self.player = player
+        self.since = len(store.entries)
+        self.rows = []  # (take id, offset of its row) of the session's live takes
+        self.csv = open_for_update(path)
+        self.end = os.fstat(self.csv.fileno()).st_size
+        if self.end and os.pread(self.csv.fileno(), 1, self.end - 1) != b'\n':
+            self.end += os.pwrite(self.csv.fileno(), b'\r\n', self.end)
+
+    # window: six sequences of samples; returns the take id
+    def append(self, window):
+        takeId = self.store.append(self.label, self.player, window)
+        row = csv_row(self.store.window(takeId)).encode('utf-8')
+        os.pwrite(self.csv.fileno(), row, self.end)
+        self.rows.append((takeId, self.end))
+        self.end += len(row)
+        return takeId
+
+    # tombstone the session's newest take and remove its row; returns its id, or None if there is none
+    def undo_last(self):
+        takeId = self.store.undo_last(self.since)
+        if takeId is None:
+            return None
+        _, self.end = self.rows.pop()
+        os.ftruncate(self.csv.fileno(), self.end)
+        return takeId
+
+    def close(self):
+        self.csv.close()
+
+
+# a (6, samples) window as a CSV row of six "[...]" cells, like the files in new_data/
+def csv_row(window):
+    return ','.join('"[' + ', '.join(map(str, axis)) + ']"' for axis in window.tolist()) + '\r\n'
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print('Usage: python recording_store.py <prefix> <csv> [label]')
+        sys.exit(1)
+    store = RecordingStore(sys.argv[1])
+    count = store.export_csv(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else None)
+    print(f'Exported {count} takes to {sys.argv[2]}')
+    store.close()
@@ -0,0 +1,132 @@
+#!/usr/bin/env python
+
+# Per-checkpoint confidence thresholds for predict_action's streaming mode.
+#
+# At a checkpoint predict_action runs the whole CNN again on the samples
+# received so far, zero-padded to the full window: the model keeps no state
+# between checkpoints, so every checkpoint costs one full inference. A prefix
+# is also a different input from the window the model was trained on, and its
+# confidence means something else at 20 samples than at 50, so each
+# checkpoint gets its own threshold, calibrated on new_data/hand with:
+#   python stream_calibration.py
+#
+# Checkpoints are calibrated in order on the windows still undecided. A
+# threshold is the lowest confidence at which the early decisions are wrong no
+# more often than the full-window decisions on the same windows, so exiting
+# early does not cost accuracy; a checkpoint where no threshold does that is
+# left out. The recorded data has only a handful of such errors per
+# checkpoint, so a threshold tuned on them alone lets new ones through on
+# unseen windows; no threshold goes below STREAM_MIN_CONFIDENCE (0.998 keeps
+# the held-out accuracy of the full window over several random halvings).
+# A checkpoint that would decide fewer than STREAM_MIN_EXIT_SHARE of the
+# windows reaching it costs one inference per window for almost nothing and
+# is left out too. The report tunes on one half of the windows and checks on
+# the other, and counts the inferences per window streaming costs.
+#
+# On new_data/hand only the 40 and 50 sample checkpoints are kept. They decide
+# 42% of the windows early without a wrong early decision on either held-out
+# half, but every window then costs about 2.4 inferences instead of 1, which is
+# why STREAM_INFERENCE is off by default.
+
+import json
+import os
+
+import numpy as np
+
+import imu_dataset
+import numpy_model
+
+STREAM_THRESHOLDS = os.getenv('STREAM_THRESHOLDS', 'stream_thresholds.json')
+STREAM_MODEL = 'gesture_model_hand_augmented_59.h5'
+HAND_DATA = os.path.join('new_data', 'hand')
+DATASIZE = 59
+STREAM_MIN_CONFIDENCE = float(os.getenv('STREAM_MIN_CONFIDENCE', '0.998'))
+STREAM_MIN_EXIT_SHARE = float(os.getenv('STREAM_MIN_EXIT_SHARE', '0.05'))
+
+
+def prefix_predictions(model, windows, samples):
+    prefixes = windows.copy()
+    prefixes[:, :, samples:] = 0
+    inputs = np.empty((len(windows),) + model.input_shape, dtype=np.float32)
+    numpy_model.scale_into(prefixes, inputs)
+    return model.predict(inputs)
+
+
+# early exits of the checkpoints and the inferences each window took; thresholds: {samples: threshold}
+def simulate(thresholds, confidence, correct, mask):
+    undecided = mask.copy()
+    decided = np.zeros_like(mask)
+    inferences = np.zeros(len(mask))
+    early = correct['full'].copy()
+    for samples, threshold in sorted(thresholds.items()):
+        inferences[undecided] += 1
+        exit = undecided & (confidence[samples] >= threshold)
+        early[exit] = correct[samples][exit]
+        decided |= exit
+        undecided &= ~exit
+    inferences[undecided] += 1
+    return early, decided, inferences
+
+
+# lowest threshold per checkpoint above every early decision on the tuning
+# windows that is wrong where the full window is right
+def tune(checkpoints, confidence, correct, mask, floor=STREAM_MIN_CONFIDENCE, minExitShare=STREAM_MIN_EXIT_SHARE):
+    thresholds = {}
+    undecided = mask.copy()
+    for samples in checkpoints:
+        # lower the threshold from the top until it lets a new error through
+        for threshold in np.unique(np.round(confidence[samples][undecided], 4))[::-1]:
+            exit = undecided & (confidence[samples] >= threshold)
+            if (~correct[samples][exit] & correct['full'][exit]).any():
+                break
+            thresholds[samples] = max(float(threshold), floor)
+        if samples in thresholds and (undecided & (confidence[samples] >= thresholds[samples])).sum() < minExitShare * undecided.sum():
+            del thresholds[samples]  # not worth an inference on every window
+        if samples in thresholds:
+            undecided &= confidence[samples] < thresholds[samples]
+    return thresholds
+
+
+def calibrate(checkpoints, model_path=STREAM_MODEL, data_dir=HAND_DATA):
+    model, classes = numpy_model.load_bundled(model_path)
+    windows, labels = imu_dataset.load_dir(data_dir, DATASIZE)
+    rng = np.random.default_rng(0)
+    tuneMask = rng.random(len(labels)) < 0.5
+
+    confidence, correct = {}, {}
+    for samples in list(checkpoints) + ['full']:
+        probabilities = prefix_predictions(model, windows, DATASIZE if samples == 'full' else samples)
+        confidence[samples] = probabilities.max(axis=1)
+        correct[samples] = np.array(classes)[probabilities.argmax(axis=1)] == labels
+
+    thresholds = tune(checkpoints, confidence, correct, np.ones(len(labels), dtype=bool))
+
+    # the same tuning on one half, checked on the other
+    for name, candidate, mask in [('fixed 0.95', {samples: 0.95 for samples in checkpoints}, np.ones(len(labels), dtype=bool)),
+                                  ('held-out', tune(checkpoints, confidence, correct, tuneMask), ~tuneMask),
+                                  ('held-out', tune(checkpoints, confidence, correct, ~tuneMask), tuneMask),
+                                  ('all', thresholds, np.ones(len(labels), dtype=bool))]:
+        early, decided, inferences = simulate(candidate, confidence, correct, mask)
+        print(f'{name:10}  early exits {decided[mask].mean():6.1%}  wrong early {(~early)[decided].sum():3} '
+              f'vs full window {(~correct["full"])[decided].sum():3}  accuracy {early[mask].mean():.4f} vs {correct["full"][mask].mean():.4f}  '
+              f'inferences per window {inferences[mask].mean():.2f}')
+    for samples in checkpoints:
+        print(f'{samples:3} samples: ' + (f'threshold {thresholds[samples]:.4f}' if samples in thresholds else 'no early exit'))
+    return {'model': os.path.basename(model_path), 'thresholds': {str(samples): threshold for samples, threshold in thresholds.items()}}
+
+
+def load_thresholds(path=STREAM_THRESHOLDS):
+    # {samples: threshold}; checkpoints that are not in the file never exit early
+    with open(path) as f:
+        config = json.load(f)
+    return {int(samples): threshold for samples, threshold in config['thresholds'].items()}
+
+
+if __name__ == '__main__':
+    STREAM_CHECKPOINT = int(os.getenv('STREAM_CHECKPOINT', '10'))
+    STREAM_MIN_SAMPLES = int(os.getenv('STREAM_MIN_SAMPLES', '20'))
+    first = -(-STREAM_MIN_SAMPLES // STREAM_CHECKPOINT) * STREAM_CHECKPOINT
+    config = calibrate(range(first, DATASIZE, STREAM_CHECKPOINT))
+    with open(STREAM_THRESHOLDS, 'w') as f:
+        json.dump(config, f, indent=4)
+    print(f'Saved {STREAM_THRESHOLDS}')
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the imu_data modules the way its scripts do, from their folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,89 @@
+import os
+
+import numpy as np
+import pytest
+
+import imu_augment
+import imu_dataset
+
+HAND_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'new_data', 'hand')
+
+
+@pytest.fixture(scope='module')
+def windows():
+    return imu_dataset.load_csv(os.path.join(HAND_DATA, 'bomb.csv'), 59)[:32]
+
+
+def only(name, strength, probability=1.0):
+    return {name: (strength, probability)}
+
+
+def test_augment_keeps_shape_and_dtype(windows):
+    augmented = imu_augment.augment(windows, np.random.default_rng(0))
+
+    assert augmented.shape == windows.shape
+    assert augmented.dtype == np.int16
+    assert not np.array_equal(augmented, windows)
+
+
+def test_augment_is_reproducible_with_a_seed(windows):
+    first = imu_augment.augment(windows, np.random.default_rng(7))
+    again = imu_augment.augment(windows, np.random.default_rng(7))
+    other = imu_augment.augment(windows, np.random.default_rng(8))
+
+    np.testing.assert_array_equal(first, again)
+    assert not np.array_equal(first, other)
+
+
+def test_augment_batches_are_reproducible(windows):
+    labels = np.arange(len(windows))
+    runs = [list(imu_augment.augment_batches(windows, labels, batch_size=10, factor=2, seed=3)) for _ in range(2)]
+
+    assert [len(batch) for batch, _ in runs[0]] == [10, 10, 10, 2] * 2
+    for (first, firstLabels), (again, againLabels) in zip(*runs):
+        np.testing.assert_array_equal(first, again)
+        np.testing.assert_array_equal(firstLabels, againLabels)
+
+
+def test_time_shift_fills_with_zero():
+    samples = np.arange(1, 11, dtype=np.float64)
+    batch = np.broadcast_to(samples, (50, 6, 10))
+
+    shifted = imu_augment.time_shift(batch, 3, np.random.default_rng(0))
+
+    # the same draw as time_shift's: sample t of window i comes from t - shift[i]
+    shifts = np.random.default_rng(0).integers(-3, 4, size=50)
+    assert set(shifts) == set(range(-3, 4))
+    for window, shift in zip(shifted, shifts):
+        source = np.arange(10) - shift
+        expected = np.where((source >= 0) & (source < 10), source + 1, 0)
+        np.testing.assert_array_equal(window, np.broadcast_to(expected, (6, 10)))
+
+
+def test_dropout_zeros_whole_samples():
+    batch = np.ones((200, 6, 59))
+
+    dropped = imu_augment.dropout(batch, 0.05, np.random.default_rng(0))
+
+    zeroed = dropped == 0
+    # every axis of a lost sample reads 0, like a packet that never arrived
+    assert (zeroed.all(axis=1) == zeroed.any(axis=1)).all()
+    assert set(np.unique(dropped)) == {0, 1}
+    assert zeroed[:, 0].mean() == pytest.approx(0.05, abs=0.01)
+
+
+def test_rotation_preserves_vector_norms(windows):
+    batch = windows.astype(np.float64)
+
+    rotated = imu_augment.rotation(batch, 0.25, np.random.default_rng(0))
+
+    for sensor in (slice(0, 3), slice(3, 6)):
+        np.testing.assert_allclose(np.linalg.norm(rotated[:, sensor], axis=1), np.linalg.norm(batch[:, sensor], axis=1), rtol=1e-9)
+    assert not np.allclose(rotated, batch)
+
+
+def test_transforms_apply_only_to_their_share(windows):
+    augmented = imu_augment.augment(windows, np.random.default_rng(0), only('jitter', 200, probability=0.5))
+
+    changed = (augmented != windows).any(axis=(1, 2))
+    assert 0 < changed.sum() < len(windows)
@@ -0,0 +1,153 @@
+import glob
+import json
+import os
+
+import h5py
+import numpy as np
+import pytest
+
+import imu_dataset
+import numpy_model
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+IMU_DATA = os.path.join(HERE, '..')
+# Keras probabilities for the first window of every new_data recording, made once
+# with TensorFlow by running this file: PYTHONPATH=. python tests/test_numpy_model.py
+REFERENCE = os.path.join(HERE, 'numpy_model_reference.npz')
+# float32 sums in a different order than TensorFlow; the largest gap seen is ~3e-7
+TOLERANCE = 1e-4
+REFERENCE_SAMPLES = 60
+
+
+def reference_windows(folder):
+    paths = sorted(glob.glob(os.path.join(IMU_DATA, 'new_data', folder, '*.csv')))
+    return np.stack([imu_dataset.load_csv(path, REFERENCE_SAMPLES)[0] for path in paths])
+
+
+def model_inputs(model, windows):
+    windows = imu_dataset.fit_samples(windows, model.input_shape[0] // 6)
+    return numpy_model.scale_into(windows, np.empty((len(windows),) + model.input_shape, dtype=np.float32))
+
+
+def data_folder(model_name):
+    return 'leg' if numpy_model.BUNDLED_MODELS[model_name][0] == 'label_encoder_leg.pkl' else 'hand'
+
+
+@pytest.mark.parametrize('model_name', sorted(numpy_model.BUNDLED_MODELS))
+def test_bundled_model_matches_keras(model_name):
+    reference = np.load(REFERENCE)
+    model, classes = numpy_model.load_bundled(os.path.join(IMU_DATA, model_name))
+    windows = reference[f'{data_folder(model_name)}_windows']
+
+    outputs = model.predict(model_inputs(model, windows))
+
+    assert outputs.shape == (len(windows), len(classes))
+    np.testing.assert_allclose(outputs, reference[model_name], rtol=0, atol=TOLERANCE)
+
+
+def test_int16_table_is_the_minmax_scaling():
+    values = np.arange(-2**15, 2**15, dtype=np.int64)
+    # MinMaxScaler(feature_range=(-1, 1)) fitted on the int16 range, in float64
+    expected = (values - -2**15) / (2**15 - 1 - -2**15) * 2 - 1
+
+    table = numpy_model.INT16_TABLE[values.astype(np.int16).view(np.uint16)]
+
+    assert table.dtype == np.float32
+    np.testing.assert_allclose(table, expected, rtol=0, atol=np.finfo(np.float32).eps)
+    assert table[[0, 2**15 - 1, 2**15, -1]].tolist() == pytest.approx([-1, -1 / (2**16 - 1), 1 / (2**16 - 1), 1], abs=1e-9)
+
+
+def test_scale_into_fills_the_model_input():
+    windows = np.array([[[-2**15, -1, 0, 2**15 - 1]] * 6] * 2, dtype=np.int16)
+    out = np.empty((2, 24, 1), dtype=np.float32)
+
+    result = numpy_model.scale_into(windows, out)
+
+    assert result is out
+    assert out.shape == (2, 24, 1) and out.dtype == np.float32
+    np.testing.assert_array_equal(out.reshape(windows.shape), numpy_model.INT16_TABLE[windows.view(np.uint16)])
+    # axis-major, like the CSV rows: every axis is one run of samples
+    np.testing.assert_allclose(out[0, :4, 0], [-1, -1 / (2**16 - 1), 1 / (2**16 - 1), 1], atol=1e-7)
+
+
+def write_model(path, layers, weights):
+    # a minimal Keras-style .h5: model_config plus model_weights/<layer>/<layer>/<name>
+    config = {'class_name': 'Sequential', 'config': {'layers': layers}}
+    with h5py.File(path, 'w') as f:
+        f.attrs['model_config'] = json.dumps(config)
+        group = f.create_group('model_weights')
+        for layer, values in weights.items():
+            layer_group = group.create_group(layer)
+            names = []
+            for name, value in values.items():
+                layer_group[f'{layer}/{name}'] = np.asarray(value, dtype=np.float32)
+                names.append(f'{layer}/{name}'.encode('utf-8'))
+            layer_group.attrs['weight_names'] = names
+
+
+def layer(class_name, name, **config):
+    return {'class_name': class_name, 'config': dict(config, name=name)}
+
+
+def test_hand_built_model(tmp_path):
+    path = str(tmp_path / 'model.h5')
+    layers = [
+        layer('InputLayer', 'input', batch_shape=[None, 4, 1]),
+        layer('Conv1D', 'conv', filters=2, kernel_size=[2], activation='relu'),
+        layer('BatchNormalization', 'bn', epsilon=0.0),
+        layer('MaxPooling1D', 'pool', pool_size=[2]),
+        layer('Flatten', 'flatten'),
+        layer('Dense', 'dense', activation='linear'),
+    ]
+    weights = {
+        # filter 0 sums neighbours, filter 1 takes the difference
+        'conv': {'kernel': [[[1, -1]], [[1, 1]]], 'bias': [0, 0]},
+        'bn': {'gamma': [2, 1], 'beta': [0, 1], 'moving_mean': [1, 0], 'moving_variance': [1, 4]},
+        'dense': {'kernel': [[1], [0]], 'bias': [0.5]},
+    }
+    write_model(path, layers, weights)
+    model = numpy_model.load_model(path)
+
+    x = np.array([1, 2, 4, 3], dtype=np.float32)
+    # conv: steps (1, 2), (2, 4), (4, 3) -> [[3, 1], [6, 2], [7, 0]] after relu
+    # bn:   filter 0 -> 2 * (v - 1), filter 1 -> v / 2 + 1 -> [[4, 1.5], [10, 2], [12, 1]]
+    # pool: size 2 over 3 steps keeps one window -> [[10, 2]]
+    # dense: 10 * 1 + 2 * 0 + 0.5
+    assert model.input_shape == (4, 1)
+    assert model.output_shape == (1,)
+    np.testing.assert_allclose(model.predict(x), [[10.5]])
+    assert model.macs == 3 * 2 * 1 * 2 + 2 * 1
+
+
+def test_average_pooling_same_counts_only_valid_positions():
+    pool = numpy_model.LAYERS['AveragePooling1D']({'pool_size': 2, 'padding': 'same'}, {}, (3, 1))
+    x = np.array([[[2], [4], [9]]], dtype=np.float32)
+
+    # the last window has one real step, so it is not halved by the padding
+    np.testing.assert_allclose(pool(x), [[[3], [9]]])
+
+
+def test_batch_normalization_leaves_its_input_alone():
+    bn = numpy_model.BatchNormalization({}, {'moving_mean': np.ones(1, np.float32), 'moving_variance': np.ones(1, np.float32)}, (2, 1))
+    x = np.ones((1, 2, 1), dtype=np.float32)
+
+    bn(x)
+
+    np.testing.assert_array_equal(x, 1)
+
+
+def make_reference():
+    import tensorflow as tf
+
+    arrays = {f'{folder}_windows': reference_windows(folder) for folder in ('hand', 'leg')}
+    for model_name in sorted(numpy_model.BUNDLED_MODELS):
+        keras_model = tf.keras.models.load_model(os.path.join(IMU_DATA, model_name), compile=False)
+        model = numpy_model.load_model(os.path.join(IMU_DATA, model_name))
+        inputs = model_inputs(model, arrays[f'{data_folder(model_name)}_windows'])
+        arrays[model_name] = keras_model.predict(inputs, verbose=0).astype(np.float32)
+        print(f'{model_name}: max abs difference {np.abs(model.predict(inputs) - arrays[model_name]).max():.3g}')
+    np.savez_compressed(REFERENCE, **arrays)
+
+
+if __name__ == '__main__':
+    make_reference()
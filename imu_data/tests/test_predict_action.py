@@ -0,0 +1,107 @@
+import importlib
+import os
+import struct
+from types import SimpleNamespace
+
+import numpy as np
+import pytest
+
+import imu_dataset
+import numpy_model
+import stream_calibration
+
+IMU_DATA = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..')
+DATASIZE = stream_calibration.DATASIZE
+
+
+@pytest.fixture(scope='module')
+def hand_windows():
+    model = numpy_model.load_model(os.path.join(IMU_DATA, stream_calibration.STREAM_MODEL))
+    windows, labels = imu_dataset.load_dir(os.path.join(IMU_DATA, stream_calibration.HAND_DATA), DATASIZE)
+    confidence = {samples: stream_calibration.prefix_predictions(model, windows, samples).max(axis=1) for samples in (40, 50)}
+    return windows, confidence
+
+
+@pytest.fixture
+def predict_action(monkeypatch):
+    pytest.importorskip('bluepy')
+    # the module loads its model and labels relative to imu_data
+    monkeypatch.chdir(IMU_DATA)
+    module = importlib.import_module('predict_action')
+    monkeypatch.setattr(module, 'STREAM_INFERENCE', True)
+    monkeypatch.setattr(module, 'streamThresholds', stream_calibration.load_thresholds())
+    module.reset_data_packet()
+    yield module
+    module.reset_data_packet()
+
+
+@pytest.fixture
+def shown(monkeypatch, predict_action):
+    shown = []
+    monkeypatch.setattr(predict_action, 'show_overlay', shown.append)
+    return shown
+
+
+@pytest.fixture
+def inferences(monkeypatch, predict_action):
+    # the windows each checkpoint classified
+    inferences = []
+    classify = predict_action.classify
+
+    def counting_classify(window=predict_action.imuWindow):
+        inferences.append(window.copy())
+        return classify(window)
+
+    monkeypatch.setattr(predict_action, 'classify', counting_classify)
+    return inferences
+
+
+def receive(predict_action, window, positions):
+    connection = SimpleNamespace(device=SimpleNamespace(delegate=SimpleNamespace(payload=b'')))
+    for seq in positions:
+        predict_action.dataPacket['seq'] = seq
+        connection.device.delegate.payload = struct.pack('<hhhhhh', *window[:, seq])
+        predict_action.BLEConnection.appendImuData(connection)
+
+
+def test_confident_window_is_decided_at_its_checkpoint(predict_action, hand_windows, shown, inferences):
+    windows, confidence = hand_windows
+    thresholds = predict_action.streamThresholds
+    window = windows[np.flatnonzero(confidence[40] >= thresholds[40])[0]]
+
+    receive(predict_action, window, range(39))
+    assert not predict_action.streamState['isDecided']
+    receive(predict_action, window, [39])
+
+    assert predict_action.streamState['isDecided']
+    assert len(shown) == 1
+    receive(predict_action, window, range(40, DATASIZE))
+    assert len(inferences) == 1
+    assert not inferences[0][:, 40:].any()
+
+
+def test_unsure_window_falls_through_to_the_full_window(predict_action, hand_windows, shown, inferences):
+    windows, confidence = hand_windows
+    thresholds = predict_action.streamThresholds
+    window = windows[np.flatnonzero((confidence[40] < thresholds[40]) & (confidence[50] < thresholds[50]))[0]]
+
+    receive(predict_action, window, range(DATASIZE))
+
+    assert not predict_action.streamState['isDecided']
+    assert not shown
+    assert len(inferences) == 2  # the 40 and 50 sample checkpoints
+    predict_action.predict_action()
+    assert len(shown) == 1
+    np.testing.assert_array_equal(inferences[-1], window)
+
+
+def test_checkpoint_after_lost_samples_uses_the_prefix(predict_action, hand_windows, inferences):
+    windows, _ = hand_windows
+
+    # samples 38 to 41 lost: checkpoint 40 runs when sample 42 arrives, on samples 0 to 39
+    receive(predict_action, windows[0], list(range(38)) + [42])
+
+    assert len(inferences) == 1
+    expected = windows[0].copy()
+    expected[:, 38:] = 0
+    np.testing.assert_array_equal(inferences[0], expected)
@@ -0,0 +1,91 @@
+import numpy as np
+import pytest
+
+import recording_store
+
+SAMPLES = 3
+
+
+def window(value, samples=SAMPLES):
+    return [[value + axis] * samples for axis in range(recording_store.IMU_AXES)]
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = recording_store.RecordingStore(str(tmp_path / 'session'), SAMPLES)
+    yield store
+    store.close()
+
+
+def test_takes_survive_reopening(tmp_path, store):
+    first = store.append('bomb', 1, window(1))
+    second = store.append('shield', 2, window(2, samples=2))
+    store.close()
+
+    reopened = recording_store.RecordingStore(str(tmp_path / 'session'))
+    assert reopened.samples == SAMPLES
+    assert [take['take_id'] for take in reopened.takes()] == [first, second]
+    np.testing.assert_array_equal(reopened.window(first), np.array(window(1)))
+    assert not reopened.window(second)[:, 2:].any()
+    reopened.close()
+
+
+def test_undo_tombstones_the_newest_live_take(tmp_path, store):
+    for i in range(3):
+        store.append('bomb', 1, window(i))
+
+    assert store.undo_last() == 2
+    assert store.undo_last() == 1
+    assert [take['take_id'] for take in store.takes()] == [0]
+    # the records stay in the log, only the index entries are flagged
+    assert len(store.windows()) == 3
+    store.close()
+
+    reopened = recording_store.RecordingStore(str(tmp_path / 'session'))
+    assert [entry['deleted'] for entry in reopened.entries] == [False, True, True]
+    assert reopened.undo_last() == 0
+    assert reopened.undo_last() is None
+    reopened.close()
+
+
+def test_undo_stops_at_the_start_of_the_session(store):
+    store.append('bomb', 1, window(0))
+    since = len(store.entries)
+    store.append('bomb', 1, window(1))
+
+    assert store.undo_last(since) == 1
+    assert store.undo_last(since) is None
+    assert [take['take_id'] for take in store.takes()] == [0]
+
+
+def test_partial_append_is_cut_off_on_open(tmp_path, store):
+    store.append('bomb', 1, window(1))
+    store.log.write(b'\x01\x02\x03')  # an append interrupted after part of its record
+    store.log.flush()
+    store.close()
+
+    reopened = recording_store.RecordingStore(str(tmp_path / 'session'))
+    assert len(reopened.entries) == 1
+    assert reopened.append('bomb', 1, window(2)) == 1
+    np.testing.assert_array_equal(reopened.window(1), np.array(window(2)))
+    reopened.close()
+
+
+def test_session_export_appends_rows_and_undo_cuts_them(tmp_path, store):
+    csv = tmp_path / 'bomb.csv'
+    csv.write_text('"[0]","[0]","[0]","[0]","[0]","[0]"')  # earlier rows, no trailing newline
+    export = recording_store.SessionExport(store, str(csv), 'bomb', 1)
+
+    export.append(window(1))
+    export.append(window(2))
+    assert export.undo_last() == 1
+    export.close()
+
+    rows = csv.read_bytes().split(b'\r\n')
+    assert rows[0] == b'"[0]","[0]","[0]","[0]","[0]","[0]"'
+    assert rows[1:] == [recording_store.csv_row(np.array(window(1))).rstrip('\r\n').encode(), b'']
+
+
+def test_long_labels_are_rejected(store):
+    with pytest.raises(ValueError):
+        store.append('x' * (recording_store.LABEL_SIZE + 1), 1, window(0))
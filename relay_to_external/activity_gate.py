@@ -0,0 +1,118 @@
+#!/usr/bin/env python
+
+# Relay-side activity gate for IMU windows.
+#
+# The Beetles also fire windows while the player is standing still or just
+# shaking the arm. Those never map to a game action but still cost the AI
+# engine a model inference, so each completed window is scored here first:
+#
+#   score = sum of accelerometer std over ax/ay/az + sum of gyro RMS over gx/gy/gz
+#
+# and only windows inside [min score, max score] are published. The default
+# bands come from the recorded datasets in imu_data/new_data (run this file to
+# recalibrate): the lower bound separates stationary windows from actions, the
+# upper bound (hand only) separates shaking from actions.
+
+import os
+
+import numpy as np
+
+# device: (min score, max score); 0 disables a bound
+DEFAULT_BANDS = {
+    'glove': (18866, 98669),
+    'leg': (36660, 0),
+}
+
+# classes in imu_data/new_data that are not game actions, the same as
+# IDLE_ACTIONS in imu_data/inference_service.py; walking and running score
+# below most kicks, so the leg band only has a lower bound
+IDLE_CLASSES = {
+    'glove': {'low': ['stationary'], 'high': ['shaking']},
+    'leg': {'low': ['stationary_leg', 'walk', 'run'], 'high': []},
+}
+
+# share of each action class's windows the calibrated band may drop, in percent
+ACTION_KEEP_PERCENTILE = 0.5
+
+
+def window_score(imu_data):
+    window = np.asarray(imu_data, dtype=np.float32)
+    accel = window[:3].std(axis=1).sum()
+    gyro = np.sqrt(np.square(window[3:]).mean(axis=1)).sum()
+    return float(accel + gyro)
+
+
+def window_scores(windows):
+    # vectorised over a (n, 6, samples) batch, used for calibration
+    windows = np.asarray(windows, dtype=np.float32)
+    accel = windows[:, :3].std(axis=2).sum(axis=1)
+    gyro = np.sqrt(np.square(windows[:, 3:]).mean(axis=2)).sum(axis=1)
+    return accel + gyro
+
+
+class ActivityGate:
+    def __init__(self, device):
+        defaultMin, defaultMax = DEFAULT_BANDS[device]
+        self.device = device
+        self.minScore = float(os.getenv(f'ACTIVITY_MIN_SCORE_{device.upper()}', defaultMin))
+        self.maxScore = float(os.getenv(f'ACTIVITY_MAX_SCORE_{device.upper()}', defaultMax))
+        self.passed = 0
+        self.suppressedIdle = 0
+        self.suppressedExcess = 0
+        print(f'[DEBUG] Activity gate for {device}: min score {self.minScore:.0f}, max score {self.maxScore:.0f}')
+
+    def accept(self, imu_data):
+        score = window_score(imu_data)
+        if score < self.minScore:
+            self.suppressedIdle += 1
+        elif self.maxScore > 0 and score > self.maxScore:
+            self.suppressedExcess += 1
+        else:
+            self.passed += 1
+            return True
+        print(f'[DEBUG] Suppressed IMU window (score {score:.0f}): {self.suppressedIdle} idle, {self.suppressedExcess} excess, {self.passed} passed')
+        return False
+
+
+def calibrate(data_dir, device, samples):
+    import csv
+    import glob
+    import json
+
+    scores = {}
+    for path in sorted(glob.glob(os.path.join(data_dir, '*.csv'))):
+        with open(path) as f:
+            rows = list(csv.reader(f))
+        windows = np.zeros((len(rows), 6, samples), dtype=np.int16)
+        for i, row in enumerate(rows):
+            for axis, cell in enumerate(row):
+                values = json.loads(cell)[:samples]
+                windows[i, axis, :len(values)] = values
+        scores[os.path.splitext(os.path.basename(path))[0]] = window_scores(windows)
+
+    idle = IDLE_CLASSES[device]
+    # bounded per class: a pooled percentile lets one class lose far more than its share
+    actions = [s for name, s in scores.items() if name not in idle['low'] + idle['high']]
+    # and in whole windows: a class of 87 windows may not drop any
+    dropped = [int(len(s) * ACTION_KEEP_PERCENTILE / 100) for s in actions]
+    actionLow = min(np.sort(s)[n] for s, n in zip(actions, dropped))
+    actionHigh = max(np.sort(s)[len(s) - 1 - n] for s, n in zip(actions, dropped))
+
+    idleLow = np.percentile(np.concatenate([scores[name] for name in idle['low']]), 99)
+    minScore = min((idleLow + actionLow) / 2, actionLow)
+    maxScore = 0
+    if idle['high']:
+        idleHigh = np.percentile(np.concatenate([scores[name] for name in idle['high']]), 5)
+        maxScore = max((idleHigh + actionHigh) / 2, actionHigh)
+
+    for name, s in scores.items():
+        kept = np.mean((s >= minScore) & ((maxScore == 0) | (s <= maxScore)))
+        print(f'{device:6} {name:16} windows {len(s):4}  kept {kept:6.1%}')
+    return int(np.floor(minScore)), int(np.ceil(maxScore))
+
+
+if __name__ == '__main__':
+    DATA_DIR = os.getenv('IMU_DATA_DIR', os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'imu_data', 'new_data'))
+    for device, folder, samples in [('glove', 'hand', 59), ('leg', 'leg', 40)]:
+        band = calibrate(os.path.join(DATA_DIR, folder), device, samples)
+        print(f'{device}: {band}')
@@ -0,0 +1,91 @@
+#!/usr/bin/env python
+
+# Expiry and backpressure for the IMU windows the relays send to AI_QUEUE.
+#
+# An IMU window is only useful for a second or two. IMU_TTL_MS gives every
+# window a per-message expiration, so the broker drops windows the AI engine
+# did not get to in time instead of queueing them up.
+#
+# With AI_BACKPRESSURE=1 the relay also watches AI_QUEUE itself: a passive
+# declare on its own channel returns the number of ready messages and
+# consumers every BACKPRESSURE_POLL_MS. From that depth the relay picks a mode:
+#   normal      depth below DOWNSAMPLE_DEPTH: every window is sent
+#   downsample  depth from DOWNSAMPLE_DEPTH: only every DOWNSAMPLE_EVERY-th window is sent
+#   drop        depth from DROP_DEPTH, or no consumer at all: windows are dropped
+# A mode is left only once the depth falls below half of its threshold, so
+# the relay does not flap around a threshold.
+
+import asyncio
+import os
+
+IMU_TTL_MS = int(os.getenv('IMU_TTL_MS', '0'))
+AI_BACKPRESSURE = os.getenv('AI_BACKPRESSURE', '0') == '1'
+BACKPRESSURE_POLL_MS = float(os.getenv('BACKPRESSURE_POLL_MS', '200'))
+DOWNSAMPLE_DEPTH = int(os.getenv('DOWNSAMPLE_DEPTH', '8'))
+DOWNSAMPLE_EVERY = int(os.getenv('DOWNSAMPLE_EVERY', '2'))
+DROP_DEPTH = int(os.getenv('DROP_DEPTH', '32'))
+
+NORMAL, DOWNSAMPLE, DROP = 'normal', 'downsample', 'drop'
+
+
+# keyword arguments for aio_pika.Message of an IMU window
+def imu_message_properties():
+    return {'expiration': IMU_TTL_MS / 1000} if IMU_TTL_MS > 0 else {}
+
+
+class AiBackpressure:
+    def __init__(self, queue_name):
+        self.queue_name = queue_name
+        self.mode = NORMAL
+        self.depth = 0
+        self.consumers = None
+        self.windows = 0
+        self.sent = 0
+        self.downsampled = 0
+        self.dropped = 0
+        self.task = None
+
+    async def start(self, connection):
+        self.connection = connection
+        self.channel = await connection.channel()
+        self.task = asyncio.create_task(self.poll())
+        print(f'[DEBUG] Backpressure on {self.queue_name}: downsample from {DOWNSAMPLE_DEPTH}, drop from {DROP_DEPTH} ready messages')
+
+    async def poll(self):
+        while True:
+            try:
+                # passive: only reads the counts, never creates the queue
+                queue = await self.channel.declare_queue(self.queue_name, passive=True)
+                self.update(queue.declaration_result.message_count, queue.declaration_result.consumer_count)
+            except Exception as e:
+                # a failed declare closes the channel
+                print(f'[ERROR] Backpressure poll of {self.queue_name}: {e}')
+                if self.channel.is_closed:
+                    self.channel = await self.connection.channel()
+            await asyncio.sleep(BACKPRESSURE_POLL_MS / 1000)
+
+    def update(self, depth, consumers):
+        self.depth, self.consumers = depth, consumers
+        if consumers == 0 or depth >= DROP_DEPTH:
+            mode = DROP
+        elif self.mode == DROP and depth >= DROP_DEPTH // 2:
+            mode = DROP
+        elif depth >= DOWNSAMPLE_DEPTH or (self.mode != NORMAL and depth >= DOWNSAMPLE_DEPTH // 2):
+            mode = DOWNSAMPLE
+        else:
+            mode = NORMAL
+        if mode != self.mode:
+            print(f'[DEBUG] {self.queue_name}: {self.mode} -> {mode} (depth {depth}, {consumers} consumers); sent {self.sent}, downsampled {self.downsampled}, dropped {self.dropped}')
+            self.mode = mode
+
+    # whether the next window should be published
+    def admit(self):
+        self.windows += 1
+        if self.mode == DROP:
+            self.dropped += 1
+            return False
+        if self.mode == DOWNSAMPLE and self.windows % DOWNSAMPLE_EVERY:
+            self.downsampled += 1
+            return False
+        self.sent += 1
+        return True
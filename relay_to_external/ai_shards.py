@@ -0,0 +1,77 @@
+#!/usr/bin/env python
+
+# Per-player sharding of the IMU windows for several inference workers.
+#
+# With AI_SHARDING=1 the relays publish IMU windows to the topic exchange
+# AI_EXCHANGE with the routing key imu.p{player}.{device} instead of to
+# AI_QUEUE. Every (player, device) pair is a shard owned by exactly one of
+# AI_SHARD_COUNT workers: the shards of the PLAYERS are dealt out round-robin
+# (gloves first, so the busier glove windows are spread evenly). Worker i
+# consumes the durable queue ai_shard_{i}, bound to the keys of the shards it
+# owns. A shard is always read from a single queue with a single active
+# consumer, so each player's windows stay in order while the players are
+# spread over workers on other cores or machines.
+#
+# The queues are durable and keep their bindings across restarts, so a worker
+# also unbinds the keys of the PLAYERS' shards it no longer owns: after a
+# change of AI_SHARD_COUNT or PLAYERS a shard would otherwise reach two
+# workers and its actions would be sent twice. The queue of a worker that is
+# no longer started (an index at or above a reduced AI_SHARD_COUNT) keeps its
+# bindings until it is deleted, e.g. rabbitmqctl delete_queue ai_shard_2.
+#   AI_SHARD_INDEX=0 AI_SHARD_COUNT=2 python inference_service.py
+#   AI_SHARD_INDEX=1 AI_SHARD_COUNT=2 python inference_service.py
+
+import os
+import zlib
+
+import aio_pika
+
+AI_SHARDING = os.getenv('AI_SHARDING', '0') == '1'
+AI_EXCHANGE = os.getenv('AI_EXCHANGE', 'ai_exchange')
+AI_SHARD_COUNT = int(os.getenv('AI_SHARD_COUNT', '1'))
+AI_SHARD_INDEX = int(os.getenv('AI_SHARD_INDEX', '0'))
+PLAYERS = [int(p) for p in os.getenv('PLAYERS', '1,2').split(',')]
+DEVICES = ['glove', 'leg']
+
+
+def routing_key(player_id, device):
+    return f'imu.p{player_id}.{device}'
+
+
+# worker that owns a shard; relays and workers have to agree on PLAYERS
+def shard_owner(player_id, device, shard_count=AI_SHARD_COUNT, players=PLAYERS):
+    shards = [(p, d) for d in DEVICES for p in sorted(players)]
+    if (player_id, device) in shards:
+        return shards.index((player_id, device)) % shard_count
+    # players outside PLAYERS still get a stable owner (crc32, unlike hash(), is the same in every process)
+    return zlib.crc32(routing_key(player_id, device).encode()) % shard_count
+
+
+def shard_queue_name(index):
+    return f'ai_shard_{index}'
+
+
+# the queue holding a relay's windows, e.g. for watching its depth
+def queue_for(player_id, device):
+    return shard_queue_name(shard_owner(player_id, device))
+
+
+async def declare_exchange(channel):
+    return await channel.declare_exchange(AI_EXCHANGE, aio_pika.ExchangeType.TOPIC, durable=True)
+
+
+# declare worker index's queue, bound to exactly the shards it owns, and return it
+async def declare_shard_queue(channel, index=AI_SHARD_INDEX, shard_count=AI_SHARD_COUNT, players=PLAYERS):
+    exchange = await declare_exchange(channel)
+    queue = await channel.declare_queue(shard_queue_name(index), durable=True, arguments={'x-single-active-consumer': True})
+    owned = []
+    for player_id in players:
+        for device in DEVICES:
+            if shard_owner(player_id, device, shard_count, players) == index:
+                owned.append((player_id, device))
+                await queue.bind(exchange, routing_key=routing_key(player_id, device))
+            else:
+                # left over from an earlier configuration; unbinding a missing binding is a no-op
+                await queue.unbind(exchange, routing_key=routing_key(player_id, device))
+    print(f"[DEBUG] Shard {index}/{shard_count}: {', '.join(routing_key(*shard) for shard in owned) or 'no shards'}")
+    return queue
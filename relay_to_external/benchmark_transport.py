@@ -0,0 +1,108 @@
+#!/usr/bin/env python
+
+# Side-by-side benchmark of the AMQP and MQTT transports (transport.py).
+#
+# For every transport a publisher and a subscriber connect to BENCH_BROKER.
+# Gun actions with a latency trace are published one at a time, and each is
+# timed from the publish call until the subscriber has received it. The CPU
+# time of this process (both clients together) is divided over the messages.
+# Run it against a local broker so the network does not drown out the client
+# cost, e.g. a RabbitMQ with the MQTT plugin enabled:
+#   docker run -d -p 5672:5672 -p 1883:1883 rabbitmq:3.13 \
+#       sh -c 'rabbitmq-plugins enable --offline rabbitmq_mqtt && rabbitmq-server'
+#   BENCH_BROKER=localhost BROKERUSER=guest PASSWORD=guest python benchmark_transport.py [amqp mqtt0 mqtt1]
+# Results are printed as a table and saved to BENCH_JSON.
+
+import asyncio
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import latency_trace
+import transport
+
+BENCH_BROKER = os.getenv('BENCH_BROKER', 'localhost')
+BENCH_MESSAGES = int(os.getenv('BENCH_MESSAGES', '1000'))
+BENCH_WARMUP = int(os.getenv('BENCH_WARMUP', '50'))
+BENCH_JSON = os.getenv('BENCH_JSON', 'transport_benchmark.json')
+BENCH_TOPIC = 'transport_benchmark'
+
+
+async def benchmark(kind):
+    publisher = transport.make_transport(kind, BENCH_BROKER)
+    subscriber = transport.make_transport(kind, BENCH_BROKER)
+    await publisher.connect()
+    await subscriber.connect()
+    deliveries = subscriber.subscribe(BENCH_TOPIC)
+    # the first __anext__ subscribes, so start it before publishing anything
+    pending = asyncio.ensure_future(deliveries.__anext__())
+    await asyncio.sleep(0.5)
+
+    latencies = []
+    try:
+        for i in range(BENCH_WARMUP + BENCH_MESSAGES):
+            if i == BENCH_WARMUP:
+                cpuStart = time.process_time()
+                wallStart = time.perf_counter()
+            trace = latency_trace.new_trace(1, 'glove')
+            body = json.dumps({'action': True, 'action_type': 'gun', 'player_id': 1, 'hit': 1, 'seq': i}).encode('utf-8')
+            start = time.perf_counter_ns()
+            await publisher.publish(BENCH_TOPIC, body, **latency_trace.message_properties(trace, 'gun'))
+            delivery = await asyncio.wait_for(pending, timeout=5)
+            end = time.perf_counter_ns()
+            pending = asyncio.ensure_future(deliveries.__anext__())
+            if delivery.correlation_id != trace[0]:
+                raise RuntimeError(f'{kind}: expected {trace[0]}, received {delivery.correlation_id}')
+            if i >= BENCH_WARMUP:
+                latencies.append((end - start) / 1000)
+        cpu = time.process_time() - cpuStart
+        wall = time.perf_counter() - wallStart
+    finally:
+        pending.cancel()
+        try:
+            await pending
+        except BaseException:
+            pass
+        await deliveries.aclose()
+        await publisher.close()
+        await subscriber.close()
+
+    latencies = np.array(latencies)
+    return {
+        'messages': len(latencies),
+        'p50_us': float(np.percentile(latencies, 50)),
+        'p90_us': float(np.percentile(latencies, 90)),
+        'p99_us': float(np.percentile(latencies, 99)),
+        'max_us': float(latencies.max()),
+        'cpu_us_per_message': cpu / len(latencies) * 1e6,
+        'cpu_share': cpu / wall,
+    }
+
+
+def print_report(results):
+    print(f"\n{'transport':<10}{'p50 us':>10}{'p90 us':>10}{'p99 us':>10}{'max us':>10}{'cpu us/msg':>12}{'cpu %':>8}")
+    for kind, result in results.items():
+        print(f"{kind:<10}{result['p50_us']:>10.0f}{result['p90_us']:>10.0f}{result['p99_us']:>10.0f}{result['max_us']:>10.0f}"
+              f"{result['cpu_us_per_message']:>12.0f}{result['cpu_share'] * 100:>8.1f}")
+
+
+async def main(kinds):
+    results = {}
+    for kind in kinds:
+        print(f'[DEBUG] Benchmarking {kind} on {BENCH_BROKER} ({BENCH_MESSAGES} messages)...')
+        try:
+            results[kind] = await benchmark(kind)
+        except Exception as e:
+            print(f'[ERROR] {kind}: {e}')
+    return results
+
+
+if __name__ == '__main__':
+    results = asyncio.run(main(sys.argv[1:] or ['amqp', 'mqtt0', 'mqtt1']))
+    print_report(results)
+    with open(BENCH_JSON, 'w') as f:
+        json.dump(results, f, indent=4)
+    print(f'\nSaved {BENCH_JSON}')
@@ -0,0 +1,205 @@
+#!/usr/bin/env python
+
+# Flight recorder: the last few thousand BLE frames and broker messages of a relay.
+#
+# Every raw notification (MyDelegate.handleNotification), every frame written
+# to the beetle, every broker message published or consumed and a few events
+# (CRC failures, handshakes) are stored with their time.monotonic_ns() in two
+# preallocated rings of fixed-size slots: one for BLE frames and events, one
+# for broker messages (truncated to the slot size, the full length is kept).
+# Recording is a struct.pack_into and a slice copy, 1-2 microseconds, and
+# the memory never grows.
+#
+# The rings are written to RECORDER_DIR as flight-<name>-<time>-<reason>.bin:
+#   on demand   kill -USR1 <pid>
+#   on a crash  the servers dump when their main loop raises
+#   on anomaly  RECORDER_CRC_BURST checksum failures within a second, or
+#               RECORDER_HANDSHAKE_LOOP failed handshakes within ten seconds
+# On demand and on anomaly the relay is still running, so the rings are only
+# copied on the event loop and written out by a worker thread.
+# Read a dump with read_dump(), or print it:
+#   python flight_recorder.py flight-glove_p1-20241101-153000-crc_burst.bin
+
+import asyncio
+import collections
+import os
+import signal
+import struct
+import sys
+import threading
+import time
+
+FLIGHT_RECORDER = os.getenv('FLIGHT_RECORDER', '1') == '1'
+RECORDER_DIR = os.getenv('RECORDER_DIR', '.')
+RECORDER_FRAME_SLOTS = int(os.getenv('RECORDER_FRAME_SLOTS', '8192'))
+RECORDER_MESSAGE_SLOTS = int(os.getenv('RECORDER_MESSAGE_SLOTS', '256'))
+RECORDER_CRC_BURST = int(os.getenv('RECORDER_CRC_BURST', '5'))
+RECORDER_HANDSHAKE_LOOP = int(os.getenv('RECORDER_HANDSHAKE_LOOP', '5'))
+# anomaly dumps of the same kind are at least this many seconds apart
+RECORDER_DUMP_COOLDOWN = float(os.getenv('RECORDER_DUMP_COOLDOWN', '30'))
+
+FRAME_SLOT_SIZE = 48
+MESSAGE_SLOT_SIZE = 4096
+
+# record kinds
+BLE_RX = 1
+BLE_TX = 2
+MQ_OUT = 3
+MQ_IN = 4
+EVENT = 5
+KIND_NAMES = {BLE_RX: 'ble_rx', BLE_TX: 'ble_tx', MQ_OUT: 'mq_out', MQ_IN: 'mq_in', EVENT: 'event'}
+
+# seq, monotonic ns, kind, original length, stored length
+RECORD_FORMAT = struct.Struct('<IqBHH')
+# magic, version, wall clock ns and monotonic ns at the time of the dump, records
+DUMP_HEADER_FORMAT = struct.Struct('<4sHqqI')
+DUMP_MAGIC = b'FLTR'
+DUMP_VERSION = 1
+
+Record = collections.namedtuple('Record', ['seq', 'ns', 'kind', 'length', 'payload'])
+
+
+class Ring:
+    def __init__(self, slots, slotSize):
+        self.slots = slots
+        self.slotSize = slotSize
+        self.buffer = bytearray(slots * slotSize)
+        self.count = 0
+
+    def put(self, seq, ns, kind, data):
+        offset = (self.count % self.slots) * self.slotSize
+        stored = min(len(data), self.slotSize - RECORD_FORMAT.size)
+        RECORD_FORMAT.pack_into(self.buffer, offset, seq, ns, kind, min(len(data), 0xffff), stored)
+        start = offset + RECORD_FORMAT.size
+        self.buffer[start:start + stored] = memoryview(data)[:stored]
+        self.count += 1
+
+    def copy(self):
+        ring = Ring.__new__(Ring)
+        ring.slots = self.slots
+        ring.slotSize = self.slotSize
+        ring.buffer = bytearray(self.buffer)
+        ring.count = self.count
+        return ring
+
+    # the occupied slots as raw records, oldest first
+    def slices(self):
+        first = max(0, self.count - self.slots)
+        for i in range(first, self.count):
+            offset = (i % self.slots) * self.slotSize
+            header = RECORD_FORMAT.unpack_from(self.buffer, offset)
+            yield header[0], self.buffer[offset:offset + RECORD_FORMAT.size + header[-1]]
+
+
+class FlightRecorder:
+    def __init__(self, name='relay'):
+        self.name = name
+        self.frames = Ring(RECORDER_FRAME_SLOTS, FRAME_SLOT_SIZE)
+        self.messages = Ring(RECORDER_MESSAGE_SLOTS, MESSAGE_SLOT_SIZE)
+        self.seq = 0
+        self.crcFailures = collections.deque(maxlen=RECORDER_CRC_BURST)
+        self.handshakeFailures = collections.deque(maxlen=RECORDER_HANDSHAKE_LOOP)
+        self.lastDump = {}
+
+    def install(self, name):
+        self.name = name.replace(' ', '_')
+        # called from the relay's event loop, which runs the handler
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR1, self.dump_in_background, 'signal')
+        print(f'[DEBUG] Flight recorder: {RECORDER_FRAME_SLOTS} frames, {RECORDER_MESSAGE_SLOTS} messages; SIGUSR1 to pid {os.getpid()} dumps them')
+
+    def record(self, kind, data):
+        self.seq += 1
+        ring = self.messages if kind == MQ_OUT or kind == MQ_IN else self.frames
+        ring.put(self.seq, time.monotonic_ns(), kind, data)
+
+    def ble_rx(self, data):
+        self.record(BLE_RX, data)
+
+    def ble_tx(self, packet):
+        self.record(BLE_TX, packet)
+
+    # routing key (or queue) and body, separated by a NUL
+    def published(self, routing_key, body):
+        self.record(MQ_OUT, routing_key.encode('utf-8') + b'\0' + body)
+
+    def consumed(self, routing_key, body):
+        self.record(MQ_IN, (routing_key or '').encode('utf-8') + b'\0' + body)
+
+    def event(self, text):
+        self.record(EVENT, text.encode('utf-8'))
+
+    def crc_failure(self):
+        self.event('crc_failure')
+        now = time.monotonic()
+        self.crcFailures.append(now)
+        if len(self.crcFailures) == RECORDER_CRC_BURST and now - self.crcFailures[0] <= 1:
+            self.anomaly('crc_burst')
+
+    def handshake(self, ok):
+        self.event('handshake_ok' if ok else 'handshake_failed')
+        if ok:
+            self.handshakeFailures.clear()
+            return
+        now = time.monotonic()
+        self.handshakeFailures.append(now)
+        if len(self.handshakeFailures) == RECORDER_HANDSHAKE_LOOP and now - self.handshakeFailures[0] <= 10:
+            self.anomaly('handshake_loop')
+
+    def anomaly(self, reason):
+        now = time.monotonic()
+        if now - self.lastDump.get(reason, -RECORDER_DUMP_COOLDOWN) < RECORDER_DUMP_COOLDOWN:
+            return
+        self.lastDump[reason] = now
+        self.dump_in_background(reason)
+
+    # copy the rings (about 1.4 MB) and write them from a worker thread
+    def dump_in_background(self, reason):
+        frames, messages = self.frames.copy(), self.messages.copy()
+        threading.Thread(target=self.write_dump, args=(reason, frames, messages), name='recorder-dump', daemon=True).start()
+
+    def dump(self, reason):
+        return self.write_dump(reason, self.frames, self.messages)
+
+    def write_dump(self, reason, frames, messages):
+        records = sorted(list(frames.slices()) + list(messages.slices()))
+        path = os.path.join(RECORDER_DIR, f"flight-{self.name}-{time.strftime('%Y%m%d-%H%M%S')}-{reason}.bin")
+        try:
+            with open(path, 'wb') as f:
+                f.write(DUMP_HEADER_FORMAT.pack(DUMP_MAGIC, DUMP_VERSION, time.time_ns(), time.monotonic_ns(), len(records)))
+                for _, record in records:
+                    f.write(record)
+        except OSError as e:
+            print(f'[ERROR] Flight recorder dump to {path}: {e}')
+            return None
+        print(f'[DEBUG] Flight recorder: dumped {len(records)} records to {path} ({reason})')
+        return path
+
+
+# (wall clock ns, monotonic ns) at the time of the dump, and its records oldest first
+def read_dump(path):
+    with open(path, 'rb') as f:
+        data = f.read()
+    magic, version, wallNs, monotonicNs, count = DUMP_HEADER_FORMAT.unpack_from(data)
+    if magic != DUMP_MAGIC or version != DUMP_VERSION:
+        raise ValueError(f'{path} is not a flight recorder dump')
+    records = []
+    offset = DUMP_HEADER_FORMAT.size
+    for _ in range(count):
+        seq, ns, kind, length, stored = RECORD_FORMAT.unpack_from(data, offset)
+        offset += RECORD_FORMAT.size
+        records.append(Record(seq, ns, kind, length, data[offset:offset + stored]))
+        offset += stored
+    return (wallNs, monotonicNs), records
+
+
+recorder = FlightRecorder() if FLIGHT_RECORDER else None
+
+
+if __name__ == '__main__':
+    (wallNs, monotonicNs), records = read_dump(sys.argv[1])
+    for record in records:
+        wall = (wallNs - (monotonicNs - record.ns)) / 1e9
+        stamp = time.strftime('%H:%M:%S', time.localtime(wall)) + f'.{int(wall % 1 * 1e6):06d}'
+        payload = record.payload.decode('utf-8', 'replace') if record.kind in (MQ_OUT, MQ_IN, EVENT) else record.payload.hex(' ')
+        truncated = f' ({record.length} bytes)' if record.length > len(record.payload) else ''
+        print(f'{stamp} {record.seq:>8} {KIND_NAMES.get(record.kind, record.kind):<7} {payload}{truncated}')
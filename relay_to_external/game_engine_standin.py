@@ -0,0 +1,174 @@
+#!/usr/bin/env python
+
+# Minimal stand-in for the game engine, for testing the relays without it.
+#
+# Consumes actions and status updates from UPDATE_GE_QUEUE, applies simplified
+# game rules and broadcasts the new game state on UPDATE_EVERYONE_EXCHANGE in
+# the format the relays read. The correlation_id and headers of each action
+# are echoed on its broadcast (see latency_trace.py); the real game engine
+# has to do the same for closed-loop latency tracing. With TRANSPORT set the
+# broadcasts also go to the topic UPDATE_EVERYONE_TOPIC, where the relays read
+# them then (see transport.py).
+
+import asyncio
+import json
+import os
+
+from dotenv import load_dotenv
+import aio_pika
+
+import latency_trace
+import priority_lanes
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Broker configurations
+BROKER = os.getenv('BROKER')
+BROKERUSER = os.getenv('BROKERUSER')
+PASSWORD = os.getenv('PASSWORD')
+RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', '5672'))
+
+# RabbitMQ queues
+UPDATE_GE_QUEUE = os.getenv('UPDATE_GE_QUEUE', 'update_ge_queue')
+
+# RabbitMQ exchanges
+UPDATE_EVERYONE_EXCHANGE = os.getenv('UPDATE_EVERYONE_EXCHANGE', 'update_everyone_exchange')
+
+# Game engine messages and broadcasts go through transport.py when TRANSPORT is set;
+# it needs aiomqtt and paho, so it is only imported then
+TRANSPORT = os.getenv('TRANSPORT', '')
+if TRANSPORT:
+    import transport
+
+MAX_HP = 100
+MAX_BULLETS = 6
+MAX_SHIELDS = 3
+SHIELD_HP = 30
+GUN_DAMAGE = 5
+ACTION_DAMAGE = 10
+# AI predictions that hurt the opponent
+ATTACK_ACTIONS = {'basket', 'bomb', 'bowl', 'volley', 'soccer'}
+
+
+def new_player():
+    return {
+        'hp': MAX_HP,
+        'bullets': MAX_BULLETS,
+        'shield_hp': 0,
+        'shields': MAX_SHIELDS,
+        'opponent_hit': False,
+        'opponent_shield_hit': False,
+    }
+
+
+class GameEngineStandin:
+    def __init__(self):
+        self.rabbitmq_connection = None
+        self.channel = None
+        self.exchange = None
+        self.transport = transport.make_transport() if TRANSPORT else None
+        self.game_state = {'p1': new_player(), 'p2': new_player()}
+
+    async def setup_rabbitmq(self):
+        print('[DEBUG] Connecting to RabbitMQ broker...')
+        self.rabbitmq_connection = await aio_pika.connect_robust(
+            host=BROKER,
+            port=RABBITMQ_PORT,
+            login=BROKERUSER,
+            password=PASSWORD,
+        )
+        self.channel = await self.rabbitmq_connection.channel()
+        self.update_ge_queue = await self.channel.declare_queue(UPDATE_GE_QUEUE, durable=True, arguments=priority_lanes.ge_queue_arguments())
+        self.exchange = await self.channel.declare_exchange(UPDATE_EVERYONE_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True)
+        if self.transport is not None:
+            await self.transport.connect()
+            await transport.bind_queue(self.channel, UPDATE_GE_QUEUE, arguments=priority_lanes.ge_queue_arguments())
+            print(f'[DEBUG] Broadcasting on {transport.UPDATE_EVERYONE_TOPIC} over {self.transport.name} as well')
+        print(f'[DEBUG] Connected to RabbitMQ broker at {BROKER}:{RABBITMQ_PORT}')
+
+    def damage(self, player, amount):
+        absorbed = min(player['shield_hp'], amount)
+        player['shield_hp'] -= absorbed
+        player['hp'] -= amount - absorbed
+        if player['hp'] <= 0:
+            player.update(new_player())
+        return absorbed > 0
+
+    def apply_action(self, player_id, action_type, data):
+        player = self.game_state[f'p{player_id}']
+        opponent = self.game_state[f'p{3 - player_id}']
+        player['opponent_hit'] = player['opponent_shield_hit'] = False
+
+        hit = False
+        if action_type == 'gun':
+            if player['bullets'] > 0:
+                player['bullets'] -= 1
+                hit = bool(data.get('hit', 0))
+            damage = GUN_DAMAGE
+        elif action_type == 'reload':
+            if player['bullets'] == 0:
+                player['bullets'] = MAX_BULLETS
+        elif action_type == 'shield':
+            if player['shields'] > 0 and player['shield_hp'] == 0:
+                player['shields'] -= 1
+                player['shield_hp'] = SHIELD_HP
+        elif action_type in ATTACK_ACTIONS:
+            hit = True
+            damage = ACTION_DAMAGE
+
+        if hit:
+            shieldHit = self.damage(opponent, damage)
+            player['opponent_shield_hit'] = shieldHit
+            player['opponent_hit'] = not shieldHit
+
+    def apply_status(self, game_state):
+        for player_key, status in game_state.items():
+            if player_key in self.game_state:
+                self.game_state[player_key].update(status)
+
+    async def handle_message(self, message):
+        async with message.process():
+            try:
+                data = json.loads(message.body.decode('utf-8'))
+            except json.JSONDecodeError:
+                print(f'[ERROR] Invalid JSON payload: {message.body[:100]}')
+                return
+
+            broadcast = {'game_state': self.game_state}
+            if data.get('action'):
+                action_type = data.get('action_type')
+                player_id = data.get('player_id')
+                if player_id not in (1, 2):
+                    print(f'[ERROR] Invalid player_id in action: {data}')
+                    return
+                self.apply_action(player_id, action_type, data)
+                broadcast['action'] = action_type
+                broadcast['player_id'] = player_id
+                print(f'[DEBUG] P{player_id} {action_type}: {self.game_state}')
+            elif data.get('update'):
+                self.apply_status(data.get('game_state', {}))
+
+            body = json.dumps(broadcast).encode('utf-8')
+            await self.exchange.publish(
+                aio_pika.Message(body=body, **latency_trace.forward_properties(message)),
+                routing_key='',
+            )
+            if self.transport is not None:
+                await self.transport.publish(transport.UPDATE_EVERYONE_TOPIC, body, **latency_trace.forward_properties(message))
+
+    async def run(self):
+        await self.setup_rabbitmq()
+        async with self.update_ge_queue.iterator() as queue_iter:
+            async for message in queue_iter:
+                await self.handle_message(message)
+
+
+if __name__ == '__main__':
+    game_engine = GameEngineStandin()
+    try:
+        asyncio.run(game_engine.run())
+    except KeyboardInterrupt:
+        print('[DEBUG] Game engine stand-in stopped by user')
+    except Exception as e:
+        print(f'[ERROR] {e}')
@@ -0,0 +1,281 @@
+#!/usr/bin/env python
+
+# Shared-memory ring of IMU windows between a relay and a co-located AI engine.
+#
+# One ring per player/device (single producer = the beetle server, single
+# consumer = the AI engine). Each slot holds one fixed-size int16 window of
+# shape (6, samples). The producer bumps a per-slot sequence number after the
+# window is written and then the ring write counter, so the consumer never
+# needs a lock; a named FIFO next to the ring is used as the notification fd.
+# The consumer copies a slot out and then checks its sequence number again, so
+# a window the producer overwrote during the copy is dropped, not handed on
+# torn. The producer counts the unread windows it overwrites (HDR_READ_SEQ).
+# The FIFO also tells the producer whether a consumer is attached at all:
+# opening its write end fails with ENXIO when nobody holds the read end.
+# A freshly started producer announces itself on the FIFO so a consumer that
+# is still mapped onto a previous relay's ring re-attaches to the new one.
+# The FIFO therefore outlives the producer: it is never unlinked, and a
+# consumer whose FIFO was replaced anyway (is_stale) has to be reopened.
+
+import errno
+import os
+import select
+import stat
+from multiprocessing import resource_tracker, shared_memory
+
+import numpy as np
+
+IMU_AXES = 6
+RING_SLOTS = int(os.getenv('IMU_SHM_SLOTS', '16'))
+FIFO_DIR = os.getenv('IMU_SHM_FIFO_DIR', '/tmp')
+
+# header words (int64)
+MAGIC = 0x494D5531  # 'IMU1'
+HDR_MAGIC = 0
+HDR_SLOTS = 1
+HDR_SAMPLES = 2
+HDR_WRITE_SEQ = 3
+HDR_READ_SEQ = 4
+HDR_ATTACH_SEQ = 5  # write counter when the current consumer was announced
+HEADER_WORDS = 8
+
+SLOT_WRITING = -1
+
+# FIFO notification bytes
+NOTIFY_WINDOW = b'\x01'
+NOTIFY_RING_CREATED = b'\x02'
+
+
+def ring_name(player_id, device):
+    return f'imu_p{player_id}_{device}'
+
+
+def fifo_path(player_id, device):
+    return os.path.join(FIFO_DIR, f'{ring_name(player_id, device)}.fifo')
+
+
+def ring_size(slots, samples):
+    return (HEADER_WORDS + slots) * 8 + slots * IMU_AXES * samples * 2
+
+
+def ensure_fifo(path):
+    try:
+        os.mkfifo(path, 0o600)
+    except FileExistsError:
+        if not stat.S_ISFIFO(os.stat(path).st_mode):
+            raise
+
+
+class _Ring:
+    # numpy views over the shared memory block
+    def _map(self, slots, samples):
+        buf = self.shm.buf
+        self.header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=buf)
+        self.slotSeq = np.ndarray((slots,), dtype=np.int64, buffer=buf, offset=HEADER_WORDS * 8)
+        self.windows = np.ndarray((slots, IMU_AXES, samples), dtype=np.int16, buffer=buf, offset=(HEADER_WORDS + slots) * 8)
+        self.slots = slots
+        self.samples = samples
+
+    def _unmap(self):
+        # views must be dropped before the mapping can be closed
+        self.header = None
+        self.slotSeq = None
+        self.windows = None
+
+
+class ImuRingWriter(_Ring):
+    def __init__(self, player_id, device, samples, slots=RING_SLOTS):
+        self.name = ring_name(player_id, device)
+        self.fifoPath = fifo_path(player_id, device)
+        self.fifoFd = None
+        self.overruns = 0
+        try:
+            self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=ring_size(slots, samples))
+        except FileExistsError:
+            # left behind by a relay that did not exit cleanly
+            stale = shared_memory.SharedMemory(name=self.name)
+            stale.close()
+            stale.unlink()
+            self.shm = shared_memory.SharedMemory(name=self.name, create=True, size=ring_size(slots, samples))
+        self._map(slots, samples)
+        self.slotSeq[:] = SLOT_WRITING
+        self.header[:] = 0
+        self.header[HDR_SLOTS] = slots
+        self.header[HDR_SAMPLES] = samples
+        self.header[HDR_MAGIC] = MAGIC
+        ensure_fifo(self.fifoPath)
+        print(f'[DEBUG] IMU shared memory ring {self.name}: {slots} slots x {samples} samples')
+
+    def is_consumer_attached(self):
+        if self.fifoFd is not None:
+            return True
+        try:
+            self.fifoFd = os.open(self.fifoPath, os.O_WRONLY | os.O_NONBLOCK)
+        except OSError as e:
+            if e.errno in (errno.ENXIO, errno.ENOENT):
+                return False
+            raise
+        self.header[HDR_ATTACH_SEQ] = self.header[HDR_WRITE_SEQ]
+        self.header[HDR_READ_SEQ] = self.header[HDR_WRITE_SEQ]
+        try:
+            os.write(self.fifoFd, NOTIFY_RING_CREATED)
+        except BlockingIOError:
+            pass
+        print(f'[DEBUG] AI engine attached to {self.name}')
+        return True
+
+    def _detach(self):
+        os.close(self.fifoFd)
+        self.fifoFd = None
+        print(f'[DEBUG] AI engine detached from {self.name}')
+
+    # Returns True if the window was handed to a local consumer; False means
+    # the caller should fall back to publishing on AI_QUEUE.
+    def write(self, ax, ay, az, gx, gy, gz):
+        if not self.is_consumer_attached():
+            return False
+
+        seq = int(self.header[HDR_WRITE_SEQ])
+        slot = seq % self.slots
+        if seq - int(self.header[HDR_READ_SEQ]) >= self.slots:
+            self.overruns += 1
+            if self.overruns & (self.overruns - 1) == 0:  # 1, 2, 4, 8, ...
+                print(f'[DEBUG] {self.name}: AI engine is behind, {self.overruns} unread windows overwritten')
+        self.slotSeq[slot] = SLOT_WRITING
+        window = self.windows[slot]
+        for axis, values in enumerate((ax, ay, az, gx, gy, gz)):
+            n = min(len(values), self.samples)
+            window[axis, :n] = values[:n]
+            window[axis, n:] = 0
+        self.slotSeq[slot] = seq
+        self.header[HDR_WRITE_SEQ] = seq + 1
+
+        try:
+            os.write(self.fifoFd, NOTIFY_WINDOW)
+        except BlockingIOError:
+            pass  # consumer already has unread notifications
+        except BrokenPipeError:
+            self._detach()
+            return False
+        return True
+
+    def close(self):
+        if self.fifoFd is not None:
+            os.close(self.fifoFd)
+            self.fifoFd = None
+        self._unmap()
+        self.shm.close()
+        self.shm.unlink()
+
+
+class ImuRingReader(_Ring):
+    def __init__(self, player_id, device):
+        self.name = ring_name(player_id, device)
+        self.playerId = player_id
+        self.device = device
+        self.overruns = 0
+        self.shm = None
+        self._attach()
+        self.readSeq = int(self.header[HDR_WRITE_SEQ])  # only new windows
+        self.fifoPath = fifo_path(player_id, device)
+        ensure_fifo(self.fifoPath)
+        # O_RDWR keeps a writer on the FIFO so a restarting relay never gives us EOF
+        self.fifoFd = os.open(self.fifoPath, os.O_RDWR | os.O_NONBLOCK)
+
+    def _attach(self):
+        # raises FileNotFoundError until the relay has created the ring
+        shm = shared_memory.SharedMemory(name=self.name)
+        # the relay owns the segment; stop our resource tracker unlinking it on exit
+        resource_tracker.unregister(shm._name, 'shared_memory')
+        header = np.ndarray((HEADER_WORDS,), dtype=np.int64, buffer=shm.buf)
+        magic, slots, samples = int(header[HDR_MAGIC]), int(header[HDR_SLOTS]), int(header[HDR_SAMPLES])
+        del header
+        if magic != MAGIC:
+            shm.close()
+            raise ValueError(f'{self.name} is not an IMU ring')
+        if self.shm is not None:
+            self._unmap()
+            self.shm.close()
+        self.shm = shm
+        self._map(slots, samples)
+
+    def fileno(self):
+        return self.fifoFd
+
+    # the FIFO was deleted or replaced, so a restarted relay can no longer reach us
+    def is_stale(self):
+        try:
+            return os.stat(self.fifoPath).st_ino != os.fstat(self.fifoFd).st_ino
+        except FileNotFoundError:
+            return True
+
+    def wait(self, timeout=None):
+        return bool(select.select([self.fifoFd], [], [], timeout)[0])
+
+    def _drain_notifications(self):
+        notifications = b''
+        try:
+            while True:
+                chunk = os.read(self.fifoFd, 4096)
+                if not chunk:
+                    break
+                notifications += chunk
+        except BlockingIOError:
+            pass
+        if NOTIFY_RING_CREATED in notifications:
+            self._attach()
+            self.readSeq = int(self.header[HDR_ATTACH_SEQ])
+            print(f'[DEBUG] Attached to ring {self.name} from relay')
+
+    # Yields (seq, window) where window is a (6, samples) int16 copy of the slot,
+    # checked against the slot's sequence number after the copy.
+    def read_available(self):
+        self._drain_notifications()
+        writeSeq = int(self.header[HDR_WRITE_SEQ])
+        if writeSeq - self.readSeq > self.slots:
+            self.overruns += writeSeq - self.readSeq - self.slots
+            self.readSeq = writeSeq - self.slots
+
+        while self.readSeq < writeSeq:
+            seq = self.readSeq
+            slot = seq % self.slots
+            self.readSeq += 1
+            self.header[HDR_READ_SEQ] = self.readSeq
+            if self.slotSeq[slot] != seq:  # overwritten before we got to it
+                self.overruns += 1
+                continue
+            window = self.windows[slot].copy()
+            if self.slotSeq[slot] != seq:  # overwritten while we copied it
+                self.overruns += 1
+                continue
+            yield seq, window
+
+    def close(self):
+        os.close(self.fifoFd)
+        self._unmap()
+        self.shm.close()
+
+
+if __name__ == '__main__':
+    # minimal local consumer, useful to check a relay is writing to its ring
+    import time
+
+    PLAYER_ID = int(os.getenv('PLAYER_ID', '1'))
+    DEVICE = os.getenv('IMU_DEVICE', 'glove')
+
+    reader = None
+    while reader is None:
+        try:
+            reader = ImuRingReader(PLAYER_ID, DEVICE)
+        except FileNotFoundError:
+            print(f'[DEBUG] Waiting for {ring_name(PLAYER_ID, DEVICE)}...')
+            time.sleep(1)
+
+    print(f'[DEBUG] Attached to {reader.name}')
+    try:
+        while True:
+            if reader.wait(1.0):
+                for seq, window in reader.read_available():
+                    print(f'[DEBUG] Window {seq}: ax[:5]={window[0, :5].tolist()} overruns={reader.overruns}')
+    except KeyboardInterrupt:
+        reader.close()
@@ -0,0 +1,160 @@
+#!/usr/bin/env python
+
+# Closed-loop action latency tracing.
+#
+# A correlation ID is assigned when the relay receives the frame that starts
+# an action (a SHOOT, a complete IMU window). It travels as the AMQP
+# correlation_id of every message the action causes, with the origin time and
+# action type as headers:
+#
+#   relay -> UPDATE_GE_QUEUE (or AI_QUEUE -> inference service -> UPDATE_GE_QUEUE)
+#         -> game engine -> update_everyone_exchange -> glove / vest relays
+#
+# The game engine (or game_engine_standin.py) copies correlation_id and headers
+# from the action onto its broadcast. The relays then record how long after the
+# origin the broadcast arrived and, on the vest, when the beetle ACKed the
+# resulting UPDATE. The latencies go into histograms per action type and stage.
+# A correlation id that new_trace did not make is not a trace and is ignored.
+# The origin time is the originating relay's wall clock in nanoseconds, and
+# each receiver subtracts it from its own time.time_ns(). Stages that end on
+# another machine (the inference service, the game engine, the other player's
+# vest relay) therefore include the clock offset between the two hosts: keep
+# them synchronised with NTP (chrony), or read those stages as offset plus
+# latency.
+
+import collections
+import json
+import os
+import re
+import time
+import uuid
+
+import numpy as np
+
+# Assign and record correlation IDs
+LATENCY_TRACE = os.getenv('LATENCY_TRACE', '0') == '1'
+LATENCY_TRACE_FILE = os.getenv('LATENCY_TRACE_FILE', '')
+REPORT_INTERVAL = float(os.getenv('LATENCY_REPORT_INTERVAL', '30'))
+# percentiles are taken over the most recent samples; counts and buckets cover every sample
+LATENCY_SAMPLES = int(os.getenv('LATENCY_SAMPLES', '10000'))
+
+ORIGIN_HEADER = 'x-origin-ns'
+ACTION_HEADER = 'x-action-type'
+
+# histogram bucket edges in milliseconds, log-spaced from 1 ms to 10 s
+BUCKET_EDGES_MS = np.logspace(0, 4, 41)
+
+DEVICES = ('glove', 'leg', 'vest')
+# correlation ids made by new_trace; any other correlation id is not a trace
+TRACE_ID = re.compile(r'p[1-9][0-9]*-(glove|leg|vest)-[0-9a-f]{12}')
+
+
+# trace for an action that starts now: (correlation id, origin ns)
+def new_trace(player_id, device):
+    if not isinstance(player_id, int) or player_id < 1 or device not in DEVICES:
+        raise ValueError(f'Invalid trace origin: player {player_id!r}, device {device!r}')
+    return f'p{player_id}-{device}-{uuid.uuid4().hex[:12]}', time.time_ns()
+
+
+# keyword arguments for aio_pika.Message carrying a trace
+def message_properties(trace, action_type):
+    if trace is None:
+        return {}
+    correlationId, originNs = trace
+    headers = {ORIGIN_HEADER: originNs}
+    if action_type is not None:
+        headers[ACTION_HEADER] = action_type
+    return {'correlation_id': correlationId, 'headers': headers}
+
+
+# the same properties copied from a received message, for forwarding
+def forward_properties(message, action_type=None):
+    if message.correlation_id is None:
+        return {}
+    headers = dict(message.headers or {})
+    if action_type is not None:
+        headers[ACTION_HEADER] = action_type
+    return {'correlation_id': message.correlation_id, 'headers': headers}
+
+
+# (correlation id, origin ns, action type) of a received message, or None
+def trace_of(message):
+    headers = message.headers or {}
+    if message.correlation_id is None or ORIGIN_HEADER not in headers:
+        return None
+    if not TRACE_ID.fullmatch(message.correlation_id):
+        return None  # another service's correlation id
+    try:
+        # MQTT user properties carry the origin as a string
+        originNs = int(headers[ORIGIN_HEADER])
+    except (TypeError, ValueError):
+        return None
+    actionType = headers.get(ACTION_HEADER)
+    if isinstance(actionType, bytes):
+        actionType = actionType.decode('utf-8')
+    return message.correlation_id, originNs, actionType
+
+
+class LatencyHistograms:
+    def __init__(self, name):
+        self.name = name
+        self.samples = {}  # (stage, action type) -> recent ms
+        self.counts = {}  # (stage, action type) -> samples per bucket
+        self.totals = collections.Counter()
+        self.maxMs = {}
+        self.seen = set()
+        self.lastReport = time.monotonic()
+
+    # stage: where the loop was closed (e.g. 'broadcast', 'vest_update')
+    def record(self, stage, trace, now_ns=None):
+        if trace is None:
+            return None
+        correlationId, originNs, actionType = trace
+        if (stage, correlationId) in self.seen:
+            return None
+        self.seen.add((stage, correlationId))
+        latencyMs = ((now_ns or time.time_ns()) - originNs) / 1e6
+        key = (stage, actionType)
+        if key not in self.samples:
+            self.samples[key] = collections.deque(maxlen=LATENCY_SAMPLES)
+            self.counts[key] = np.zeros(len(BUCKET_EDGES_MS) - 1, dtype=np.int64)
+        self.samples[key].append(latencyMs)
+        self.totals[key] += 1
+        self.maxMs[key] = max(self.maxMs.get(key, latencyMs), latencyMs)
+        if BUCKET_EDGES_MS[0] <= latencyMs <= BUCKET_EDGES_MS[-1]:
+            self.counts[key][min(np.searchsorted(BUCKET_EDGES_MS, latencyMs, side='right') - 1, len(BUCKET_EDGES_MS) - 2)] += 1
+        print(f'[TRACE] {correlationId} {actionType} {stage}: {latencyMs:.1f} ms')
+        if time.monotonic() - self.lastReport >= REPORT_INTERVAL:
+            self.report()
+        return latencyMs
+
+    def summary(self):
+        result = {}
+        for key, values in sorted(self.samples.items(), key=lambda item: tuple(map(str, item[0]))):
+            stage, actionType = key
+            values = np.array(values)
+            result[f'{stage}/{actionType}'] = {
+                'count': self.totals[key],
+                'p50_ms': float(np.percentile(values, 50)),
+                'p90_ms': float(np.percentile(values, 90)),
+                'p99_ms': float(np.percentile(values, 99)),
+                'max_ms': float(self.maxMs[key]),
+                'bucket_edges_ms': BUCKET_EDGES_MS.round(2).tolist(),
+                'bucket_counts': self.counts[key].tolist(),
+            }
+        return result
+
+    def report(self):
+        self.lastReport = time.monotonic()
+        for key, stats in self.summary().items():
+            print(f"[TRACE] {self.name} {key}: n={stats['count']} p50 {stats['p50_ms']:.1f} ms  p90 {stats['p90_ms']:.1f} ms  p99 {stats['p99_ms']:.1f} ms  max {stats['max_ms']:.1f} ms")
+        # IDs only matter until every stage had its chance to record them
+        if len(self.seen) > 10000:
+            self.seen.clear()
+
+    def save(self, path=LATENCY_TRACE_FILE):
+        if not path or not self.samples:
+            return
+        with open(path, 'w') as f:
+            json.dump({'name': self.name, 'histograms': self.summary()}, f, indent=4)
+        print(f'[TRACE] Saved latency histograms to {path}')
@@ -0,0 +1,104 @@
+#!/usr/bin/env python
+
+# Relay-side kick detection for leg IMU windows.
+#
+# The leg has a single game action, the kick ('soccer' in the leg label
+# encoder). Instead of waiting for the AI engine, the leg server classifies
+# each window with the NumPy port of gesture_model_real_leg.h5 (about 30 us
+# per window) and publishes a confident kick to the game engine itself. The
+# window is still sent to AI_QUEUE, flagged as an audit copy, so the engine
+# can log its own prediction without acting on it a second time.
+#
+# A missed kick still reaches the game engine through the AI engine, only
+# later; a false kick is acted on at once. KICK_CONFIDENCE is therefore set
+# for no false kicks. The model was trained on new_data/leg and there are no
+# other leg recordings, so running
+#   python leg_action_detector.py
+# also scores seeded augmented copies of the recordings (imu_augment.py) as a
+# stand-in for unseen windows. At 0.95 the recordings lose 2 of 162 kicks and
+# give no false kick; the augmented copies keep about 80% of the kicks and give
+# 1 false kick in 1190 other windows. At 0.9 they give one in almost every copy.
+
+import importlib.util
+import os
+import sys
+
+import numpy as np
+
+IMU_DATA_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'imu_data')
+
+
+# imu_data has its own myBle.py, so it is not put on sys.path; its modules are
+# loaded from their files instead
+def load_imu_data_module(name):
+    if name not in sys.modules:
+        spec = importlib.util.spec_from_file_location(name, os.path.join(IMU_DATA_DIR, f'{name}.py'))
+        module = importlib.util.module_from_spec(spec)
+        sys.modules[name] = module
+        spec.loader.exec_module(module)
+    return sys.modules[name]
+
+
+numpy_model = load_imu_data_module('numpy_model')
+
+LEG_MODEL = os.getenv('LEG_MODEL', os.path.join(IMU_DATA_DIR, 'gesture_model_real_leg.h5'))
+LEG_DATA = os.path.join(IMU_DATA_DIR, 'new_data', 'leg')
+KICK_ACTION = 'soccer'
+KICK_CONFIDENCE = float(os.getenv('KICK_CONFIDENCE', '0.95'))
+
+
+class LegActionDetector:
+    def __init__(self):
+        self.model, self.classes = numpy_model.load_bundled(LEG_MODEL)
+        self.samples = self.model.input_shape[0] // 6
+        self.window = np.zeros((6, self.samples), dtype=np.int16)
+        self.input = np.empty((1,) + self.model.input_shape, dtype=np.float32)
+        self.kicks = 0
+        self.windows = 0
+        print(f'[DEBUG] Leg action detector: {LEG_MODEL}, kick confidence {KICK_CONFIDENCE}')
+
+    def classify(self, imu_data):
+        self.window.fill(0)
+        for axis, values in enumerate(imu_data):
+            n = min(len(values), self.samples)
+            self.window[axis, :n] = values[:n]
+        numpy_model.scale_into(self.window, self.input)
+        probabilities = self.model.predict(self.input)[0]
+        index = int(np.argmax(probabilities))
+        return self.classes[index], float(probabilities[index])
+
+    # (is kick, label, confidence) for one window
+    def detect(self, imu_data):
+        label, confidence = self.classify(imu_data)
+        self.windows += 1
+        isKick = label == KICK_ACTION and confidence >= KICK_CONFIDENCE
+        if isKick:
+            self.kicks += 1
+        return isKick, label, confidence
+
+
+# kick recall and false kicks per threshold on the recordings and on augmented copies of them
+def evaluate(thresholds=(0.7, 0.8, 0.9, 0.95, 0.99), copies=5):
+    imu_dataset = load_imu_data_module('imu_dataset')
+    imu_augment = load_imu_data_module('imu_augment')
+    detector = LegActionDetector()
+    windows, labels = imu_dataset.load_dir(LEG_DATA, detector.samples)
+    isKick = labels == KICK_ACTION
+    print(f'{len(labels)} windows, {isKick.sum()} kicks')
+
+    sets = [('recorded', windows)] + [(f'augmented {seed}', imu_augment.augment(windows, np.random.default_rng(seed))) for seed in range(copies)]
+    for name, batch in sets:
+        inputs = np.empty((len(batch),) + detector.model.input_shape, dtype=np.float32)
+        numpy_model.scale_into(batch, inputs)
+        probabilities = detector.model.predict(inputs)
+        predicted = np.array(detector.classes)[probabilities.argmax(axis=1)] == KICK_ACTION
+        confidence = probabilities.max(axis=1)
+        scores = []
+        for threshold in thresholds:
+            kick = predicted & (confidence >= threshold)
+            scores.append(f'{threshold}: recall {kick[isKick].mean():.3f} false {kick[~isKick].sum()}')
+        print(f'{name:12}  ' + '  '.join(scores))
+
+
+if __name__ == '__main__':
+    evaluate()
@@ -9,6 +9,17 @@ from bluepy.btle import BTLEDisconnectError
 import struct
 import myBle
 import collections
+import imu_shm
+import activity_gate
+import time
+import latency_trace
+import priority_lanes
+import loop_monitor
+import sampling_profiler
+import flight_recorder
+import update_consumer
+import ai_backpressure
+import ai_shards
 
 # Load environment variables from .env file
 load_dotenv()
@@ -23,13 +34,34 @@ RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', '5672'))
 AI_QUEUE = os.getenv('AI_QUEUE', 'ai_queue')
 UPDATE_GE_QUEUE = os.getenv('UPDATE_GE_QUEUE', 'update_ge_queue')
 
+# Hand IMU windows to a co-located AI engine through shared memory when one is attached
+IMU_SHM = os.getenv('IMU_SHM', '0') == '1'
+
+# Drop IMU windows that do not look like an action before they reach the AI engine
+ACTIVITY_GATE = os.getenv('ACTIVITY_GATE', '0') == '1'
+
+# Recognise kicks on the relay and publish them to the game engine directly;
+# the window still goes to AI_QUEUE as an audit copy
+LEG_DETECTOR = os.getenv('LEG_DETECTOR', '0') == '1'
+
 # RabbitMQ exchanges
 UPDATE_EVERYONE_EXCHANGE = os.getenv('UPDATE_EVERYONE_EXCHANGE', 'update_everyone_exchange')
 
+# Game engine messages and broadcasts go through transport.py when TRANSPORT is set;
+# it needs aiomqtt and paho, so it is only imported then
+TRANSPORT = os.getenv('TRANSPORT', '')
+if TRANSPORT:
+    import transport
+
 # Player ID this server is handling
 PLAYER_ID = int(os.getenv('PLAYER_ID', '1'))
 print(f'[DEBUG] Player ID: {PLAYER_ID}')
 
+# with AI_SHARDING, IMU windows go through AI_EXCHANGE to the shard queue owning this relay
+AI_EXCHANGE = ai_shards.AI_EXCHANGE if ai_shards.AI_SHARDING else ''
+AI_ROUTING_KEY = ai_shards.routing_key(PLAYER_ID, 'leg') if ai_shards.AI_SHARDING else AI_QUEUE
+AI_WINDOW_QUEUE = ai_shards.queue_for(PLAYER_ID, 'leg') if ai_shards.AI_SHARDING else AI_QUEUE
+
 # BLE variables
 MAC_ADDR = os.getenv(f'LEG_P{PLAYER_ID}')
 IMU_SAMPLES = 40
@@ -48,11 +80,27 @@ dataPacket = {
     'gy': [0] * IMU_SAMPLES,
     'gz': [0] * IMU_SAMPLES,
     'imuCounter': 0,
-    'isAllImuReceived': False 
 }
 
+# Complete IMU windows not yet taken by send_imu_data; dataPacket only holds the one being received.
+# If send_imu_data falls behind, the oldest window is dropped and counted, like the IMU ring does.
+IMU_QUEUE_SIZE = int(os.getenv('IMU_QUEUE_SIZE', '8'))
+dataPacketQueue = collections.deque(maxlen=IMU_QUEUE_SIZE)
+imuQueueStats = {
+    'dropped': 0,
+}
+
+# Start a new IMU window in dataPacket
+def clear_imu_data():
+    for axis in ('ax', 'ay', 'az', 'gx', 'gy', 'gz'):
+        dataPacket[axis] = [0] * IMU_SAMPLES
+    dataPacket['imuCounter'] = 0
+
 # BLE connection
 class ExtendedBLEConnection(myBle.BLEConnection):
+    # arrival of the last DATA packet of the window being received, None between windows
+    imuLastAt = None
+
     # Unpack IMU data and store in dataPacket
     def appendImuData(self):
         unpackFormat = "<hhhhhh"
@@ -72,37 +120,24 @@ class ExtendedBLEConnection(myBle.BLEConnection):
         packetType = self.device.delegate.packetType
         seqReceived = self.device.delegate.seqReceived
         payload = self.device.delegate.payload
-            
+
+        if (self.imuLastAt is not None and packetType != myBle.DATA):
+            self.finishImuData()
+
+        # one packet of an IMU window; the window ends at its last sample, another packet type or IMU_TIMEOUT
         if (packetType == myBle.DATA):
-            dataPacket['seq'] = self.device.delegate.seqReceived
-            if (dataPacket['seq'] >= 5): # ignored those samples that stuck in buffer
-                return
-            
-            self.appendImuData()
-            
-            # Check if all IMU data is received
-            while (not dataPacket['isAllImuReceived'] and self.device.waitForNotifications(myBle.IMU_TIMEOUT)):
-                # handle packet
-                if (not self.device.delegate.isRxPacketReady): # in case of fragmentation
-                    continue
-                if (self.device.delegate.packetType != myBle.DATA):
-                    break
-
-                # get the imu data
-                dataPacket['seq'] = self.device.delegate.seqReceived
-                if (dataPacket['seq'] <= IMU_SAMPLES - 1):  # ignored extra samples
-                    self.appendImuData()
-                if (dataPacket['seq'] >= IMU_SAMPLES - 1):
-                    dataPacket['isAllImuReceived'] = True
-
-            # all imu data is received
-            dataPacket['isAllImuReceived'] = True
-            self.imuSeq = 0
-            print(f"[BLE] >> All IMU data is received.")
-        
-        # send SYNACK packet to finish the handshake
-        elif (packetType == myBle.SYNACK):
-            self.sendSYNACK(0)
+            if (self.imuLastAt is None):
+                if (seqReceived >= 5): # ignored those samples that stuck in buffer
+                    return
+                clear_imu_data() # drop what is left of a window cut off by a disconnect
+            self.imuLastAt = time.monotonic()
+
+            # get the imu data
+            dataPacket['seq'] = seqReceived
+            if (dataPacket['seq'] <= IMU_SAMPLES - 1):  # ignored extra samples
+                self.appendImuData()
+            if (dataPacket['seq'] >= IMU_SAMPLES - 1):
+                self.finishImuData()
         
         else:
             # invalid packet handling
@@ -110,104 +145,186 @@ class ExtendedBLEConnection(myBle.BLEConnection):
             print(f"[BLE] Unpack: {packetType} {payload}")
         return packetType
 
+    def finishImuData(self):
+        # the loop latency of an IMU window starts when it is complete
+        dataPacket['trace'] = latency_trace.new_trace(PLAYER_ID, 'leg') if latency_trace.LATENCY_TRACE else None
+        if (len(dataPacketQueue) == dataPacketQueue.maxlen):
+            imuQueueStats['dropped'] += 1
+            if (imuQueueStats['dropped'] & (imuQueueStats['dropped'] - 1) == 0): # 1, 2, 4, 8, ...
+                print(f"[BLE] >> IMU windows are not being sent, {imuQueueStats['dropped']} oldest windows dropped")
+        dataPacketQueue.append(dataPacket.copy())
+        clear_imu_data()
+        self.imuLastAt = None
+        print(f"[BLE] >> All IMU data is received.")
+
+    def stepTimers(self, now):
+        if (self.imuLastAt is not None and now - self.imuLastAt >= myBle.IMU_TIMEOUT):
+            self.finishImuData()
+
     async def run(self):
         while True:
             try: 
                 self = ExtendedBLEConnection(MAC_ADDR, myBle.SERVICE_UUID, myBle.CHAR_UUID)
-                self.establishConnection()
-                self.isHandshakeRequire = True
+                await self.connect()
                 while True:
-                    self.device.delegate.isRxPacketReady = False
-                    if ((self.device.delegate.invalidPacketCounter >= 5) or self.isHandshakeRequire):
-                        self.isHandshakeRequire = not self.performHandShake(seq=0,connectionStatus=connectionStatus, connectionStatusQueue=connectionStatusQueue)
+                    if (self.device.delegate.invalidPacketCounter >= 5):
+                        self.degrade()
+                    if (self.state != myBle.ESTABLISHED):
+                        self.stepHandShake(seq=0, connectionStatus=connectionStatus, connectionStatusQueue=connectionStatusQueue)
                     else:
-                        if(self.device.waitForNotifications(0.1) and self.device.delegate.isRxPacketReady):
-                            self.parseRxPacket()
-                        await asyncio.sleep(0.1)
+                        self.stepLink()
+                    await asyncio.sleep(self.pollInterval())
 
             except BTLEDisconnectError:
                 print("[BLE] >> Disconnected.")
+                self.setState(myBle.DISCONNECTED)
                 if (connectionStatus['isConnected']):
                     connectionStatus['isConnected'] = False
                     connectionStatusQueue.append(connectionStatus.copy())
                 await asyncio.sleep(0.1)
 
 # Functions to get data from BLE and send to RabbitMQ
+# (ax, ay, az, gx, gy, gz) of the next complete IMU window and its trace, or (None, None)
 def get_imu_data():
-    action_occurred = dataPacket['isAllImuReceived'] and dataPacket['imuCounter'] > 30
-    ax = dataPacket['ax'].copy()
-    ay = dataPacket['ay'].copy()
-    az = dataPacket['az'].copy()
-    gx = dataPacket['gx'].copy()
-    gy = dataPacket['gy'].copy()
-    gz = dataPacket['gz'].copy()
-    dataPacket['ax'] = [0] * IMU_SAMPLES
-    dataPacket['ay'] = [0] * IMU_SAMPLES
-    dataPacket['az'] = [0] * IMU_SAMPLES
-    dataPacket['gx'] = [0] * IMU_SAMPLES
-    dataPacket['gy'] = [0] * IMU_SAMPLES
-    dataPacket['gz'] = [0] * IMU_SAMPLES
-    dataPacket['isAllImuReceived'] = False
-    dataPacket['imuCounter'] = 0
+    if len(dataPacketQueue) == 0: # none yet, or still being received
+        return None, None
+    myDataPacket = dataPacketQueue.popleft()
+    action_occurred = myDataPacket['imuCounter'] > 30
 
     if action_occurred:
         print(f"[BLE] >> Relay IMU Data to Server")
-        return ax, ay, az, gx, gy, gz
+        return (myDataPacket['ax'], myDataPacket['ay'], myDataPacket['az'], myDataPacket['gx'], myDataPacket['gy'], myDataPacket['gz']), myDataPacket['trace']
     else:
-        return None
+        return None, None
+
+# the leg only acts on status requests
+def keep_update(data):
+    return bool(data.get('update'))
 
 # RabbitMQ server
 class LegBeetleServer:
     def __init__(self):
         self.rabbitmq_connection = None
         self.channel = None
+        self.publisher = None
+        self.transport = transport.make_transport() if TRANSPORT else None
+        self.backpressure = ai_backpressure.AiBackpressure(AI_WINDOW_QUEUE) if ai_backpressure.AI_BACKPRESSURE else None
         self.exchange = None
         self.update_queue = None
         self.should_run = True
+        self.audit_tasks = set()  # audit publishes still in flight
+        self.imu_ring = imu_shm.ImuRingWriter(PLAYER_ID, 'leg', IMU_SAMPLES) if IMU_SHM else None
+        self.activity_gate = activity_gate.ActivityGate('leg') if ACTIVITY_GATE else None
+        if LEG_DETECTOR:
+            import leg_action_detector
+            self.leg_detector = leg_action_detector.LegActionDetector()
+        else:
+            self.leg_detector = None
 
-    async def setup_rabbitmq(self):
-        print('[DEBUG] Connecting to RabbitMQ broker...')
-        self.rabbitmq_connection = await aio_pika.connect_robust(
+    async def connect(self):
+        return await aio_pika.connect_robust(
             host=BROKER,
             port=RABBITMQ_PORT,
             login=BROKERUSER,
             password=PASSWORD,
         )
+
+    async def setup_rabbitmq(self):
+        print('[DEBUG] Connecting to RabbitMQ broker...')
+        self.rabbitmq_connection = await self.connect()
         self.channel = await self.rabbitmq_connection.channel()
-        await self.channel.declare_queue(AI_QUEUE, durable=True)
-        await self.channel.declare_queue(UPDATE_GE_QUEUE, durable=True)
-        # DECLARE EXCHANGE STUFF
-        self.exchange = await self.channel.declare_exchange(UPDATE_EVERYONE_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True)
-        self.update_queue = await self.channel.declare_queue('', exclusive=True)
-        await self.update_queue.bind(self.exchange)
+        self.publisher = priority_lanes.LanePublisher(self.channel)
+        await self.publisher.open(self.rabbitmq_connection, self.connect)
+        if ai_shards.AI_SHARDING:
+            await ai_shards.declare_exchange(self.channel)
+        else:
+            await self.channel.declare_queue(AI_QUEUE, durable=True)
+        if self.backpressure is not None:
+            await self.backpressure.start(self.rabbitmq_connection)
+        await self.channel.declare_queue(UPDATE_GE_QUEUE, durable=True, arguments=priority_lanes.ge_queue_arguments())
+        if self.transport is not None:
+            await self.transport.connect()
+            await transport.bind_queue(self.channel, UPDATE_GE_QUEUE, arguments=priority_lanes.ge_queue_arguments())
+            print(f'[DEBUG] Game engine messages and updates go over {self.transport.name}')
+        else:
+            # DECLARE EXCHANGE STUFF
+            self.exchange = await self.channel.declare_exchange(UPDATE_EVERYONE_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True)
+            self.update_queue = await self.channel.declare_queue('', exclusive=True)
+            await self.update_queue.bind(self.exchange)
         print(f'[DEBUG] Connected to RabbitMQ broker at {BROKER}:{RABBITMQ_PORT}')
 
     async def send_imu_data(self):
         while self.should_run:
-            imu_data = get_imu_data()
-            if imu_data is not None:
-                ax, ay, az, gx, gy, gz = imu_data
-                length = len(ax)
-                message = {
-                    'ax': ax,
-                    'ay': ay,
-                    'az': az,
-                    'gx': gx,
-                    'gy': gy,
-                    'gz': gz,
-                    'player_id': PLAYER_ID,
-                    'imu_device': 'leg'
-                }
-                print(f"[DEBUG] Length of IMU Data: {length}")
-                print(f"[DEBUG] IMU Data: {message}")
-                message_body = json.dumps(message).encode('utf-8')
-                await self.channel.default_exchange.publish(
-                    aio_pika.Message(body=message_body),
-                    routing_key=AI_QUEUE,
-                )
-                print(f'[DEBUG] Published IMU data to {AI_QUEUE}')
+            imu_data, trace = get_imu_data()
+            if imu_data is not None and self.activity_gate is not None and not self.activity_gate.accept(imu_data):
+                imu_data = None
+            isKick = False
+            if imu_data is not None and self.leg_detector is not None:
+                isKick = await self.detect_kick(imu_data, trace)
+            if isKick:
+                task = asyncio.create_task(self.publish_imu_data(imu_data, trace, audit=True))
+                self.audit_tasks.add(task)
+                task.add_done_callback(self.audit_done)
+            elif imu_data is not None and self.imu_ring is not None and self.imu_ring.write(*imu_data):
+                print(f'[DEBUG] Wrote IMU data to shared memory ring {self.imu_ring.name}')
+            elif imu_data is not None:
+                await self.publish_imu_data(imu_data, trace)
             await asyncio.sleep(0.1)
 
+    def audit_done(self, task):
+        self.audit_tasks.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f'[ERROR] Audit publish: {task.exception()}')
+
+    async def publish_imu_data(self, imu_data, trace=None, audit=False):
+        if self.backpressure is not None and not self.backpressure.admit():
+            print(f'[DEBUG] Skipped IMU data, {AI_WINDOW_QUEUE} is {self.backpressure.mode} (depth {self.backpressure.depth})')
+            return
+        ax, ay, az, gx, gy, gz = imu_data
+        length = len(ax)
+        message = {
+            'ax': ax,
+            'ay': ay,
+            'az': az,
+            'gx': gx,
+            'gy': gy,
+            'gz': gz,
+            'player_id': PLAYER_ID,
+            'imu_device': 'leg'
+        }
+        if audit:
+            # already acted on by the relay; the AI engine only logs its prediction
+            message['audit'] = True
+        print(f"[DEBUG] Length of IMU Data: {length}")
+        print(f"[DEBUG] IMU Data: {message}")
+        message_body = json.dumps(message).encode('utf-8')
+        await self.publisher.publish('imu', message_body, AI_ROUTING_KEY, exchange=AI_EXCHANGE, **latency_trace.message_properties(trace, None), **ai_backpressure.imu_message_properties())
+        print(f'[DEBUG] Published IMU data to {AI_WINDOW_QUEUE}')
+
+    # messages for the game engine go through TRANSPORT when one is set, otherwise on their lane
+    async def publish_ge(self, lane, message_body, **properties):
+        if self.transport is not None:
+            if flight_recorder.recorder is not None:
+                flight_recorder.recorder.published(UPDATE_GE_QUEUE, message_body)
+            await self.transport.publish(UPDATE_GE_QUEUE, message_body, priority=priority_lanes.LANES[lane], **properties)
+        else:
+            await self.publisher.publish(lane, message_body, UPDATE_GE_QUEUE, **properties)
+
+    async def detect_kick(self, imu_data, trace=None):
+        start = time.perf_counter()
+        isKick, label, confidence = self.leg_detector.detect(imu_data)
+        print(f'[DEBUG] Leg detector: {label} ({confidence:.5f}) in {(time.perf_counter() - start) * 1000:.2f} ms')
+        if not isKick:
+            return False
+        action = {
+            'action': True,
+            'action_type': label,
+            'player_id': PLAYER_ID,
+        }
+        await self.publish_ge('action', json.dumps(action).encode('utf-8'), **latency_trace.message_properties(trace, label))
+        print(f'[DEBUG] Published kick to {UPDATE_GE_QUEUE}: {action}')
+        return True
+
     async def send_connection_status(self):
         while self.should_run:
             toSend = len(connectionStatusQueue) > 0
@@ -223,30 +340,22 @@ class LegBeetleServer:
                     "f": True
                 }
                 message_body = json.dumps(message).encode('utf-8')
-                await self.channel.default_exchange.publish(
-                    aio_pika.Message(body=message_body),
-                    routing_key=UPDATE_GE_QUEUE,
-                )
+                await self.publish_ge('status', message_body)
                 print(f'[DEBUG] Published connection status to {UPDATE_GE_QUEUE}')
             await asyncio.sleep(0.1)
 
+    def handle_update(self, message, data):
+        print(f'[DEBUG] Received update: {data}')
+        toupdate = data.get('update', False)
+        if toupdate:
+            connectionStatusQueue.append(connectionStatus.copy())
+
     async def consume_updates(self):
-        async with self.update_queue.iterator() as queue_iter:
-            async for message in queue_iter:
-                async with message.process():
-                    payload = message.body.decode('utf-8')
-                    print(f'[DEBUG] Received update: {payload}')
-                    try:
-                        data = json.loads(payload)
-
-                        toupdate = data.get('update', False)
-                        if toupdate:
-                            connectionStatusQueue.append(connectionStatus.copy())
-                        
-                    except json.JSONDecodeError:
-                        print(f'[ERROR] Invalid JSON payload: {payload}')
-                    except Exception as e:
-                        print(f'[ERROR] {e}')
+        consumer = update_consumer.UpdateConsumer(self.update_queue, self.handle_update, keep_update)
+        if self.transport is not None:
+            await consumer.run_transport(self.transport, transport.UPDATE_EVERYONE_TOPIC)
+        else:
+            await consumer.run(self.channel)
 
     async def run(self):
         await self.setup_rabbitmq()
@@ -257,7 +366,16 @@ class LegBeetleServer:
             self.consume_updates()
             )
 
+loopMonitor = loop_monitor.LoopMonitor(f'leg p{PLAYER_ID}')
+profiler = sampling_profiler.SamplingProfiler(f'leg p{PLAYER_ID}')
+
 async def main():
+    if loop_monitor.LOOP_MONITOR:
+        loopMonitor.start()
+    if sampling_profiler.PROFILER:
+        profiler.install()
+    if flight_recorder.recorder is not None:
+        flight_recorder.recorder.install(f'leg p{PLAYER_ID}')
     await asyncio.gather(leg_beetle_server.run(), ble1.run())
 
 if __name__ == '__main__':
@@ -269,4 +387,11 @@ if __name__ == '__main__':
         print('[DEBUG] Leg Beetle Server stopped by user')
         leg_beetle_server.should_run = False
     except Exception as e:
-        print(f'[ERROR] {e}')
\ No newline at end of file
+        print(f'[ERROR] {e}')
+        if flight_recorder.recorder is not None:
+            flight_recorder.recorder.dump('crash')
+    finally:
+        loopMonitor.save()
+        profiler.stop()
+        if leg_beetle_server.imu_ring is not None:
+            leg_beetle_server.imu_ring.close()
\ No newline at end of file
@@ -0,0 +1,139 @@
+#!/usr/bin/env python
+
+# Event loop health monitor for the beetle servers.
+#
+# A sentinel task sleeps LOOP_MONITOR_INTERVAL_MS at a time and records how
+# late it wakes up: that lag is how long every other task had to wait for the
+# loop. A watchdog thread checks the sentinel's heartbeat. Once the loop has
+# been held for LOOP_STALL_MS it captures the loop thread's stack (through
+# sys._current_frames) while the stall is still going on, so the report names
+# the code that is blocking, e.g. a bluepy waitForNotifications inside
+# ExtendedBLEConnection.run, rather than whatever runs after it.
+#
+# Lags go into a histogram; stalls are counted per holder (the task or callback
+# that had the loop, and the innermost frame of relay code in it). Both are
+# reported every LOOP_REPORT_INTERVAL seconds and saved to LOOP_MONITOR_FILE
+# on exit.
+
+import asyncio
+import collections
+import json
+import os
+import sys
+import sysconfig
+import threading
+import time
+import traceback
+
+import numpy as np
+
+LOOP_MONITOR = os.getenv('LOOP_MONITOR', '0') == '1'
+LOOP_MONITOR_INTERVAL_MS = float(os.getenv('LOOP_MONITOR_INTERVAL_MS', '10'))
+LOOP_STALL_MS = float(os.getenv('LOOP_STALL_MS', '100'))
+LOOP_REPORT_INTERVAL = float(os.getenv('LOOP_REPORT_INTERVAL', '30'))
+LOOP_MONITOR_FILE = os.getenv('LOOP_MONITOR_FILE', '')
+# lags kept for the percentiles, about half an hour at 10 ms
+LOOP_MAX_SAMPLES = 200000
+
+# histogram bucket edges in milliseconds, log-spaced from 0.1 ms to 10 s
+BUCKET_EDGES_MS = np.logspace(-1, 4, 51)
+
+ASYNCIO_DIR = os.path.dirname(asyncio.__file__)
+LIBRARY_DIRS = tuple({sysconfig.get_paths()[key] for key in ('stdlib', 'purelib', 'platlib')})
+
+
+def describe(entry):
+    return f'{os.path.basename(entry.filename)}:{entry.lineno} {entry.name}'
+
+
+# where the loop is held: the callback Handle._run called into and the innermost
+# frame of our own code (the caller of a blocking bluepy call, say), and the stack
+def loop_holder(frame):
+    stack = traceback.extract_stack(frame)
+    handle = max((i for i, entry in enumerate(stack) if entry.filename.startswith(ASYNCIO_DIR) and entry.name == '_run'), default=-1)
+    called = [entry for entry in stack[handle + 1:] if not entry.filename.startswith(ASYNCIO_DIR)]
+    if not called:
+        return 'asyncio', stack
+    own = [entry for entry in called if not entry.filename.startswith(LIBRARY_DIRS)] or called
+    if own[-1] is called[0]:
+        return describe(own[-1]), stack
+    return f'{called[0].name} > {describe(own[-1])}', stack
+
+
+class LoopMonitor:
+    def __init__(self, name):
+        self.name = name
+        self.lags = collections.deque(maxlen=LOOP_MAX_SAMPLES)
+        self.stalls = collections.Counter()  # holder -> number of stalls
+        self.stallMs = collections.defaultdict(float)  # holder -> total ms stalled
+        self.stall = None  # (holder, stack) captured during the current stall
+        self.lastBeat = time.monotonic()
+        self.lastReport = time.monotonic()
+        self.loop = None
+        self.loopThread = None
+
+    def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.loopThread = threading.get_ident()
+        self.lastBeat = time.monotonic()
+        self.task = asyncio.create_task(self.sentinel())
+        threading.Thread(target=self.watchdog, name='loop-watchdog', daemon=True).start()
+        print(f'[DEBUG] Loop monitor: every {LOOP_MONITOR_INTERVAL_MS} ms, stacks of stalls above {LOOP_STALL_MS} ms')
+
+    async def sentinel(self):
+        interval = LOOP_MONITOR_INTERVAL_MS / 1000
+        while True:
+            start = time.monotonic()
+            await asyncio.sleep(interval)
+            self.lastBeat = time.monotonic()
+            self.record((self.lastBeat - start - interval) * 1000)
+
+    def watchdog(self):
+        while True:
+            time.sleep(LOOP_MONITOR_INTERVAL_MS / 1000)
+            heldMs = (time.monotonic() - self.lastBeat) * 1000 - LOOP_MONITOR_INTERVAL_MS
+            if heldMs < LOOP_STALL_MS or self.stall is not None:
+                continue
+            frame = sys._current_frames().get(self.loopThread)
+            if frame is None:
+                continue
+            self.stall = loop_holder(frame)
+
+    def record(self, lagMs):
+        self.lags.append(lagMs)
+        if self.stall is not None:
+            holder, stack = self.stall
+            self.stall = None
+            self.stalls[holder] += 1
+            self.stallMs[holder] += lagMs
+            print(f'[LOOP] {self.name}: loop held for {lagMs:.0f} ms by {holder}')
+            print(''.join(traceback.format_list(stack[-8:])), end='')
+        if time.monotonic() - self.lastReport >= LOOP_REPORT_INTERVAL:
+            self.report()
+
+    def summary(self):
+        lags = np.array(self.lags or [0.0])
+        counts, _ = np.histogram(lags, bins=BUCKET_EDGES_MS)
+        return {
+            'count': len(self.lags),
+            'p50_ms': float(np.percentile(lags, 50)),
+            'p99_ms': float(np.percentile(lags, 99)),
+            'max_ms': float(lags.max()),
+            'bucket_edges_ms': BUCKET_EDGES_MS.round(2).tolist(),
+            'bucket_counts': counts.tolist(),
+            'stalls': {holder: {'count': count, 'total_ms': round(self.stallMs[holder], 1)} for holder, count in self.stalls.most_common()},
+        }
+
+    def report(self):
+        self.lastReport = time.monotonic()
+        stats = self.summary()
+        print(f"[LOOP] {self.name} lag: n={stats['count']} p50 {stats['p50_ms']:.1f} ms  p99 {stats['p99_ms']:.1f} ms  max {stats['max_ms']:.1f} ms")
+        for holder, stall in list(stats['stalls'].items())[:5]:
+            print(f"[LOOP]   {stall['count']} stalls, {stall['total_ms']:.0f} ms: {holder}")
+
+    def save(self, path=LOOP_MONITOR_FILE):
+        if not path or not self.lags:
+            return
+        with open(path, 'w') as f:
+            json.dump({'name': self.name, 'loop': self.summary()}, f, indent=4)
+        print(f'[LOOP] Saved loop lag histogram to {path}')
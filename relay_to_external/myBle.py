@@ -1,15 +1,30 @@
 import bluepy.btle as btle
 from bluepy.btle import Peripheral, BTLEDisconnectError
 from crc import Calculator, Crc8
+import asyncio
+import os
 import struct
+import time
 import numpy as np
+import flight_recorder
 
 SERVICE_UUID = "0000dfb0-0000-1000-8000-00805f9b34fb"
 CHAR_UUID = "0000dfb1-0000-1000-8000-00805f9b34fb"
 PACKET_SIZE = 15
 IMU_TIMEOUT = 0.5
 ACK_TIMEOUT = 0.5
-HANDSHAKE_TIMEOUT = 2
+# an UPDATE is sent again every ACK_TIMEOUT until it is acknowledged; after
+# UPDATE_RETRANSMIT_LIMIT of them the link is degraded
+UPDATE_RETRANSMIT_LIMIT = 5
+# a SYN is sent again every SYN_RETRANSMIT_MS until the SYNACK arrives; after
+# SYN_RETRANSMIT_LIMIT of them the link is dropped and reconnected
+SYN_RETRANSMIT_MS = float(os.getenv('SYN_RETRANSMIT_MS', '50'))
+SYN_RETRANSMIT_LIMIT = int(os.getenv('SYN_RETRANSMIT_LIMIT', '20'))
+# every state is stepped with zero-timeout polls this often; nothing blocks the event loop
+POLL_INTERVAL = float(os.getenv('BLE_POLL_MS', '5')) / 1000
+# until the first handshake is done only SYNs and their SYNACK are exchanged, so a
+# beetle that is out of range or switched off is polled less often
+HANDSHAKE_POLL_INTERVAL = float(os.getenv('BLE_HANDSHAKE_POLL_MS', '25')) / 1000
 CRC8 = Calculator(Crc8.CCITT)
 
 # packet types
@@ -21,6 +36,13 @@ DATA = 'D'
 UPDATE = 'U'
 KICK = 'K'
 
+# connection states
+DISCONNECTED = 'disconnected'
+CONNECTING = 'connecting'
+SYN_SENT = 'syn-sent'       # connected, waiting for the SYNACK of the first handshake
+ESTABLISHED = 'established'
+DEGRADED = 'degraded'       # still connected and parsing data, re-handshaking after corrupt packets or a lost UPDATE
+
 class MyDelegate(btle.DefaultDelegate):
     def __init__(self):
         btle.DefaultDelegate.__init__(self)
@@ -33,6 +55,8 @@ class MyDelegate(btle.DefaultDelegate):
 
     def handleNotification(self, cHandle, data): # handle fragmented packets and checksum
         self.isRxPacketReady = False
+        if flight_recorder.recorder is not None:
+            flight_recorder.recorder.ble_rx(data)
         self.rxPacketBuffer += data
 
         if (len(self.rxPacketBuffer) >= PACKET_SIZE):
@@ -46,6 +70,8 @@ class MyDelegate(btle.DefaultDelegate):
                 self.rxPacketBuffer = self.rxPacketBuffer[PACKET_SIZE:]
             else:
                 print("[BLE]  Checksum failed.")
+                if flight_recorder.recorder is not None:
+                    flight_recorder.recorder.crc_failure()
                 self.invalidPacketCounter += 1
                 self.rxPacketBuffer = b''
             return
@@ -60,7 +86,21 @@ class BLEConnection:
         self.charUUID = charUUID
         self.device = Peripheral()
         self.beetleSerial = None
-        self.isHandshakeRequire = True
+        self.state = DISCONNECTED
+        self.synAttempts = 0
+        self.synSentAt = None
+        self.pendingUpdate = None  # the UPDATE waiting for its ACK
+
+    @property
+    def isHandshakeRequire(self):
+        return self.state != ESTABLISHED
+
+    def setState(self, state):
+        if (state != self.state):
+            print(f"[BLE] >> {self.state} -> {state}")
+            if flight_recorder.recorder is not None:
+                flight_recorder.recorder.event(f'{self.state}->{state}')
+            self.state = state
 
     def establishConnection(self): # connect to the beetle
         print("[BLE] >> Searching and Connecting to the Beetle...")
@@ -75,43 +115,124 @@ class BLEConnection:
         print("[BLE] >> Connection is established.")
         return True
 
+    def write(self, packet): # write a frame to the beetle
+        if flight_recorder.recorder is not None:
+            flight_recorder.recorder.ble_tx(packet)
+        self.beetleSerial.write(packet)
+
     def sendSYN(self, seq): # send SYN packet to the beetle
         print(f"[BLE] >> Send SYN: {seq}")
         packet = bytes(SYN, 'utf-8') + bytes([np.uint8(seq)]) + bytes([0] * (PACKET_SIZE - 3))
         packet = packet + (bytes)([np.uint8(CRC8.checksum(packet))])
-        self.beetleSerial.write(packet)
+        self.write(packet)
         
     def sendSYNACK(self, seq): # send SYNACK packet to the beetle
         print(f"[BLE] >> Send SYNACK: {seq}")
         packet = bytes(SYNACK, 'utf-8') + bytes([np.uint8(seq)]) + bytes([0] * (PACKET_SIZE - 3))
         packet = packet + (bytes)([np.uint8(CRC8.checksum(packet))])
-        self.beetleSerial.write(packet)
+        self.write(packet)
 
     def sendACK(self, seq): # send ACK packet to the beetle
         print(f"[BLE]    Send ACK: {seq}")
         packet = bytes(ACK, 'utf-8') + bytes([np.uint8(seq)]) + bytes([0] * (PACKET_SIZE - 3))
         packet = packet + (bytes)([np.uint8(CRC8.checksum(packet))])
-        self.beetleSerial.write(packet)
+        self.write(packet)
+
+    async def connect(self): # connect in a worker thread so the event loop keeps running
+        self.setState(CONNECTING)
+        try:
+            await asyncio.get_running_loop().run_in_executor(None, self.establishConnection)
+        except BTLEDisconnectError:
+            self.setState(DISCONNECTED)
+            raise
+        self.startHandshake(SYN_SENT)
 
-    def performHandShake(self, seq, connectionStatus, connectionStatusQueue): # perform handshake with the beetle
+    def startHandshake(self, state): # SYN_SENT after connecting, DEGRADED on a live link
+        self.setState(state)
         print("[BLE] >> Performing Handshake...")
-        self.sendSYN(seq)
-        if (self.device.waitForNotifications(HANDSHAKE_TIMEOUT) and self.device.delegate.isRxPacketReady):
-            if (self.device.delegate.packetType ==  SYNACK):
+        self.synAttempts = 0
+        self.synSentAt = None
+        self.pendingUpdate = None
+
+    def pollInterval(self): # how long the server loops sleep between steps
+        return HANDSHAKE_POLL_INTERVAL if self.state == SYN_SENT else POLL_INTERVAL
+
+    def degrade(self):
+        if (self.state == ESTABLISHED):
+            self.startHandshake(DEGRADED)
+
+    def stepHandShake(self, seq, connectionStatus, connectionStatusQueue): # one non-blocking step of the handshake; True once established
+        now = time.monotonic()
+        if (self.synSentAt is None or now - self.synSentAt >= SYN_RETRANSMIT_MS / 1000):
+            if (self.synAttempts >= SYN_RETRANSMIT_LIMIT):
+                print("[BLE] >> Handshake Failed.")
+                if flight_recorder.recorder is not None:
+                    flight_recorder.recorder.handshake(False)
+                self.setState(DISCONNECTED)
+                self.device.disconnect()
+                raise BTLEDisconnectError("no SYNACK from the beetle")
+            self.sendSYN(seq)
+            self.synSentAt = now
+            self.synAttempts += 1
+
+        self.device.delegate.isRxPacketReady = False
+        if (self.device.waitForNotifications(0) and self.device.delegate.isRxPacketReady):
+            if (self.device.delegate.packetType == SYNACK):
                 self.sendSYNACK(0)
-                self.isHandshakeRequire = False
-                if (self.device.delegate.invalidPacketCounter >= 5):
-                    self.device.delegate.invalidPacketCounter = 0
-                print("[BLE] >> Handshake Done.")
+                self.device.delegate.invalidPacketCounter = 0
+                self.setState(ESTABLISHED)
+                print(f"[BLE] >> Handshake Done after {self.synAttempts} SYN.")
                 print("[BLE] _______________________________________________________________ ")
                 if (not connectionStatus['isConnected']):
                     connectionStatus['isConnected'] = True
                     connectionStatusQueue.append(connectionStatus.copy())
+                if flight_recorder.recorder is not None:
+                    flight_recorder.recorder.handshake(True)
                 return True
-        print("[BLE] >> Handshake Failed.")
+            elif (self.state == DEGRADED):
+                self.handleRxPacket()
+        self.stepTimers(now)
         return False
-    
-    def sendUPDATE(self, updatePacket, myUpdatePacket, isVestUpdate=False, isGloveUpdate=False): # send update packet to the beetle
+
+    def stepLink(self, updatePacket=None, updatePacketQueue=(), **updateKind): # one non-blocking step of an established link; the update the beetle acknowledged, if any
+        acked = None
+        while (self.state == ESTABLISHED and self.device.waitForNotifications(0)):
+            if (self.device.delegate.isRxPacketReady):
+                self.device.delegate.isRxPacketReady = False
+                acked = self.handleRxPacket() or acked
+        now = time.monotonic()
+        self.stepTimers(now)
+        if (self.state != ESTABLISHED):
+            return acked
+        if (self.pendingUpdate is None and len(updatePacketQueue) > 0):
+            self.startUPDATE(updatePacket, updatePacketQueue.pop(), **updateKind)
+        if (self.pendingUpdate is not None):
+            self.stepUPDATE(now)
+        return acked
+
+    def handleRxPacket(self): # dispatch a received packet; the update it acknowledges, if any
+        packetType = self.device.delegate.packetType
+        if (packetType == ACK):
+            pending = self.pendingUpdate
+            if (pending is not None and self.device.delegate.seqReceived == pending['updatePacket']['seq']):
+                self.pendingUpdate = None
+                pending['updatePacket']['seq'] += 1
+                pending['updatePacket']['seq'] %= 100
+                print("[BLE] >> Done update player")
+                print("[BLE] _______________________________________________________________ ")
+                return pending['update']
+            # a late ACK of an UPDATE that was already acknowledged
+            return None
+        if (packetType == SYNACK):
+            self.sendSYNACK(0)
+            return None
+        self.parseRxPacket()
+        return None
+
+    def stepTimers(self, now): # timeouts of the relay's own packet handling
+        pass
+
+    def startUPDATE(self, updatePacket, myUpdatePacket, isVestUpdate=False, isGloveUpdate=False): # send update packet to the beetle, see stepUPDATE
         print("[BLE] >> Sending UPDATE...")
         print(f"[BLE] >> Update Packet: {myUpdatePacket}")
 
@@ -121,31 +242,24 @@ class BLEConnection:
             packet = bytes(UPDATE, 'utf-8') + bytes([np.uint8(updatePacket['seq'])]) + bytes([0] * 3) + bytes([np.uint8(myUpdatePacket['bullets']), np.uint8(myUpdatePacket['isReload'])]) + bytes([0] * (PACKET_SIZE - 8))
         else:
             print("[BLE] >> UPDATE Failed.")
-            
+            return
+
         packet = packet + (bytes)([np.uint8(CRC8.checksum(packet))])
-        
-        for i in range(5):
-            self.beetleSerial.write(packet)
-            print(f"[BLE] >> Send UPDATE to the beetle: {updatePacket['seq']}")
-
-            if (self.device.waitForNotifications(ACK_TIMEOUT) and self.device.delegate.isRxPacketReady and not self.isHandshakeRequire):
-                if (self.device.delegate.packetType == SYNACK):
-                    self.sendSYNACK(0)
-                elif (self.device.delegate.packetType ==  ACK and (self.device.delegate.seqReceived == updatePacket['seq'])):
-                    updatePacket['seq'] += 1
-                    updatePacket['seq'] %= 100
-                    print("[BLE] >> Done update player")
-                    print("[BLE] _______________________________________________________________ ")
-                    return
-                # if recevied data instead of ACK, collect the data first
-                elif (self.device.delegate.packetType == DATA):
-                    self.parseRxPacket()
-            elif (self.isHandshakeRequire):
-                break
-
-        # after 5 attempts of sending update, then rehandshake
-        print("[BLE] >> Update Failed.")
-        self.isHandshakeRequire = True
+        self.pendingUpdate = {'packet': packet, 'updatePacket': updatePacket, 'update': myUpdatePacket, 'attempts': 0, 'sentAt': None}
+
+    def stepUPDATE(self, now): # (re)send the pending UPDATE when its ACK is overdue
+        pending = self.pendingUpdate
+        if (pending['sentAt'] is not None and now - pending['sentAt'] < ACK_TIMEOUT):
+            return
+        if (pending['attempts'] >= UPDATE_RETRANSMIT_LIMIT):
+            # after 5 attempts of sending update, then rehandshake
+            print("[BLE] >> Update Failed.")
+            self.degrade()
+            return
+        self.write(pending['packet'])
+        pending['sentAt'] = now
+        pending['attempts'] += 1
+        print(f"[BLE] >> Send UPDATE to the beetle: {pending['updatePacket']['seq']}")
     
     def parseRxPacket(self):
         pass
@@ -0,0 +1,122 @@
+#!/usr/bin/env python
+
+# Priority lanes for the relay's RabbitMQ traffic.
+#
+# The relays publish three classes of traffic: game actions (gun, kick),
+# connection status and IMU windows. With PRIORITY_LANES=1 every class gets
+# its own channel (and, with PRIORITY_LANE_CONNECTIONS=1, its own connection),
+# so flow control or a large publish on one lane cannot hold up another.
+# Actions and status are published right away on their lane. IMU windows
+# are queued and published by a background task, but only while no action is
+# being published, so a shot never waits behind a window. At most
+# IMU_LANE_SIZE windows are held; when the lane falls behind, the oldest is
+# dropped and counted.
+#
+# Every message carries the AMQP priority of its lane. The broker only honours
+# it if UPDATE_GE_QUEUE is declared with x-max-priority (UPDATE_GE_MAX_PRIORITY).
+# An existing queue has to be deleted first to change that, and all publishers
+# and consumers have to declare it with the same arguments.
+
+import asyncio
+import os
+
+import aio_pika
+
+import flight_recorder
+
+PRIORITY_LANES = os.getenv('PRIORITY_LANES', '0') == '1'
+PRIORITY_LANE_CONNECTIONS = os.getenv('PRIORITY_LANE_CONNECTIONS', '0') == '1'
+UPDATE_GE_MAX_PRIORITY = int(os.getenv('UPDATE_GE_MAX_PRIORITY', '0'))
+IMU_LANE_SIZE = int(os.getenv('IMU_LANE_SIZE', '8'))
+
+# lane -> AMQP message priority
+LANES = {
+    'action': 9,
+    'status': 5,
+    'imu': 1,
+}
+
+
+# queue arguments every declare of UPDATE_GE_QUEUE has to use
+def ge_queue_arguments():
+    return {'x-max-priority': UPDATE_GE_MAX_PRIORITY} if UPDATE_GE_MAX_PRIORITY else None
+
+
+class LanePublisher:
+    def __init__(self, channel):
+        self.channel = channel
+        self.lanes = {}
+        self.connections = []
+        self.actionsInFlight = 0
+        self.actionsIdle = asyncio.Event()
+        self.actionsIdle.set()
+        self.imuQueue = asyncio.Queue(maxsize=IMU_LANE_SIZE)
+        self.imuDeferred = 0
+        self.imuDropped = 0
+        self.worker = None
+        self.exchanges = {}
+
+    # connect: coroutine function returning a new connection, for a connection per lane
+    async def open(self, connection, connect=None):
+        if not PRIORITY_LANES:
+            return
+        for lane in LANES:
+            if PRIORITY_LANE_CONNECTIONS and connect is not None:
+                laneConnection = await connect()
+                self.connections.append(laneConnection)
+            else:
+                laneConnection = connection
+            self.lanes[lane] = await laneConnection.channel()
+        self.worker = asyncio.create_task(self.publish_imu_windows())
+        print(f"[DEBUG] Priority lanes: {', '.join(LANES)}{' (one connection each)' if self.connections else ''}")
+
+    # exchange: name of an already declared exchange; the default exchange if empty
+    async def publish(self, lane, body, routing_key, exchange='', **properties):
+        if flight_recorder.recorder is not None:
+            flight_recorder.recorder.published(routing_key, body)
+        message = aio_pika.Message(body=body, priority=LANES[lane], **properties)
+        if not self.lanes:
+            await self.exchange_on(self.channel, exchange).publish(message, routing_key=routing_key)
+        elif lane == 'imu':
+            if self.imuQueue.full():
+                self.imuQueue.get_nowait()
+                self.imuDropped += 1
+                if self.imuDropped & (self.imuDropped - 1) == 0:  # 1, 2, 4, 8, ...
+                    print(f'[DEBUG] IMU lane is behind, {self.imuDropped} oldest windows dropped')
+            self.imuQueue.put_nowait((message, routing_key, exchange))
+        elif lane == 'action':
+            self.actionsInFlight += 1
+            self.actionsIdle.clear()
+            try:
+                await self.exchange_on(self.lanes[lane], exchange).publish(message, routing_key=routing_key)
+            finally:
+                self.actionsInFlight -= 1
+                if self.actionsInFlight == 0:
+                    self.actionsIdle.set()
+        else:
+            await self.exchange_on(self.lanes[lane], exchange).publish(message, routing_key=routing_key)
+
+    def exchange_on(self, channel, name):
+        if not name:
+            return channel.default_exchange
+        key = (id(channel), name)
+        if key not in self.exchanges:
+            self.exchanges[key] = aio_pika.Exchange(channel, name)
+        return self.exchanges[key]
+
+    async def publish_imu_windows(self):
+        while True:
+            message, routing_key, exchange = await self.imuQueue.get()
+            if not self.actionsIdle.is_set():
+                self.imuDeferred += 1
+                await self.actionsIdle.wait()
+            try:
+                await self.exchange_on(self.lanes['imu'], exchange).publish(message, routing_key=routing_key)
+            except Exception as e:
+                print(f'[ERROR] IMU lane: {e}')
+
+    async def close(self):
+        if self.worker is not None:
+            self.worker.cancel()
+        for connection in self.connections:
+            await connection.close()
@@ -0,0 +1,175 @@
+#!/usr/bin/env python
+
+# On-demand sampling profiler for a running relay.
+#
+# With PROFILER=1 the relay can be profiled without a restart: SIGUSR2 (or
+# 'start' / 'stop' / 'status' on the Unix socket PROFILE_SOCKET) switches
+# sampling on and off.
+#   kill -USR2 $(pm2 pid glove_p1)          # start, and again to stop
+#   echo stop | nc -U /tmp/glove_p1.sock
+# While on, a thread takes the stack of every other thread PROFILE_HZ times a
+# second. Nothing runs in the sampled threads, so the relay only pays for the
+# sampler's own share of the GIL.
+#
+# On stop the samples are written in collapsed-stack format (one
+# "thread;file:function;...;file:function count" line per stack) to
+# PROFILE_DIR/profile-<name>-<time>.folded, ready for flamegraph.pl or
+# speedscope. A summary attributes the samples to BLE, packet decoding,
+# serialization, broker publishing, idle and other by the innermost frame of
+# each stack that matches a category.
+#
+# SIGUSR2 is handled on the relay's event loop (install() has to be called
+# from it); stopping joins the sampler and writes the file, so that runs in a
+# worker thread and the loop only starts the thread.
+
+import asyncio
+import collections
+import os
+import signal
+import socket
+import sys
+import threading
+import time
+
+PROFILER = os.getenv('PROFILER', '0') == '1'
+PROFILE_HZ = float(os.getenv('PROFILE_HZ', '200'))
+PROFILE_DIR = os.getenv('PROFILE_DIR', '.')
+PROFILE_SOCKET = os.getenv('PROFILE_SOCKET', '')
+
+# (category, function names, file name fragments); functions are checked first
+CATEGORIES = [
+    ('decode', {'handleNotification', 'parseRxPacket', 'appendImuData', 'unpack', 'unpack_from'}, ()),
+    ('ble', set(), ('bluepy', 'myBle.py')),
+    ('serialization', {'dumps', 'loads', 'encode', 'decode'}, ('json',)),
+    ('publish', set(), ('aio_pika', 'aiormq', 'pamqp', 'aiomqtt', 'paho', 'priority_lanes.py', 'transport.py')),
+    ('idle', {'wait'}, ('selectors.py',)),
+]
+
+
+def frame_category(filename, function):
+    for category, functions, files in CATEGORIES:
+        if function in functions:
+            return category
+    for category, functions, files in CATEGORIES:
+        if any(fragment in filename for fragment in files):
+            return category
+    return None
+
+
+# category of a stack (outermost frame first) by its innermost categorised frame
+def stack_category(frames):
+    for filename, function in reversed(frames):
+        category = frame_category(filename, function)
+        if category is not None:
+            return category
+    return 'other'
+
+
+class SamplingProfiler:
+    def __init__(self, name, hz=PROFILE_HZ):
+        self.name = name.replace(' ', '_')
+        self.interval = 1 / hz
+        self.samples = collections.Counter()  # collapsed stack -> count
+        self.categories = collections.Counter()
+        self.running = threading.Event()
+        self.sampler = None
+        self.started = None
+        self.lock = threading.RLock()  # start/stop from the socket and signal threads
+
+    def install(self, socket_path=PROFILE_SOCKET):
+        asyncio.get_running_loop().add_signal_handler(signal.SIGUSR2, self.toggle_in_background)
+        if socket_path:
+            threading.Thread(target=self.serve, args=(socket_path,), name='profiler-control', daemon=True).start()
+        print(f"[DEBUG] Profiler: SIGUSR2 to pid {os.getpid()}{f' or {socket_path}' if socket_path else ''} starts and stops sampling at {1 / self.interval:.0f} Hz")
+
+    # signal handler on the event loop
+    def toggle_in_background(self):
+        threading.Thread(target=self.toggle, name='profiler-toggle', daemon=True).start()
+
+    def toggle(self):
+        with self.lock:
+            if self.running.is_set():
+                self.stop()
+            else:
+                self.start()
+
+    def start(self):
+        with self.lock:
+            if self.running.is_set():
+                return
+            self.samples.clear()
+            self.categories.clear()
+            self.started = time.time()
+            self.running.set()
+            self.sampler = threading.Thread(target=self.sample, name='profiler-sampler', daemon=True)
+            self.sampler.start()
+        print(f'[PROFILE] Sampling {self.name}')
+
+    def stop(self):
+        with self.lock:
+            if not self.running.is_set():
+                return None
+            self.running.clear()
+            if threading.current_thread() is not self.sampler:
+                self.sampler.join()
+            return self.write()
+
+    def status(self):
+        if not self.running.is_set():
+            return 'stopped'
+        return f'sampling for {time.time() - self.started:.1f} s, {sum(self.samples.values())} samples'
+
+    def sample(self):
+        me = threading.get_ident()
+        while self.running.is_set():
+            names = {thread.ident: thread.name for thread in threading.enumerate()}
+            for ident, frame in sys._current_frames().items():
+                name = names.get(ident, str(ident))
+                if ident == me or name.startswith('profiler-'):
+                    continue
+                frames = []
+                while frame is not None:
+                    frames.append((frame.f_code.co_filename, frame.f_code.co_name))
+                    frame = frame.f_back
+                frames.reverse()
+                self.samples[';'.join([name] + [f'{os.path.basename(filename)}:{function}' for filename, function in frames])] += 1
+                self.categories[stack_category(frames)] += 1
+            time.sleep(self.interval)
+
+    def write(self):
+        path = os.path.join(PROFILE_DIR, f"profile-{self.name}-{time.strftime('%Y%m%d-%H%M%S', time.localtime(self.started))}.folded")
+        with open(path, 'w') as f:
+            for stack, count in self.samples.most_common():
+                f.write(f'{stack} {count}\n')
+        total = sum(self.categories.values()) or 1
+        shares = '  '.join(f'{category} {count / total:.0%}' for category, count in self.categories.most_common())
+        print(f'[PROFILE] {self.name}: {total} samples over {time.time() - self.started:.1f} s: {shares}')
+        print(f'[PROFILE] Saved collapsed stacks to {path}')
+        return path
+
+    # one command per connection: start, stop or status
+    def serve(self, socket_path):
+        if os.path.exists(socket_path):
+            os.unlink(socket_path)
+        server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        server.bind(socket_path)
+        server.listen(1)
+        while True:
+            connection, _ = server.accept()
+            with connection:
+                # a client that hung up, or a profile that could not be written,
+                # must not end the control thread
+                try:
+                    command = connection.recv(64).decode('utf-8', 'replace').strip()
+                    if command == 'start':
+                        self.start()
+                        reply = self.status()
+                    elif command == 'stop':
+                        reply = self.stop() or 'not sampling'
+                    elif command == 'status':
+                        reply = self.status()
+                    else:
+                        reply = f'unknown command {command!r}; use start, stop or status'
+                    connection.sendall(f'{reply}\n'.encode('utf-8'))
+                except Exception as e:
+                    print(f'[ERROR] Profiler control: {e}')
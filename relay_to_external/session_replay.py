@@ -0,0 +1,271 @@
+#!/usr/bin/env python
+
+# Time-accurate replay of a recorded session.
+#
+# A session is a flight recorder dump (flight_recorder.py) or one or more
+# imu_data CSV files. A CSV window becomes a SYNACK, IMU_SAMPLES DATA frames
+# REPLAY_SAMPLE_MS apart and the IMU message the relay would have published,
+# with REPLAY_WINDOW_GAP_MS between windows.
+#
+#   python session_replay.py broker <session>...        publish the relay's broker messages again
+#   python session_replay.py ble glove <session>...     feed the BLE frames to the glove relay
+#
+# broker: every published message of the session goes out through
+# transport.py (REPLAY_TRANSPORT: 'local', the in-process broker stand-in, or
+# amqp / mqtt against BROKER), and a subscriber on '#' times its delivery.
+# With REPLAY_BIND=1 the AMQP transport binds the original queues (AI_QUEUE,
+# UPDATE_GE_QUEUE, ...) so the real consumers receive the messages.
+#
+# ble: the relay's ExtendedBLEConnection runs on a ReplayPeripheral that hands
+# out the recorded notifications in place of bluepy, and the frames the relay
+# writes are compared with the recorded ones. IMU windows and shots are taken
+# from the BLE side the way the server would; with REPLAY_WITH_SERVER=1 the
+# relay's RabbitMQ server runs instead, against BROKER.
+#
+# REPLAY_SPEED keeps the recorded inter-arrival times at 1, runs N times
+# faster at N, and as fast as possible at 0. The report gives how late events
+# were sent against their schedule, so a replay can be told apart from the
+# relay it drives.
+
+import asyncio
+import collections
+import importlib
+import json
+import os
+import sys
+import time
+
+import numpy as np
+
+import flight_recorder
+import leg_action_detector
+import myBle
+import priority_lanes
+import transport
+
+REPLAY_SPEED = float(os.getenv('REPLAY_SPEED', '1'))
+REPLAY_TRANSPORT = os.getenv('REPLAY_TRANSPORT', 'local')
+REPLAY_BIND = os.getenv('REPLAY_BIND', '0') == '1'
+REPLAY_WITH_SERVER = os.getenv('REPLAY_WITH_SERVER', '0') == '1'
+REPLAY_SAMPLE_MS = float(os.getenv('REPLAY_SAMPLE_MS', '20'))
+REPLAY_WINDOW_GAP_MS = float(os.getenv('REPLAY_WINDOW_GAP_MS', '1000'))
+REPLAY_PLAYER_ID = int(os.getenv('PLAYER_ID', '1'))
+
+AI_QUEUE = os.getenv('AI_QUEUE', 'ai_queue')
+UPDATE_GE_QUEUE = os.getenv('UPDATE_GE_QUEUE', 'update_ge_queue')
+IMU_SAMPLES = 59
+REPLAY_HEADER = 'x-replay-seq'
+IMU_AXES = ['ax', 'ay', 'az', 'gx', 'gy', 'gz']
+
+
+class ReplayFinished(Exception):
+    pass
+
+
+def frame(packetType, seq, payload=b''):
+    packet = packetType.encode('utf-8') + bytes([seq % 256]) + payload.ljust(myBle.PACKET_SIZE - 3, b'\0')
+    return packet + bytes([myBle.CRC8.checksum(packet)])
+
+
+# flight recorder records for the windows of a CSV, as the glove or leg relay would have seen them
+def csv_records(path, device, start_ns=0):
+    imu_dataset = leg_action_detector.load_imu_data_module('imu_dataset')
+    windows = imu_dataset.load_csv(path, IMU_SAMPLES)
+    records = []
+    ns = start_ns
+    records.append(flight_recorder.Record(0, ns, flight_recorder.BLE_RX, myBle.PACKET_SIZE, frame(myBle.SYNACK, 0)))
+    for window in windows:
+        for seq in range(IMU_SAMPLES):
+            ns += int(REPLAY_SAMPLE_MS * 1e6)
+            payload = window[:, seq].astype('<i2').tobytes()
+            records.append(flight_recorder.Record(0, ns, flight_recorder.BLE_RX, myBle.PACKET_SIZE, frame(myBle.DATA, seq, payload)))
+        message = {axis: window[i].tolist() for i, axis in enumerate(IMU_AXES)}
+        message.update(player_id=REPLAY_PLAYER_ID, imu_device=device)
+        body = AI_QUEUE.encode('utf-8') + b'\0' + json.dumps(message).encode('utf-8')
+        records.append(flight_recorder.Record(0, ns, flight_recorder.MQ_OUT, len(body), body))
+        ns += int(REPLAY_WINDOW_GAP_MS * 1e6)
+    return records
+
+
+def load_session(paths, device='glove'):
+    records = []
+    for path in paths:
+        startNs = records[-1].ns + int(REPLAY_WINDOW_GAP_MS * 1e6) if records else 0
+        if path.endswith('.csv'):
+            records += csv_records(path, device, startNs)
+        else:
+            _, dumped = flight_recorder.read_dump(path)
+            records += [record._replace(ns=record.ns - dumped[0].ns + startNs) for record in dumped] if dumped else []
+    return [record._replace(seq=i) for i, record in enumerate(records)]
+
+
+class Schedule:
+    def __init__(self, records, speed=REPLAY_SPEED):
+        self.originNs = records[0].ns if records else 0
+        self.speed = speed
+        self.start = None
+        self.lateMs = []
+
+    def begin(self):
+        self.start = time.monotonic()
+
+    def due(self, record):
+        if self.speed <= 0:
+            return self.start
+        return self.start + (record.ns - self.originNs) / 1e9 / self.speed
+
+    def sent(self, record):
+        self.lateMs.append((time.monotonic() - self.due(record)) * 1000)
+
+
+class ReplayPeripheral:
+    # frames: BLE_RX records, handed to the delegate on their schedule
+    def __init__(self, frames, schedule):
+        self.frames = collections.deque(frames)
+        self.schedule = schedule
+        self.delegate = None
+        self.written = []
+
+    def connect(self, macAddr):
+        if self.schedule.start is None:
+            self.schedule.begin()
+
+    def disconnect(self):
+        pass
+
+    def setDelegate(self, delegate):
+        self.delegate = delegate
+
+    def getServiceByUUID(self, uuid):
+        return self
+
+    def getCharacteristics(self, uuid):
+        return [self]
+
+    def write(self, packet):
+        self.written.append(packet)
+
+    # blocks like bluepy: up to timeout, or until the next frame is due
+    def waitForNotifications(self, timeout):
+        if not self.frames:
+            raise ReplayFinished()
+        wait = self.schedule.due(self.frames[0]) - time.monotonic()
+        if wait > timeout:
+            time.sleep(timeout)
+            return False
+        time.sleep(max(0, wait))
+        record = self.frames.popleft()
+        self.schedule.sent(record)
+        self.delegate.handleNotification(0, record.payload)
+        return True
+
+
+def packet_counts(packets):
+    return collections.Counter(chr(packet[0]) for packet in packets if packet)
+
+
+def print_timing(schedule, wall, records):
+    late = np.array(schedule.lateMs or [0.0])
+    recorded = (records[-1].ns - records[0].ns) / 1e9 if records else 0
+    print(f'[REPLAY] {len(schedule.lateMs)} events in {wall:.2f} s (recorded {recorded:.2f} s, speed {REPLAY_SPEED or "max"})')
+    print(f'[REPLAY] sent late by p50 {np.percentile(late, 50):.2f} ms  p99 {np.percentile(late, 99):.2f} ms  max {late.max():.2f} ms')
+
+
+async def replay_broker(records):
+    messages = [record for record in records if record.kind == flight_recorder.MQ_OUT]
+    publisher = transport.make_transport(REPLAY_TRANSPORT)
+    subscriber = transport.make_transport(REPLAY_TRANSPORT)
+    await publisher.connect()
+    await subscriber.connect()
+    routed = [(record, *record.payload.split(b'\0', 1)) for record in messages]
+    if REPLAY_BIND and REPLAY_TRANSPORT == 'amqp':
+        for queueName in sorted({key.decode('utf-8') for _, key, _ in routed}):
+            arguments = priority_lanes.ge_queue_arguments() if queueName == UPDATE_GE_QUEUE else None
+            await transport.bind_queue(publisher.channel, queueName, arguments=arguments)
+
+    sentAt = {}
+    deliveryMs = []
+
+    async def receive():
+        async for delivery in subscriber.subscribe('#'):
+            seq = delivery.headers.get(REPLAY_HEADER)
+            if seq is not None and int(seq) in sentAt:
+                deliveryMs.append((time.monotonic() - sentAt.pop(int(seq))) * 1000)
+
+    receiver = asyncio.create_task(receive())
+    await asyncio.sleep(0.2)
+    schedule = Schedule(messages)
+    schedule.begin()
+    for record, key, body in routed:
+        wait = schedule.due(record) - time.monotonic()
+        if wait > 0:
+            await asyncio.sleep(wait)
+        schedule.sent(record)
+        sentAt[record.seq] = time.monotonic()
+        if record.length > len(record.payload):
+            print(f'[REPLAY] Message {record.seq} to {key.decode("utf-8")} was truncated by the recorder ({record.length} bytes)')
+        await publisher.publish(key.decode('utf-8'), body, headers={REPLAY_HEADER: record.seq})
+    wall = time.monotonic() - schedule.start
+    await asyncio.sleep(1)
+    receiver.cancel()
+    await publisher.close()
+    await subscriber.close()
+
+    print_timing(schedule, wall, messages)
+    if deliveryMs:
+        delivery = np.array(deliveryMs)
+        print(f'[REPLAY] {len(delivery)} delivered over {publisher.name}: p50 {np.percentile(delivery, 50):.2f} ms  p99 {np.percentile(delivery, 99):.2f} ms  max {delivery.max():.2f} ms')
+    print(f'[REPLAY] {len(sentAt)} messages not delivered')
+
+
+async def replay_ble(device, records):
+    frames = [record for record in records if record.kind == flight_recorder.BLE_RX]
+    recordedWrites = [record.payload for record in records if record.kind == flight_recorder.BLE_TX]
+    schedule = Schedule(frames)
+    peripheral = ReplayPeripheral(frames, schedule)
+    myBle.Peripheral = lambda: peripheral
+
+    relay = importlib.import_module(f'{device}_beetle_server')
+    ble = relay.ExtendedBLEConnection(relay.MAC_ADDR, myBle.SERVICE_UUID, myBle.CHAR_UUID)
+    outputs = collections.Counter()
+
+    # what the server's send loops would take from the BLE side, every 0.1 s like them
+    async def drain():
+        getters = [name for name in ('get_imu_data', 'get_gun_action') if hasattr(relay, name)]
+        while True:
+            for name in getters:
+                result = getattr(relay, name)()
+                if name == 'get_imu_data':
+                    result = result[0]  # (window, trace)
+                if result is not None:
+                    outputs[name] += 1
+            await asyncio.sleep(0.1)
+
+    start = time.monotonic()
+    try:
+        if REPLAY_WITH_SERVER:
+            setattr(relay, f'{device}_beetle_server', getattr(relay, f'{device.capitalize()}BeetleServer')())
+            relay.ble1 = ble
+            await relay.main()
+        else:
+            await asyncio.gather(ble.run(), drain())
+    except ReplayFinished:
+        pass
+    wall = time.monotonic() - start
+
+    print_timing(schedule, wall, frames)
+    replayed, recorded = packet_counts(peripheral.written), packet_counts(recordedWrites)
+    for packetType in sorted(set(replayed) | set(recorded)):
+        print(f'[REPLAY] {packetType} frames written: {replayed[packetType]} (recorded {recorded[packetType]})')
+    for name, count in sorted(outputs.items()):
+        print(f'[REPLAY] {name}: {count}')
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3 or sys.argv[1] not in ('broker', 'ble') or (sys.argv[1] == 'ble' and len(sys.argv) < 4):
+        print('usage: session_replay.py broker <session>... | session_replay.py ble glove|leg|vest <session>...')
+        sys.exit(1)
+    if sys.argv[1] == 'broker':
+        asyncio.run(replay_broker(load_session(sys.argv[2:])))
+    else:
+        asyncio.run(replay_ble(sys.argv[2], load_session(sys.argv[3:], sys.argv[2])))
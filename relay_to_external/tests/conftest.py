@@ -0,0 +1,5 @@
+import os
+import sys
+
+# the tests import the relay modules the way the servers do, from their folder
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
@@ -0,0 +1,56 @@
+import os
+
+import pytest
+
+import activity_gate
+import leg_action_detector
+
+imu_dataset = leg_action_detector.load_imu_data_module('imu_dataset')
+
+NEW_DATA = os.path.join(leg_action_detector.IMU_DATA_DIR, 'new_data')
+# device: (new_data folder, samples per window), as the relays send them
+DEVICES = {'glove': ('hand', 59), 'leg': ('leg', 40)}
+
+
+def kept_share(gate, name):
+    folder, samples = DEVICES[gate.device]
+    windows = imu_dataset.load_csv(os.path.join(NEW_DATA, folder, f'{name}.csv'), samples)
+    return sum(gate.accept(window.tolist()) for window in windows) / len(windows)
+
+
+@pytest.mark.parametrize('device, name', [
+    ('glove', 'basket'), ('glove', 'bomb'), ('glove', 'bowl'), ('glove', 'logout'),
+    ('glove', 'raise_arm'), ('glove', 'reload'), ('glove', 'shield'), ('glove', 'volley'),
+    ('leg', 'soccer'),
+])
+def test_action_windows_pass(device, name):
+    # the calibration may drop at most ACTION_KEEP_PERCENTILE of a class
+    assert kept_share(activity_gate.ActivityGate(device), name) >= 1 - activity_gate.ACTION_KEEP_PERCENTILE / 100
+
+
+@pytest.mark.parametrize('device, name, most', [
+    ('glove', 'stationary', 0),
+    ('glove', 'shaking', 0.1),
+    ('leg', 'stationary_leg', 0.02),
+    ('leg', 'walk', 0),
+])
+def test_idle_windows_are_suppressed(device, name, most):
+    assert kept_share(activity_gate.ActivityGate(device), name) <= most
+
+
+@pytest.mark.parametrize('device', sorted(DEVICES))
+def test_default_bands_match_the_calibration(device):
+    folder, samples = DEVICES[device]
+    assert activity_gate.calibrate(os.path.join(NEW_DATA, folder), device, samples) == activity_gate.DEFAULT_BANDS[device]
+
+
+def test_per_device_overrides(monkeypatch):
+    monkeypatch.setenv('ACTIVITY_MIN_SCORE_GLOVE', '0')
+    monkeypatch.setenv('ACTIVITY_MAX_SCORE_GLOVE', '0')
+    glove = activity_gate.ActivityGate('glove')
+    leg = activity_gate.ActivityGate('leg')
+
+    # no bounds left on the glove: stationary and shaking windows pass
+    assert kept_share(glove, 'stationary') == 1
+    assert kept_share(glove, 'shaking') == 1
+    assert (leg.minScore, leg.maxScore) == activity_gate.DEFAULT_BANDS['leg']
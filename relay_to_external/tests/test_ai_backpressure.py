@@ -0,0 +1,89 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+
+import ai_backpressure
+from ai_backpressure import DOWNSAMPLE_DEPTH, DOWNSAMPLE_EVERY, DROP_DEPTH
+
+
+class FakeChannel:
+    # answers passive declares with the next (depth, consumers), or raises it;
+    # then an empty queue with one consumer
+    def __init__(self, counts):
+        self.counts = list(counts)
+        self.is_closed = False
+
+    async def declare_queue(self, name, passive):
+        assert passive
+        counts = self.counts.pop(0) if self.counts else (0, 1)
+        if isinstance(counts, Exception):
+            self.is_closed = True
+            raise counts
+        depth, consumers = counts
+        return SimpleNamespace(declaration_result=SimpleNamespace(message_count=depth, consumer_count=consumers))
+
+
+class FakeConnection:
+    def __init__(self, *channels):
+        self.channels = list(channels)
+
+    async def channel(self):
+        return self.channels.pop(0)
+
+
+def admitted(backpressure, windows):
+    return sum(backpressure.admit() for _ in range(windows))
+
+
+@pytest.mark.parametrize('depth, consumers, mode, sent', [
+    (0, 1, ai_backpressure.NORMAL, 8),
+    (DOWNSAMPLE_DEPTH - 1, 1, ai_backpressure.NORMAL, 8),
+    (DOWNSAMPLE_DEPTH, 1, ai_backpressure.DOWNSAMPLE, 8 // DOWNSAMPLE_EVERY),
+    (DROP_DEPTH - 1, 2, ai_backpressure.DOWNSAMPLE, 8 // DOWNSAMPLE_EVERY),
+    (DROP_DEPTH, 1, ai_backpressure.DROP, 0),
+    (0, 0, ai_backpressure.DROP, 0),
+])
+def test_mode_from_depth_and_consumers(depth, consumers, mode, sent):
+    backpressure = ai_backpressure.AiBackpressure('ai_queue')
+
+    backpressure.update(depth, consumers)
+
+    assert backpressure.mode == mode
+    assert admitted(backpressure, 8) == sent
+
+
+def test_modes_are_left_below_half_their_threshold():
+    backpressure = ai_backpressure.AiBackpressure('ai_queue')
+
+    backpressure.update(DROP_DEPTH, 1)
+    backpressure.update(DROP_DEPTH // 2, 1)
+    assert backpressure.mode == ai_backpressure.DROP
+    backpressure.update(DROP_DEPTH // 2 - 1, 1)
+    assert backpressure.mode == ai_backpressure.DOWNSAMPLE
+    backpressure.update(DOWNSAMPLE_DEPTH // 2, 1)
+    assert backpressure.mode == ai_backpressure.DOWNSAMPLE
+    backpressure.update(DOWNSAMPLE_DEPTH // 2 - 1, 1)
+    assert backpressure.mode == ai_backpressure.NORMAL
+
+
+def test_poll_reads_the_queue_and_survives_a_failed_declare(monkeypatch):
+    monkeypatch.setattr(ai_backpressure, 'BACKPRESSURE_POLL_MS', 0)
+    first = FakeChannel([(DOWNSAMPLE_DEPTH, 1), RuntimeError('channel closed')])
+    second = FakeChannel([(0, 0)])
+    backpressure = ai_backpressure.AiBackpressure('ai_queue')
+
+    async def poll():
+        await backpressure.start(FakeConnection(first, second))
+        modes = []
+        for _ in range(10):
+            await asyncio.sleep(0)
+            if not modes or modes[-1] != backpressure.mode:
+                modes.append(backpressure.mode)
+        backpressure.task.cancel()
+        return modes
+
+    modes = asyncio.run(poll())
+
+    assert modes == [ai_backpressure.DOWNSAMPLE, ai_backpressure.DROP, ai_backpressure.NORMAL]
+    assert backpressure.channel is second
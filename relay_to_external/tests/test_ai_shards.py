@@ -0,0 +1,71 @@
+import asyncio
+
+import ai_shards
+
+PLAYERS = [1, 2]
+
+
+class FakeQueue:
+    def __init__(self):
+        self.bound = set()
+
+    async def bind(self, exchange, routing_key):
+        self.bound.add(routing_key)
+
+    async def unbind(self, exchange, routing_key):
+        self.bound.discard(routing_key)
+
+
+class FakeChannel:
+    # one durable queue per name, like the broker keeps them across restarts
+    def __init__(self):
+        self.queues = {}
+
+    async def declare_exchange(self, name, kind, durable):
+        return name
+
+    async def declare_queue(self, name, durable, arguments):
+        return self.queues.setdefault(name, FakeQueue())
+
+
+def test_every_shard_has_exactly_one_owner():
+    for shardCount in (1, 2, 3, 4):
+        owners = {(p, d): ai_shards.shard_owner(p, d, shardCount, PLAYERS) for p in PLAYERS for d in ai_shards.DEVICES}
+        assert all(0 <= owner < shardCount for owner in owners.values())
+        # as many workers in use as there are shards to go round
+        assert len(set(owners.values())) == min(shardCount, len(owners))
+
+
+def test_gloves_are_dealt_out_first():
+    assert ai_shards.shard_owner(1, 'glove', 2, PLAYERS) == 0
+    assert ai_shards.shard_owner(2, 'glove', 2, PLAYERS) == 1
+    assert ai_shards.shard_owner(1, 'leg', 2, PLAYERS) == 0
+    assert ai_shards.shard_owner(2, 'leg', 2, PLAYERS) == 1
+
+
+def test_unknown_players_get_a_stable_owner():
+    owner = ai_shards.shard_owner(7, 'glove', 3, PLAYERS)
+    assert 0 <= owner < 3
+    assert ai_shards.shard_owner(7, 'glove', 3, PLAYERS) == owner
+
+
+def test_each_worker_binds_only_its_own_shards():
+    channel = FakeChannel()
+    for index in range(2):
+        asyncio.run(ai_shards.declare_shard_queue(channel, index, 2, PLAYERS))
+
+    assert channel.queues['ai_shard_0'].bound == {'imu.p1.glove', 'imu.p1.leg'}
+    assert channel.queues['ai_shard_1'].bound == {'imu.p2.glove', 'imu.p2.leg'}
+
+
+def test_shards_moved_to_another_worker_are_unbound():
+    channel = FakeChannel()
+    for index in range(2):
+        asyncio.run(ai_shards.declare_shard_queue(channel, index, 2, PLAYERS))
+    # down to one worker: it takes over every shard
+    asyncio.run(ai_shards.declare_shard_queue(channel, 0, 1, PLAYERS))
+    assert channel.queues['ai_shard_0'].bound == {ai_shards.routing_key(p, d) for p in PLAYERS for d in ai_shards.DEVICES}
+
+    # back to two workers: worker 0 drops the shards that went to worker 1
+    asyncio.run(ai_shards.declare_shard_queue(channel, 0, 2, PLAYERS))
+    assert channel.queues['ai_shard_0'].bound == {'imu.p1.glove', 'imu.p1.leg'}
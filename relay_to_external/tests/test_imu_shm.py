@@ -0,0 +1,83 @@
+import os
+import types
+
+import numpy as np
+import pytest
+
+import imu_shm
+
+SAMPLES = 4
+SLOTS = 4
+
+
+@pytest.fixture
+def ring(tmp_path, monkeypatch):
+    monkeypatch.setattr(imu_shm, 'FIFO_DIR', str(tmp_path))
+    # the reader stops its resource tracker unlinking the writer's segment; here both
+    # share one tracker, which the writer still needs for its own unlink
+    monkeypatch.setattr(imu_shm, 'resource_tracker', types.SimpleNamespace(unregister=lambda name, rtype: None))
+    player = os.getpid()  # ring names are system-wide
+    writer = imu_shm.ImuRingWriter(player, 'test', SAMPLES, slots=SLOTS)
+    reader = imu_shm.ImuRingReader(player, 'test')
+    yield writer, reader
+    reader.close()
+    writer.close()
+
+
+def window(value, samples=SAMPLES):
+    return [[value + axis] * samples for axis in range(imu_shm.IMU_AXES)]
+
+
+def test_write_without_consumer_falls_back(tmp_path, monkeypatch):
+    monkeypatch.setattr(imu_shm, 'FIFO_DIR', str(tmp_path))
+    writer = imu_shm.ImuRingWriter(os.getpid(), 'test', SAMPLES, slots=SLOTS)
+    try:
+        assert not writer.write(*window(1))
+    finally:
+        writer.close()
+
+
+def test_windows_are_read_in_order_and_padded(ring):
+    writer, reader = ring
+    assert writer.write(*window(10))
+    assert writer.write(*window(20, samples=2))
+
+    read = list(reader.read_available())
+    assert [seq for seq, _ in read] == [0, 1]
+    np.testing.assert_array_equal(read[0][1], np.array(window(10)))
+    np.testing.assert_array_equal(read[1][1][:, :2], np.array(window(20, samples=2)))
+    assert not read[1][1][:, 2:].any()
+    assert list(reader.read_available()) == []
+
+
+def test_overrun_drops_the_oldest_windows_and_is_counted(ring):
+    writer, reader = ring
+    for i in range(SLOTS + 3):
+        assert writer.write(*window(i))
+
+    assert writer.overruns == 3
+    read = list(reader.read_available())
+    assert [seq for seq, _ in read] == list(range(3, SLOTS + 3))
+    assert [int(w[0, 0]) for _, w in read] == list(range(3, SLOTS + 3))
+    assert reader.overruns == 3
+
+
+def test_slot_being_written_is_skipped_not_torn(ring):
+    writer, reader = ring
+    writer.write(*window(1))
+    writer.write(*window(2))
+    # the writer marks a slot before filling it and stamps its seq after
+    writer.slotSeq[0] = imu_shm.SLOT_WRITING
+
+    read = list(reader.read_available())
+    assert [seq for seq, _ in read] == [1]
+    assert reader.overruns == 1
+
+
+def test_reader_only_counts_windows_it_has_not_read(ring):
+    writer, reader = ring
+    for i in range(SLOTS):
+        writer.write(*window(i))
+    assert len(list(reader.read_available())) == SLOTS
+    writer.write(*window(SLOTS))
+    assert writer.overruns == 0
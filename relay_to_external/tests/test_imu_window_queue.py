@@ -0,0 +1,18 @@
+import pytest
+
+pytest.importorskip('bluepy')
+import glove_beetle_server
+import leg_beetle_server
+
+
+@pytest.mark.parametrize('server', [glove_beetle_server, leg_beetle_server])
+def test_full_window_queue_drops_the_oldest(server, monkeypatch):
+    monkeypatch.setattr(server, 'dataPacketQueue', server.collections.deque(maxlen=2))
+    monkeypatch.setitem(server.imuQueueStats, 'dropped', 0)
+    link = server.ExtendedBLEConnection.__new__(server.ExtendedBLEConnection)
+    for i in range(5):
+        server.dataPacket['imuCounter'] = i
+        link.finishImuData()
+
+    assert [packet['imuCounter'] for packet in server.dataPacketQueue] == [3, 4]
+    assert server.imuQueueStats['dropped'] == 3
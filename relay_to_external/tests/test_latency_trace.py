@@ -0,0 +1,72 @@
+from types import SimpleNamespace
+
+import pytest
+
+import latency_trace
+
+
+def received(properties):
+    # a delivery carrying the properties it was published with
+    return SimpleNamespace(correlation_id=properties.get('correlation_id'), headers=properties.get('headers'))
+
+
+def test_trace_survives_the_game_engine_round_trip():
+    trace = latency_trace.new_trace(2, 'glove')
+
+    action = received(latency_trace.message_properties(trace, 'gun'))
+    # the game engine copies the action's properties onto its broadcast
+    broadcast = received(latency_trace.forward_properties(action))
+
+    assert latency_trace.trace_of(broadcast) == (trace[0], trace[1], 'gun')
+
+
+def test_forwarding_can_set_the_action_type():
+    # an IMU window has no action type until the AI engine classified it
+    trace = latency_trace.new_trace(1, 'leg')
+    window = received(latency_trace.message_properties(trace, None))
+
+    action = received(latency_trace.forward_properties(window, 'soccer'))
+
+    assert latency_trace.trace_of(window) == (trace[0], trace[1], None)
+    assert latency_trace.trace_of(action) == (trace[0], trace[1], 'soccer')
+
+
+def test_mqtt_string_headers_are_read():
+    trace = latency_trace.new_trace(1, 'vest')
+    headers = {key: str(value) for key, value in latency_trace.message_properties(trace, 'gun')['headers'].items()}
+
+    assert latency_trace.trace_of(SimpleNamespace(correlation_id=trace[0], headers=headers)) == (trace[0], trace[1], 'gun')
+
+
+@pytest.mark.parametrize('player_id, device', [(0, 'glove'), (-1, 'glove'), ('1', 'glove'), (None, 'leg'), (1, 'gun')])
+def test_bad_origins_are_rejected(player_id, device):
+    with pytest.raises(ValueError):
+        latency_trace.new_trace(player_id, device)
+
+
+@pytest.mark.parametrize('correlation_id, headers', [
+    (None, {latency_trace.ORIGIN_HEADER: 1}),
+    ('p1-glove-0123456789ab', {}),
+    ('p1-glove-0123456789ab', {latency_trace.ORIGIN_HEADER: 'soon'}),
+    ('request-42', {latency_trace.ORIGIN_HEADER: 1}),
+    ('p0-glove-0123456789ab', {latency_trace.ORIGIN_HEADER: 1}),
+    ('p1-glove-0123456789ab-extra', {latency_trace.ORIGIN_HEADER: 1}),
+])
+def test_unknown_ids_are_not_traces(correlation_id, headers):
+    assert latency_trace.trace_of(SimpleNamespace(correlation_id=correlation_id, headers=headers)) is None
+
+
+def test_samples_are_bounded_and_counts_are_not(monkeypatch):
+    monkeypatch.setattr(latency_trace, 'LATENCY_SAMPLES', 5)
+    histograms = latency_trace.LatencyHistograms('test')
+
+    for i in range(8):
+        histograms.record('broadcast', (f'p1-glove-{i:012x}', 0, 'gun'), now_ns=(i + 1) * 10**6)
+    # every stage records an action once
+    assert histograms.record('broadcast', ('p1-glove-000000000000', 0, 'gun'), now_ns=10**9) is None
+
+    stats = histograms.summary()['broadcast/gun']
+    assert list(histograms.samples[('broadcast', 'gun')]) == [4, 5, 6, 7, 8]
+    assert stats['count'] == 8
+    assert sum(stats['bucket_counts']) == 8
+    assert stats['max_ms'] == 8
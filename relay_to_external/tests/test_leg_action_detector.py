@@ -0,0 +1,73 @@
+import asyncio
+import json
+import os
+
+import pytest
+
+import leg_action_detector
+
+imu_dataset = leg_action_detector.load_imu_data_module('imu_dataset')
+
+
+@pytest.fixture(scope='module')
+def detector():
+    return leg_action_detector.LegActionDetector()
+
+
+def recorded_windows(name, samples):
+    return imu_dataset.load_csv(os.path.join(leg_action_detector.LEG_DATA, f'{name}.csv'), samples)
+
+
+def test_recorded_kick_is_detected(detector):
+    window = recorded_windows('soccer', detector.samples)[0]
+
+    isKick, label, confidence = detector.detect(window.tolist())
+
+    assert isKick
+    assert label == leg_action_detector.KICK_ACTION
+    assert confidence >= leg_action_detector.KICK_CONFIDENCE
+
+
+@pytest.mark.parametrize('name', ['walk', 'run', 'stationary_leg'])
+def test_other_recordings_are_not_kicks(detector, name):
+    windows = recorded_windows(name, detector.samples)
+
+    kicks = [index for index, window in enumerate(windows) if detector.detect(window.tolist())[0]]
+
+    assert kicks == []
+
+
+class FakePublisher:
+    def __init__(self):
+        self.published = []
+
+    async def publish(self, lane, message_body, routing_key, exchange=None, **properties):
+        self.published.append((lane, json.loads(message_body)))
+
+
+def test_leg_server_publishes_kick_and_audit_copy(monkeypatch, detector):
+    pytest.importorskip('bluepy')
+    import leg_beetle_server
+
+    window = recorded_windows('soccer', detector.samples)[0]
+    server = leg_beetle_server.LegBeetleServer()
+    server.leg_detector = detector
+    server.publisher = FakePublisher()
+
+    def get_imu_data():
+        server.should_run = False
+        return window.tolist(), None
+
+    async def send_one_window():
+        await server.send_imu_data()
+        await asyncio.gather(*server.audit_tasks)
+
+    monkeypatch.setattr(leg_beetle_server, 'get_imu_data', get_imu_data)
+    asyncio.run(send_one_window())
+
+    (actionLane, action), (imuLane, imu) = server.publisher.published
+    assert actionLane == 'action'
+    assert action == {'action': True, 'action_type': leg_action_detector.KICK_ACTION, 'player_id': leg_beetle_server.PLAYER_ID}
+    assert imuLane == 'imu'
+    assert imu['audit'] is True
+    assert imu['ax'] == window[0].tolist()
@@ -0,0 +1,53 @@
+import asyncio
+import time
+
+import loop_monitor
+
+STALL_MS = 50
+
+
+def block_the_loop():
+    time.sleep(STALL_MS * 3 / 1000)
+
+
+async def blocking_task():
+    block_the_loop()
+
+
+def test_stall_is_attributed_to_the_blocking_function(monkeypatch):
+    monkeypatch.setattr(loop_monitor, 'LOOP_MONITOR_INTERVAL_MS', 5)
+    monkeypatch.setattr(loop_monitor, 'LOOP_STALL_MS', STALL_MS)
+    monitor = loop_monitor.LoopMonitor('test')
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.05)
+        await asyncio.create_task(blocking_task())
+        # the sentinel wakes up late and records the stall
+        await asyncio.sleep(0.05)
+        monitor.task.cancel()
+
+    asyncio.run(run())
+
+    stats = monitor.summary()
+    (holder, stall), = stats['stalls'].items()
+    assert holder.startswith('blocking_task > test_loop_monitor.py:')
+    assert holder.endswith(' block_the_loop')
+    assert stall['count'] == 1
+    assert stall['total_ms'] >= STALL_MS * 2
+    assert stats['max_ms'] >= STALL_MS * 2
+
+
+def test_quiet_loop_has_no_stalls(monkeypatch):
+    monkeypatch.setattr(loop_monitor, 'LOOP_MONITOR_INTERVAL_MS', 5)
+    monitor = loop_monitor.LoopMonitor('test')
+
+    async def run():
+        monitor.start()
+        await asyncio.sleep(0.1)
+        monitor.task.cancel()
+
+    asyncio.run(run())
+
+    assert monitor.summary()['stalls'] == {}
+    assert len(monitor.lags) > 0
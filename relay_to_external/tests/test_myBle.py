@@ -0,0 +1,145 @@
+import collections
+import types
+
+import pytest
+
+pytest.importorskip('bluepy')
+import myBle
+
+# a little over the retransmit interval, so float rounding of the clock cannot hold a resend back
+SYN_INTERVAL = myBle.SYN_RETRANSMIT_MS / 1000 + 0.001
+
+class FakeDevice:
+    # notifications queued by the test are delivered one per zero-timeout poll
+    def __init__(self):
+        self.delegate = myBle.MyDelegate()
+        self.notifications = collections.deque()
+        self.isDisconnected = False
+
+    def waitForNotifications(self, timeout):
+        if not self.notifications:
+            return False
+        self.delegate.handleNotification(0, self.notifications.popleft())
+        return True
+
+    def disconnect(self):
+        self.isDisconnected = True
+
+
+class FakeSerial:
+    def __init__(self):
+        self.written = []
+
+    def write(self, packet):
+        self.written.append(packet)
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [100.0]
+    monkeypatch.setattr(myBle, 'time', types.SimpleNamespace(monotonic=lambda: now[0]))
+    return now
+
+
+@pytest.fixture
+def link():
+    link = myBle.BLEConnection.__new__(myBle.BLEConnection)
+    link.device = FakeDevice()
+    link.beetleSerial = FakeSerial()
+    link.state = myBle.DISCONNECTED
+    link.synAttempts = 0
+    link.synSentAt = None
+    link.pendingUpdate = None
+    link.startHandshake(myBle.SYN_SENT)
+    return link
+
+
+def frame(packetType, seq=0):
+    packet = packetType.encode('utf-8') + bytes([seq]) + bytes(myBle.PACKET_SIZE - 3)
+    return packet + bytes([myBle.CRC8.checksum(packet)])
+
+
+def sent(link, packetType):
+    return [packet for packet in link.beetleSerial.written if packet[:1] == packetType.encode('utf-8')]
+
+
+def handshake(link):
+    status, statusQueue = {'isConnected': False}, []
+    return link.stepHandShake(0, status, statusQueue), status, statusQueue
+
+
+def test_syn_is_resent_every_retransmit_interval(link, clock):
+    handshake(link)
+    clock[0] += SYN_INTERVAL / 2
+    handshake(link)
+    assert len(sent(link, myBle.SYN)) == 1
+    clock[0] += SYN_INTERVAL / 2
+    handshake(link)
+    assert len(sent(link, myBle.SYN)) == 2
+
+
+def test_link_is_dropped_after_the_syn_limit(link, clock):
+    for _ in range(myBle.SYN_RETRANSMIT_LIMIT):
+        handshake(link)
+        clock[0] += SYN_INTERVAL
+    assert link.state == myBle.SYN_SENT
+
+    with pytest.raises(myBle.BTLEDisconnectError):
+        handshake(link)
+    assert len(sent(link, myBle.SYN)) == myBle.SYN_RETRANSMIT_LIMIT
+    assert link.state == myBle.DISCONNECTED
+    assert link.device.isDisconnected
+
+
+def test_synack_establishes_the_link(link, clock):
+    handshake(link)
+    link.device.notifications.append(frame(myBle.SYNACK))
+    isEstablished, status, statusQueue = handshake(link)
+
+    assert isEstablished
+    assert link.state == myBle.ESTABLISHED
+    assert len(sent(link, myBle.SYNACK)) == 1
+    assert statusQueue == [{'isConnected': True}]
+
+
+def established(link):
+    link.device.notifications.append(frame(myBle.SYNACK))
+    handshake(link)
+    link.beetleSerial.written.clear()
+    updatePacket = {'seq': 7}
+    queue = [{'bullets': 3, 'isReload': False}]
+    return updatePacket, queue
+
+
+def test_update_is_resent_until_the_limit_then_degrades(link, clock):
+    updatePacket, queue = established(link)
+    link.stepLink(updatePacket, queue, isGloveUpdate=True)
+    link.stepLink(updatePacket, queue, isGloveUpdate=True)
+    assert len(sent(link, myBle.UPDATE)) == 1  # ACK not overdue yet
+
+    for _ in range(myBle.UPDATE_RETRANSMIT_LIMIT):
+        clock[0] += myBle.ACK_TIMEOUT
+        link.stepLink(updatePacket, queue, isGloveUpdate=True)
+    assert len(sent(link, myBle.UPDATE)) == myBle.UPDATE_RETRANSMIT_LIMIT
+    assert link.state == myBle.DEGRADED
+    assert updatePacket['seq'] == 7
+
+
+def test_ack_of_the_update_returns_it_and_advances_the_seq(link, clock):
+    updatePacket, queue = established(link)
+    update = queue[0]
+    link.stepLink(updatePacket, queue, isGloveUpdate=True)
+
+    link.device.notifications.append(frame(myBle.ACK, seq=6))  # a late ACK of an earlier UPDATE
+    assert link.stepLink(updatePacket, queue, isGloveUpdate=True) is None
+    link.device.notifications.append(frame(myBle.ACK, seq=7))
+    assert link.stepLink(updatePacket, queue, isGloveUpdate=True) is update
+    assert updatePacket['seq'] == 8
+    assert link.pendingUpdate is None
+    assert link.state == myBle.ESTABLISHED
+
+
+def test_handshake_after_connecting_is_polled_less_often(link):
+    assert link.pollInterval() == myBle.HANDSHAKE_POLL_INTERVAL
+    link.setState(myBle.DEGRADED)
+    assert link.pollInterval() == myBle.POLL_INTERVAL
@@ -0,0 +1,112 @@
+from types import SimpleNamespace
+
+import pytest
+
+pytest.importorskip('bluepy')
+import glove_beetle_server as glove
+
+OTHER_PLAYER = glove.PLAYER_ID % 2 + 1
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = SimpleNamespace(now=100.0)
+    monkeypatch.setattr(glove, 'time', SimpleNamespace(monotonic=lambda: clock.now))
+    return clock
+
+
+@pytest.fixture
+def server(monkeypatch, clock):
+    monkeypatch.setattr(glove, 'OPTIMISTIC_AMMO', True)
+    monkeypatch.setattr(glove, 'pendingShots', glove.collections.deque())
+    monkeypatch.setattr(glove, 'updatePacketQueue', glove.collections.deque())
+    monkeypatch.setitem(glove.updatePacket, 'bullets', 6)
+    monkeypatch.setitem(glove.updatePacket, 'isReload', False)
+    return glove.GloveBeetleServer()
+
+
+def broadcast(server, bullets, action='gun', player_id=glove.PLAYER_ID):
+    message = SimpleNamespace(correlation_id=None, headers=None)
+    data = {'game_state': {f'p{glove.PLAYER_ID}': {'bullets': bullets}}, 'action': action, 'player_id': player_id}
+    server.handle_update(message, data)
+
+
+def sent_bullets():
+    # what the glove would be sent next, then nothing is pending
+    updates = [update['bullets'] for update in glove.updatePacketQueue]
+    glove.updatePacketQueue.clear()
+    return updates
+
+
+def test_confirmed_shot_needs_no_correction(server):
+    glove.shoot_optimistically()
+    assert sent_bullets() == [5]
+
+    broadcast(server, 5)
+
+    assert glove.updatePacket['bullets'] == 5
+    assert not glove.pendingShots
+    assert sent_bullets() == []
+
+
+def test_shot_at_zero_bullets_takes_nothing_off(server):
+    glove.updatePacket['bullets'] = 0
+
+    glove.shoot_optimistically()
+    assert glove.updatePacket['bullets'] == 0
+    assert sent_bullets() == []
+    assert len(glove.pendingShots) == 1
+
+    # the game engine rejects the shot and echoes it with 0 bullets
+    broadcast(server, 0)
+    assert not glove.pendingShots
+    assert glove.updatePacket['bullets'] == 0
+    assert sent_bullets() == []
+
+
+def test_broadcast_from_before_the_shots_keeps_them_taken_off(server):
+    glove.shoot_optimistically()
+    glove.shoot_optimistically()
+    assert glove.updatePacket['bullets'] == 4
+    sent_bullets()
+
+    # the other player's action was handled before our shots reached the engine
+    broadcast(server, 6, action='gun', player_id=OTHER_PLAYER)
+    assert glove.updatePacket['bullets'] == 4
+    broadcast(server, 5)
+    broadcast(server, 4)
+
+    assert glove.updatePacket['bullets'] == 4
+    assert not glove.pendingShots
+    assert sent_bullets() == []
+
+
+def test_reload_clears_pending_shots(server):
+    glove.shoot_optimistically()
+    glove.shoot_optimistically()
+    sent_bullets()
+
+    broadcast(server, 6, action='reload')
+
+    assert not glove.pendingShots
+    assert glove.updatePacket['bullets'] == 6
+    assert glove.updatePacket['isReload']
+    assert sent_bullets() == [6]
+    # the echoes of the shots fired before the reload find nothing to pop
+    broadcast(server, 6)
+    assert glove.updatePacket['bullets'] == 6
+
+
+def test_unconfirmed_shots_expire(server, clock):
+    glove.shoot_optimistically()
+    clock.now += glove.PENDING_SHOT_TIMEOUT / 2
+    glove.shoot_optimistically()
+    sent_bullets()
+
+    # the engine never saw the first shot
+    clock.now += glove.PENDING_SHOT_TIMEOUT * 0.75
+    broadcast(server, 6, action='gun', player_id=OTHER_PLAYER)
+
+    assert len(glove.pendingShots) == 1
+    assert glove.updatePacket['bullets'] == 5
+    assert sent_bullets() == [5]
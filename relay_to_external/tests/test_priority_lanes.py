@@ -0,0 +1,108 @@
+import asyncio
+
+import pytest
+
+import priority_lanes
+
+
+class FakeExchange:
+    # publishes wait for the gate, so a test can hold a lane mid-publish
+    def __init__(self, lane, published):
+        self.lane = lane
+        self.published = published
+        self.gate = asyncio.Event()
+        self.gate.set()
+
+    async def publish(self, message, routing_key):
+        await self.gate.wait()
+        self.published.append((self.lane, message.body))
+
+
+class FakeChannel:
+    def __init__(self, lane, published):
+        self.default_exchange = FakeExchange(lane, published)
+
+
+class FakeConnection:
+    # hands out one channel per lane, in the order LanePublisher opens them
+    def __init__(self):
+        self.published = []
+        self.lanes = iter(priority_lanes.LANES)
+
+    async def channel(self):
+        return FakeChannel(next(self.lanes), self.published)
+
+
+async def settle():
+    for _ in range(10):
+        await asyncio.sleep(0)
+
+
+def test_imu_lane_drops_the_oldest_windows():
+    async def fill_lane():
+        publisher = priority_lanes.LanePublisher(None)
+        # lanes without the worker, so nothing drains the IMU lane
+        publisher.lanes = {'imu': FakeChannel('imu', [])}
+        for i in range(priority_lanes.IMU_LANE_SIZE + 3):
+            await publisher.publish('imu', bytes([i]), 'ai_queue')
+        return publisher
+
+    publisher = asyncio.run(fill_lane())
+
+    held = []
+    while not publisher.imuQueue.empty():
+        held.append(publisher.imuQueue.get_nowait()[0].body[0])
+    assert held == list(range(3, priority_lanes.IMU_LANE_SIZE + 3))
+    assert publisher.imuDropped == 3
+
+
+def test_imu_windows_wait_while_an_action_is_publishing(monkeypatch):
+    monkeypatch.setattr(priority_lanes, 'PRIORITY_LANES', True)
+
+    async def publish_during_action():
+        connection = FakeConnection()
+        publisher = priority_lanes.LanePublisher(None)
+        await publisher.open(connection)
+        actionGate = publisher.lanes['action'].default_exchange.gate
+        actionGate.clear()
+
+        action = asyncio.create_task(publisher.publish('action', b'gun', 'update_ge_queue'))
+        await settle()
+        await publisher.publish('imu', b'window', 'ai_queue')
+        await publisher.publish('status', b'connected', 'update_ge_queue')
+        await settle()
+        before = list(connection.published)
+
+        actionGate.set()
+        await action
+        await settle()
+        await publisher.close()
+        return before, connection.published, publisher.imuDeferred
+
+    before, after, deferred = asyncio.run(publish_during_action())
+
+    # other lanes are not held up; the IMU window goes once the action is out
+    assert before == [('status', b'connected')]
+    assert after == [('status', b'connected'), ('action', b'gun'), ('imu', b'window')]
+    assert deferred == 1
+
+
+def test_without_lanes_everything_goes_on_the_channel(monkeypatch):
+    monkeypatch.setattr(priority_lanes, 'PRIORITY_LANES', False)
+    published = []
+
+    async def publish():
+        publisher = priority_lanes.LanePublisher(FakeChannel('channel', published))
+        await publisher.open(FakeConnection())
+        for lane in ('imu', 'action', 'status'):
+            await publisher.publish(lane, lane.encode(), 'queue')
+
+    asyncio.run(publish())
+
+    assert published == [('channel', b'imu'), ('channel', b'action'), ('channel', b'status')]
+
+
+@pytest.mark.parametrize('maxPriority, arguments', [(0, None), (10, {'x-max-priority': 10})])
+def test_ge_queue_arguments(monkeypatch, maxPriority, arguments):
+    monkeypatch.setattr(priority_lanes, 'UPDATE_GE_MAX_PRIORITY', maxPriority)
+    assert priority_lanes.ge_queue_arguments() == arguments
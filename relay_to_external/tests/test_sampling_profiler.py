@@ -0,0 +1,52 @@
+import os
+import socket
+import threading
+import time
+
+import pytest
+
+import sampling_profiler
+
+
+@pytest.fixture
+def control(tmp_path):
+    profiler = sampling_profiler.SamplingProfiler('test', hz=1000)
+    path = str(tmp_path / 'p.sock')
+    threading.Thread(target=profiler.serve, args=(path,), name='profiler-control', daemon=True).start()
+    for _ in range(100):
+        if os.path.exists(path):
+            break
+        time.sleep(0.01)
+
+    def send(command):
+        with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as client:
+            client.connect(path)
+            client.sendall(command.encode('utf-8'))
+            return client.makefile().read().strip()
+
+    yield send
+    profiler.running.clear()
+
+
+def test_start_and_stop_write_collapsed_stacks(monkeypatch, tmp_path, control):
+    monkeypatch.setattr(sampling_profiler, 'PROFILE_DIR', str(tmp_path))
+
+    assert control('start').startswith('sampling for')
+    time.sleep(0.05)
+    path = control('stop')
+
+    assert os.path.dirname(path) == str(tmp_path)
+    with open(path) as f:
+        assert f.read().strip()
+    assert control('status') == 'stopped'
+
+
+def test_failed_command_does_not_end_the_control_thread(monkeypatch, tmp_path, control):
+    monkeypatch.setattr(sampling_profiler, 'PROFILE_DIR', str(tmp_path / 'missing'))
+
+    control('start')
+    # the profile cannot be written; the client gets no reply
+    assert control('stop') == ''
+
+    assert control('status') == 'stopped'
+    assert control('bogus').startswith("unknown command 'bogus'")
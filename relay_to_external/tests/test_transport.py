@@ -0,0 +1,21 @@
+import pytest
+
+transport = pytest.importorskip('transport')  # needs aiomqtt and paho
+
+
+@pytest.mark.parametrize('pattern, topic, matches', [
+    ('update_everyone', 'update_everyone', True),
+    ('update_everyone', 'update_ge_queue', False),
+    ('imu.*.glove', 'imu.p1.glove', True),
+    ('imu.*.glove', 'imu.p1.leg', False),
+    ('imu.*', 'imu.p1.glove', False),
+    ('imu.#', 'imu', True),
+    ('imu.#', 'imu.p1.glove', True),
+    ('#', 'imu.p1.glove', True),
+    ('#.glove', 'imu.p1.glove', True),
+    ('imu.#.leg', 'imu.p1.glove', False),
+    ('*', '', True),
+    ('*', 'imu.p1', False),
+])
+def test_topic_matches_follows_amq_topic(pattern, topic, matches):
+    assert transport.topic_matches(pattern, topic) is matches
@@ -0,0 +1,79 @@
+import asyncio
+
+import update_consumer
+
+
+def burst(*broadcasts):
+    return [(f'message {i}', data) for i, data in enumerate(broadcasts)]
+
+
+def kept(handled):
+    return [message for message, _ in handled]
+
+
+def test_only_the_newest_game_state_is_kept():
+    handled = update_consumer.latest_wins(burst({'game_state': 1}, {'game_state': 2}, {'game_state': 3}))
+    assert kept(handled) == ['message 2']
+
+
+def test_broadcasts_the_relay_acts_on_are_kept():
+    handled = update_consumer.latest_wins(burst(
+        {'game_state': 1, 'action': 'reload', 'player_id': 1},
+        {'game_state': 2, 'update': True},
+        {'game_state': 3},
+    ))
+    assert kept(handled) == ['message 0', 'message 1', 'message 2']
+
+
+def test_custom_keep():
+    broadcasts = burst({'game_state': 1, 'action': 'gun', 'player_id': 2}, {'game_state': 2})
+    assert kept(update_consumer.latest_wins(broadcasts, keep=lambda data: data.get('player_id') == 1)) == ['message 1']
+
+
+def test_broadcasts_after_the_newest_game_state_and_invalid_ones_are_kept():
+    handled = update_consumer.latest_wins(burst({'game_state': 1}, None, {'game_state': 2}, {'other': True}))
+    assert kept(handled) == ['message 1', 'message 2', 'message 3']
+
+
+def test_burst_without_game_state_is_kept_whole():
+    assert kept(update_consumer.latest_wins(burst({'other': 1}, {'other': 2}))) == ['message 0', 'message 1']
+
+
+class FakeMessage:
+    def __init__(self, log, n, body):
+        self.log = log
+        self.n = n
+        self.routing_key = ''
+        self.body = body
+
+    async def ack(self, multiple=False):
+        self.log.append(('ack', self.n, multiple))
+
+    async def reject(self, requeue=False):
+        self.log.append(('reject', self.n))
+
+
+def acks(mode):
+    log = []
+
+    def handle(message, data):
+        if data.get('fail'):
+            raise RuntimeError('handler failed')
+
+    messages = [FakeMessage(log, 0, b'{"a": 1}'), FakeMessage(log, 1, b'{"fail": true}'),
+                FakeMessage(log, 2, b'not json'), FakeMessage(log, 3, b'{"a": 2}')]
+    consumer = update_consumer.UpdateConsumer(None, handle, mode=mode)
+    asyncio.run(consumer.handle_burst(messages))
+    return log
+
+
+def test_process_mode_rejects_failed_broadcasts():
+    assert acks('process') == [('ack', 0, False), ('reject', 1), ('reject', 2), ('ack', 3, False)]
+
+
+def test_batch_mode_acks_once_after_rejecting_failed_broadcasts():
+    assert acks('batch') == [('reject', 1), ('reject', 2), ('ack', 3, True)]
+
+
+def test_no_ack_mode_sends_nothing():
+    assert acks('no_ack') == []
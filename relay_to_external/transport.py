@@ -0,0 +1,238 @@
+#!/usr/bin/env python
+
+# Pluggable messaging transport: AMQP or MQTT behind one publish/subscribe interface.
+#
+#   transport = make_transport('mqtt')
+#   await transport.connect()
+#   await transport.publish('update_ge_queue', body, **latency_trace.message_properties(trace, 'gun'))
+#   async for delivery in transport.subscribe('update_everyone'):
+#       delivery.body, delivery.correlation_id, delivery.headers
+#   await transport.close()
+#
+# Both map a topic name onto the same place on a RabbitMQ broker with the MQTT
+# plugin enabled: the plugin publishes MQTT messages to amq.topic with the topic
+# as routing key, and AmqpTransport publishes and subscribes on TRANSPORT_EXCHANGE
+# (amq.topic by default). A queue such as UPDATE_GE_QUEUE receives a topic once it
+# is bound to that exchange with the topic as routing key (bind_queue).
+#
+# AMQP publishes wait for the broker's publisher confirm. MQTT publishes use
+# MQTT_QOS: 0 is fire-and-forget, 1 waits for the PUBACK. The correlation id and
+# headers of a trace travel as MQTT 5 correlation data and user properties, so
+# latency_trace.trace_of() works on deliveries from either transport.
+#
+# With TRANSPORT set the relays send everything for the game engine (actions
+# and connection status) to UPDATE_GE_QUEUE and read the game state broadcasts
+# from the topic UPDATE_EVERYONE_TOPIC instead of UPDATE_EVERYONE_EXCHANGE, so
+# the game engine has to publish its broadcasts there as well (as
+# game_engine_standin.py does with TRANSPORT set).
+#
+# An MQTT client has one stream of messages for all its subscriptions; one
+# reader task hands each message to the queue of every subscription it
+# matches, so several subscriptions can share a client.
+#
+# LocalTransport is an in-process broker stand-in with the same interface and
+# amq.topic's routing rules, for replays and tests without a broker.
+
+import asyncio
+import collections
+import math
+import os
+
+from dotenv import load_dotenv
+import aio_pika
+import aiomqtt
+from paho.mqtt.packettypes import PacketTypes
+from paho.mqtt.properties import Properties
+
+# Load environment variables from .env file
+load_dotenv()
+
+# Broker configurations
+BROKER = os.getenv('BROKER')
+BROKERUSER = os.getenv('BROKERUSER')
+PASSWORD = os.getenv('PASSWORD')
+RABBITMQ_PORT = int(os.getenv('RABBITMQ_PORT', '5672'))
+MQTT_PORT = int(os.getenv('MQTT_PORT', '1883'))
+
+# '' (the relays keep publishing through priority_lanes), 'amqp', 'mqtt' or 'local'
+TRANSPORT = os.getenv('TRANSPORT', '')
+TRANSPORT_EXCHANGE = os.getenv('TRANSPORT_EXCHANGE', 'amq.topic')
+MQTT_QOS = int(os.getenv('MQTT_QOS', '1'))
+UPDATE_EVERYONE_TOPIC = os.getenv('MQTT_TOPIC_UPDATE_EVERYONE', 'update_everyone')
+
+# a received message; has the attributes latency_trace.trace_of() reads
+Delivery = collections.namedtuple('Delivery', ['topic', 'body', 'correlation_id', 'headers'])
+
+
+class AmqpTransport:
+    name = 'amqp'
+
+    def __init__(self, host=BROKER, port=RABBITMQ_PORT):
+        self.host = host
+        self.port = port
+        self.connection = None
+        self.channel = None
+        self.exchange = None
+
+    async def connect(self):
+        self.connection = await aio_pika.connect_robust(
+            host=self.host,
+            port=self.port,
+            login=BROKERUSER,
+            password=PASSWORD,
+        )
+        self.channel = await self.connection.channel()
+        # amq.topic always exists; anything else is declared as a durable topic exchange
+        if TRANSPORT_EXCHANGE.startswith('amq.'):
+            self.exchange = await self.channel.get_exchange(TRANSPORT_EXCHANGE)
+        else:
+            self.exchange = await self.channel.declare_exchange(TRANSPORT_EXCHANGE, aio_pika.ExchangeType.TOPIC, durable=True)
+
+    # properties: keyword arguments for aio_pika.Message (correlation_id, headers, expiration, ...)
+    async def publish(self, topic, body, **properties):
+        await self.exchange.publish(aio_pika.Message(body=body, **properties), routing_key=topic)
+
+    async def subscribe(self, topic):
+        queue = await self.channel.declare_queue('', exclusive=True)
+        await queue.bind(self.exchange, routing_key=topic)
+        async with queue.iterator(no_ack=True) as queue_iter:
+            async for message in queue_iter:
+                yield Delivery(message.routing_key, message.body, message.correlation_id, message.headers or {})
+
+    async def close(self):
+        if self.connection is not None:
+            await self.connection.close()
+
+
+class MqttTransport:
+    def __init__(self, host=BROKER, port=MQTT_PORT, qos=MQTT_QOS):
+        self.host = host
+        self.port = port
+        self.qos = qos
+        self.name = f'mqtt qos{qos}'
+        self.client = None
+        self.subscriptions = []  # (topic filter, queue)
+        self.reader = None
+
+    async def connect(self):
+        self.client = aiomqtt.Client(
+            hostname=self.host,
+            port=self.port,
+            username=BROKERUSER,
+            password=PASSWORD,
+            protocol=aiomqtt.ProtocolVersion.V5,
+        )
+        await self.client.__aenter__()
+
+    # the subset of aio_pika.Message properties MQTT 5 can carry; priority is dropped
+    def publish_properties(self, correlation_id=None, headers=None, expiration=None, **_):
+        if correlation_id is None and not headers and expiration is None:
+            return None
+        properties = Properties(PacketTypes.PUBLISH)
+        if correlation_id is not None:
+            properties.CorrelationData = correlation_id.encode('utf-8')
+        if headers:
+            properties.UserProperty = [(key, str(value)) for key, value in headers.items()]
+        if expiration is not None:
+            properties.MessageExpiryInterval = max(1, math.ceil(expiration))
+        return properties
+
+    async def publish(self, topic, body, **properties):
+        await self.client.publish(topic, body, qos=self.qos, properties=self.publish_properties(**properties))
+
+    async def subscribe(self, topic):
+        queue = asyncio.Queue()
+        self.subscriptions.append((topic, queue))
+        if self.reader is None:
+            self.reader = asyncio.create_task(self.read())
+        await self.client.subscribe(topic, qos=self.qos)
+        try:
+            while True:
+                delivery = await queue.get()
+                if isinstance(delivery, Exception):
+                    raise delivery
+                yield delivery
+        finally:
+            self.subscriptions.remove((topic, queue))
+
+    # the single reader of the client's messages
+    async def read(self):
+        try:
+            async for message in self.client.messages:
+                properties = message.properties
+                correlationData = getattr(properties, 'CorrelationData', None)
+                headers = dict(getattr(properties, 'UserProperty', None) or [])
+                delivery = Delivery(message.topic.value, message.payload, correlationData.decode('utf-8') if correlationData else None, headers)
+                for topic, queue in self.subscriptions:
+                    if message.topic.matches(topic):
+                        queue.put_nowait(delivery)
+        except aiomqtt.MqttError as e:
+            # a lost connection ends every subscription
+            for _, queue in self.subscriptions:
+                queue.put_nowait(e)
+
+    async def close(self):
+        if self.reader is not None:
+            self.reader.cancel()
+        if self.client is not None:
+            await self.client.__aexit__(None, None, None)
+
+
+# amq.topic routing: words separated by '.', '*' matches one word and '#' any number
+def topic_matches(pattern, topic):
+    return words_match(pattern.split('.'), topic.split('.'))
+
+
+def words_match(pattern, words):
+    if not pattern:
+        return not words
+    if pattern[0] == '#':
+        return any(words_match(pattern[1:], words[i:]) for i in range(len(words) + 1))
+    return bool(words) and pattern[0] in ('*', words[0]) and words_match(pattern[1:], words[1:])
+
+
+class LocalTransport:
+    name = 'local'
+    # subscriptions of every LocalTransport in this process: (topic pattern, queue)
+    subscriptions = []
+
+    def __init__(self, host=None):
+        self.queues = []
+
+    async def connect(self):
+        pass
+
+    async def publish(self, topic, body, correlation_id=None, headers=None, **_):
+        # a broker hop is at least one pass through the loop
+        await asyncio.sleep(0)
+        for pattern, queue in LocalTransport.subscriptions:
+            if topic_matches(pattern, topic):
+                queue.put_nowait(Delivery(topic, body, correlation_id, dict(headers or {})))
+
+    async def subscribe(self, topic):
+        queue = asyncio.Queue()
+        LocalTransport.subscriptions.append((topic, queue))
+        self.queues.append(queue)
+        while True:
+            yield await queue.get()
+
+    async def close(self):
+        LocalTransport.subscriptions[:] = [(pattern, queue) for pattern, queue in LocalTransport.subscriptions if queue not in self.queues]
+
+
+# kind: 'amqp', 'mqtt' (MQTT_QOS), 'mqtt0', 'mqtt1' or 'local'
+def make_transport(kind=TRANSPORT, host=BROKER):
+    if kind == 'amqp':
+        return AmqpTransport(host)
+    if kind == 'local':
+        return LocalTransport()
+    if kind.startswith('mqtt'):
+        return MqttTransport(host, qos=int(kind[4:] or MQTT_QOS))
+    raise ValueError(f'Unknown transport {kind!r}')
+
+
+# route a topic into an AMQP queue, e.g. UPDATE_GE_QUEUE for actions published over MQTT
+async def bind_queue(channel, queue_name, topic=None, **arguments):
+    queue = await channel.declare_queue(queue_name, durable=True, **arguments)
+    await queue.bind(TRANSPORT_EXCHANGE, routing_key=topic or queue_name)
+    return queue
@@ -0,0 +1,125 @@
+#!/usr/bin/env python
+
+# Consumption of the game state broadcasts on UPDATE_EVERYONE_EXCHANGE.
+#
+# Every relay reads the fanout through its own exclusive, transient queue, so
+# an acknowledgement per broadcast buys nothing but a round trip. UPDATE_ACK_MODE:
+#   process  ack each broadcast once it has been handled (the old behaviour)
+#   batch    one multiple-ack per burst, or per UPDATE_ACK_BATCH broadcasts
+# In both, a broadcast that is not valid JSON or whose handler raised is
+# rejected (not requeued) instead, as message.process() did.
+#   no_ack   the broker considers a broadcast delivered as soon as it is sent
+# UPDATE_PREFETCH limits how many unacked broadcasts the broker pushes ahead
+# (0: no limit); it has no effect with no_ack.
+#
+# Broadcasts are handled in bursts: everything already delivered is taken at
+# once. With UPDATE_LATEST_WINS=1 a broadcast in a burst is skipped when a later
+# one carries a newer game state, unless the relay still has to act on it
+# (keep(data), e.g. a reload by this player or a status request).
+#
+# With TRANSPORT set (see transport.py) the broadcasts come from a transport
+# subscription instead (run_transport); those have no acknowledgements.
+
+import asyncio
+import json
+import os
+
+import flight_recorder
+
+UPDATE_ACK_MODE = os.getenv('UPDATE_ACK_MODE', 'process')
+UPDATE_PREFETCH = int(os.getenv('UPDATE_PREFETCH', '0'))
+UPDATE_ACK_BATCH = int(os.getenv('UPDATE_ACK_BATCH', '16'))
+UPDATE_LATEST_WINS = os.getenv('UPDATE_LATEST_WINS', '0') == '1'
+
+ACK_MODES = ('process', 'batch', 'no_ack')
+
+
+# broadcasts a relay acts on besides reading the game state
+def keep_actions(data):
+    return bool(data.get('update') or data.get('action'))
+
+
+# the broadcasts of a burst that have to be handled, in order
+def latest_wins(burst, keep=keep_actions):
+    lastState = max((i for i, (_, data) in enumerate(burst) if data is not None and 'game_state' in data), default=-1)
+    return [(message, data) for i, (message, data) in enumerate(burst) if i >= lastState or data is None or keep(data)]
+
+
+class UpdateConsumer:
+    # handle(message, data): called for every broadcast that is not skipped
+    def __init__(self, queue, handle, keep=keep_actions, mode=UPDATE_ACK_MODE):
+        if mode not in ACK_MODES:
+            raise ValueError(f'UPDATE_ACK_MODE must be one of {", ".join(ACK_MODES)}, not {mode!r}')
+        self.queue = queue
+        self.handle = handle
+        self.keep = keep
+        self.mode = mode
+        self.buffer = asyncio.Queue()
+        self.received = 0
+        self.skipped = 0
+        self.bursts = 0
+
+    async def run(self, channel):
+        if UPDATE_PREFETCH > 0 and self.mode != 'no_ack':
+            await channel.set_qos(prefetch_count=UPDATE_PREFETCH)
+        await self.queue.consume(self.buffer.put, no_ack=self.mode == 'no_ack')
+        print(f"[DEBUG] Consuming updates: {self.mode}, prefetch {UPDATE_PREFETCH or 'unlimited'}{', latest wins' if UPDATE_LATEST_WINS else ''}")
+        await self.drain()
+
+    async def run_transport(self, transport, topic):
+        self.mode = 'no_ack'
+        print(f"[DEBUG] Consuming updates: {transport.name} {topic}{', latest wins' if UPDATE_LATEST_WINS else ''}")
+        await asyncio.gather(self.feed(transport.subscribe(topic)), self.drain())
+
+    async def feed(self, deliveries):
+        async for delivery in deliveries:
+            self.buffer.put_nowait(delivery)
+
+    async def drain(self):
+        while True:
+            burst = [await self.buffer.get()]
+            while not self.buffer.empty():
+                burst.append(self.buffer.get_nowait())
+            await self.handle_burst(burst)
+
+    async def handle_burst(self, burst):
+        self.bursts += 1
+        self.received += len(burst)
+        if flight_recorder.recorder is not None:
+            for message in burst:
+                flight_recorder.recorder.consumed(getattr(message, 'routing_key', None) or getattr(message, 'topic', ''), message.body)
+        parsed = [(message, self.parse(message)) for message in burst]
+        handled = latest_wins(parsed, self.keep) if UPDATE_LATEST_WINS else parsed
+        if len(handled) < len(parsed):
+            self.skipped += len(parsed) - len(handled)
+            print(f'[DEBUG] Skipped {len(parsed) - len(handled)} superseded updates ({self.skipped} of {self.received} so far)')
+        handledMessages = {id(message) for message, _ in handled}
+        pendingAck = None  # the last broadcast of the batch not acked yet
+        for i, (message, data) in enumerate(parsed):
+            isFailed = data is None
+            if data is not None and id(message) in handledMessages:
+                try:
+                    self.handle(message, data)
+                except Exception as e:
+                    print(f'[ERROR] {e}')
+                    isFailed = True
+            if self.mode == 'no_ack':
+                continue
+            if isFailed:
+                await message.reject()
+            elif self.mode == 'process':
+                await message.ack()  # skipped broadcasts are acked as well
+            else:
+                pendingAck = message
+            # a multiple-ack does not cover broadcasts already rejected
+            if pendingAck is not None and ((i + 1) % UPDATE_ACK_BATCH == 0 or i == len(parsed) - 1):
+                await pendingAck.ack(multiple=True)
+                pendingAck = None
+
+    def parse(self, message):
+        payload = message.body.decode('utf-8')
+        try:
+            return json.loads(payload)
+        except json.JSONDecodeError:
+            print(f'[ERROR] Invalid JSON payload: {payload}')
+            return None
@@ -6,6 +6,12 @@ import os
 from dotenv import load_dotenv
 import aio_pika
 import collections
+import latency_trace
+import priority_lanes
+import loop_monitor
+import sampling_profiler
+import flight_recorder
+import update_consumer
 
 from bluepy.btle import BTLEDisconnectError
 import myBle
@@ -25,6 +31,12 @@ UPDATE_GE_QUEUE = os.getenv('UPDATE_GE_QUEUE', 'update_ge_queue')
 # RabbitMQ exchanges
 UPDATE_EVERYONE_EXCHANGE = os.getenv('UPDATE_EVERYONE_EXCHANGE', 'update_everyone_exchange')
 
+# Game engine messages and broadcasts go through transport.py when TRANSPORT is set;
+# it needs aiomqtt and paho, so it is only imported then
+TRANSPORT = os.getenv('TRANSPORT', '')
+if TRANSPORT:
+    import transport
+
 # Player ID this server is handling
 PLAYER_ID = int(os.getenv('PLAYER_ID', '2'))
 print(f'[DEBUG] Player ID: {PLAYER_ID}')
@@ -47,28 +59,31 @@ updatePacket = {
 connectionStatusQueue = collections.deque()
 updatePacketQueue = collections.deque()
 
+# Loop latency of the actions that caused each vest update
+latencyHistograms = latency_trace.LatencyHistograms(f'vest p{PLAYER_ID}')
+
 # BLE connection
 class ExtendedBLEConnection(myBle.BLEConnection):
     async def run(self):
         while True:
             try: 
                 self = ExtendedBLEConnection(MAC_ADDR, myBle.SERVICE_UUID, myBle.CHAR_UUID)
-                self.establishConnection()
-                self.isHandshakeRequire = True
+                await self.connect()
                 while True:
-                    self.device.delegate.isRxPacketReady = False
-                    if ((self.device.delegate.invalidPacketCounter >= 5) or self.isHandshakeRequire):
+                    if (self.device.delegate.invalidPacketCounter >= 5 and self.state == myBle.ESTABLISHED):
                         print(f"[BLE] >> Invalid Packet Counter Exceeded: {self.device.delegate.invalidPacketCounter}")
-                        self.isHandshakeRequire = not self.performHandShake(seq=0,connectionStatus=connectionStatus, connectionStatusQueue=connectionStatusQueue)
+                        self.degrade()
+                    if (self.state != myBle.ESTABLISHED):
+                        self.stepHandShake(seq=0, connectionStatus=connectionStatus, connectionStatusQueue=connectionStatusQueue)
                     else:
-                        if (len(updatePacketQueue) > 0):
-                            self.sendUPDATE(updatePacket, myUpdatePacket = updatePacketQueue.pop(), isVestUpdate=True)
-                        if (self.device.waitForNotifications(0.1) and self.device.delegate.isRxPacketReady):
-                            pass
-                    await asyncio.sleep(0.1)
+                        ackedUpdatePacket = self.stepLink(updatePacket, updatePacketQueue, isVestUpdate=True)
+                        if ackedUpdatePacket is not None:
+                            latencyHistograms.record('vest_update', ackedUpdatePacket.get('trace'))
+                    await asyncio.sleep(self.pollInterval())
 
             except BTLEDisconnectError:
                 print("[BLE] >> Disconnected.")
+                self.setState(myBle.DISCONNECTED)
                 if connectionStatus['isConnected']:
                     connectionStatus['isConnected'] = False
                     connectionStatusQueue.append(connectionStatus.copy())
@@ -79,23 +94,35 @@ class VestBeetleServer:
     def __init__(self):
         self.rabbitmq_connection = None
         self.channel = None
+        self.publisher = None
         self.should_run = True
         self.exchange = None
         self.update_queue = None
+        self.transport = transport.make_transport() if TRANSPORT else None
 
-    async def setup_rabbitmq(self):
-        print('[DEBUG] Connecting to RabbitMQ broker...')
-        self.rabbitmq_connection = await aio_pika.connect_robust(
+    async def connect(self):
+        return await aio_pika.connect_robust(
             host=BROKER,
             port=RABBITMQ_PORT,
             login=BROKERUSER,
             password=PASSWORD,
         )
+
+    async def setup_rabbitmq(self):
+        print('[DEBUG] Connecting to RabbitMQ broker...')
+        self.rabbitmq_connection = await self.connect()
         self.channel = await self.rabbitmq_connection.channel()
-        await self.channel.declare_queue(UPDATE_GE_QUEUE, durable=True)
-        self.exchange = await self.channel.declare_exchange(UPDATE_EVERYONE_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True)
-        self.update_queue = await self.channel.declare_queue('', exclusive=True)
-        await self.update_queue.bind(self.exchange)
+        self.publisher = priority_lanes.LanePublisher(self.channel)
+        await self.publisher.open(self.rabbitmq_connection, self.connect)
+        await self.channel.declare_queue(UPDATE_GE_QUEUE, durable=True, arguments=priority_lanes.ge_queue_arguments())
+        if self.transport is not None:
+            await self.transport.connect()
+            await transport.bind_queue(self.channel, UPDATE_GE_QUEUE, arguments=priority_lanes.ge_queue_arguments())
+            print(f'[DEBUG] Game engine messages and updates go over {self.transport.name}')
+        else:
+            self.exchange = await self.channel.declare_exchange(UPDATE_EVERYONE_EXCHANGE, aio_pika.ExchangeType.FANOUT, durable=True)
+            self.update_queue = await self.channel.declare_queue('', exclusive=True)
+            await self.update_queue.bind(self.exchange)
         print(f'[DEBUG] Connected to RabbitMQ broker at {BROKER}:{RABBITMQ_PORT}')
     
     async def send_connection_status(self):
@@ -113,53 +140,56 @@ class VestBeetleServer:
                     "f": True
                 }
                 message_body = json.dumps(message).encode('utf-8')
-                await self.channel.default_exchange.publish(
-                    aio_pika.Message(body=message_body),
-                    routing_key=UPDATE_GE_QUEUE,
-                )
+                await self.publish_ge('status', message_body)
                 print(f'[DEBUG] Published connection status to {UPDATE_GE_QUEUE}')
             await asyncio.sleep(0.1)
     
+    # messages for the game engine go through TRANSPORT when one is set, otherwise on their lane
+    async def publish_ge(self, lane, message_body, **properties):
+        if self.transport is not None:
+            if flight_recorder.recorder is not None:
+                flight_recorder.recorder.published(UPDATE_GE_QUEUE, message_body)
+            await self.transport.publish(UPDATE_GE_QUEUE, message_body, priority=priority_lanes.LANES[lane], **properties)
+        else:
+            await self.publisher.publish(lane, message_body, UPDATE_GE_QUEUE, **properties)
+
+    def handle_update(self, message, data):
+        print(f'[DEBUG] Received update: {data}')
+        toupdate = data.get('update', False)
+        if toupdate:
+            connectionStatusQueue.append(connectionStatus.copy())
+
+        game_state = data.get('game_state', {})
+        action = data.get('action', None)
+        player_id_for_action = data.get('player_id', None)
+        player_key = f'p{PLAYER_ID}'
+        trace = latency_trace.trace_of(message)
+        latencyHistograms.record('broadcast', trace)
+
+        hp = game_state.get(player_key, {}).get('hp', None)
+        shield_hp = game_state.get(player_key, {}).get('shield_hp', None)
+
+        if hp is not None and shield_hp is not None:
+            updatePacket['hp'] = hp
+            updatePacket['shield_hp'] = shield_hp
+            gotHit = game_state.get(f'p{player_id_for_action}', {}).get('opponent_hit', False) or game_state.get(f'p{player_id_for_action}', {}).get('opponent_shield_hit', False)
+
+            if action is None:
+                updatePacket['action_type'] = 0
+            else:
+                if player_id_for_action == PLAYER_ID and action == 'shield': 
+                    updatePacket['action_type'] = 2
+                elif player_id_for_action != PLAYER_ID and gotHit:
+                    updatePacket['action_type'] = 1
+            updatePacketQueue.append(dict(updatePacket, trace=trace))
+
     async def consume_updates(self):
-        async with self.update_queue.iterator() as queue_iter:
-            async for message in queue_iter:
-                async with message.process():
-                    payload = message.body.decode('utf-8')
-                    try:
-                        data = json.loads(payload)
-                        print(f'[DEBUG] Received RabbitMQ payload: {data}')
-                        
-                        toupdate = data.get('update', False)
-                        if toupdate:
-                            connectionStatusQueue.append(connectionStatus.copy())
-                            
-                        game_state = data.get('game_state', {})
-                        action = data.get('action', None)
-                        player_id_for_action = data.get('player_id', None)
-                        player_key = f'p{PLAYER_ID}'
-                        
-                        hp = game_state.get(player_key, {}).get('hp', None)
-                        shield_hp = game_state.get(player_key, {}).get('shield_hp', None)
-                        
-                        if hp is not None and shield_hp is not None:
-                            updatePacket['hp'] = hp
-                            updatePacket['shield_hp'] = shield_hp
-                            gotHit = game_state.get(f'p{player_id_for_action}', {}).get('opponent_hit', False) or game_state.get(f'p{player_id_for_action}', {}).get('opponent_shield_hit', False)
-                            
-                            if action is None:
-                                updatePacket['action_type'] = 0
-                            else:
-                                if player_id_for_action == PLAYER_ID and action == 'shield': 
-                                    updatePacket['action_type'] = 2
-                                elif player_id_for_action != PLAYER_ID and gotHit:
-                                    updatePacket['action_type'] = 1
-                            updatePacketQueue.append(updatePacket.copy())
-                    
-                    except json.JSONDecodeError:
-                        print(f'[ERROR] Invalid JSON payload: {payload}')
-                    except Exception as e:
-                        print(f'[ERROR] {e}')
-            
+        consumer = update_consumer.UpdateConsumer(self.update_queue, self.handle_update, update_consumer.keep_actions)
+        if self.transport is not None:
+            await consumer.run_transport(self.transport, transport.UPDATE_EVERYONE_TOPIC)
+        else:
+            await consumer.run(self.channel)
+
     async def run(self):
         await self.setup_rabbitmq()
 
@@ -169,7 +199,16 @@ class VestBeetleServer:
         )
             
 
+loopMonitor = loop_monitor.LoopMonitor(f'vest p{PLAYER_ID}')
+profiler = sampling_profiler.SamplingProfiler(f'vest p{PLAYER_ID}')
+
 async def main():
+    if loop_monitor.LOOP_MONITOR:
+        loopMonitor.start()
+    if sampling_profiler.PROFILER:
+        profiler.install()
+    if flight_recorder.recorder is not None:
+        flight_recorder.recorder.install(f'vest p{PLAYER_ID}')
     await asyncio.gather(vest_beetle_server.run(),ble1.run())
 
 if __name__ == '__main__':
@@ -181,4 +220,10 @@ if __name__ == '__main__':
         print('[DEBUG] Vest Beetle Server stopped by user')
         vest_beetle_server.should_run = False
     except Exception as e:
-        print(f'[ERROR] {e}')
\ No newline at end of file
+        print(f'[ERROR] {e}')
+        if flight_recorder.recorder is not None:
+            flight_recorder.recorder.dump('crash')
+    finally:
+        loopMonitor.save()
+        profiler.stop()
+        latencyHistograms.save()
\ No newline at end of file